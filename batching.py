@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+from models import loads
+from operations import FRAGMENTS, OPERATIONS
+
+
+# operations issued within a short window are sent as one http request:
+# either one document with an aliased field per call ("alias"), or a json
+# array of ordinary payloads for servers that accept array batches ("array").
+# every caller still gets a response shaped like its own single request.
+
+BATCHABLE = ('AddReaction', 'CreateMirrorViaDispatcher', 'Profile')
+
+
+class BatchError(Exception):
+    pass
+
+
+class PendingCall:
+    def __init__(self, operation, variables, future):
+        self.operation = operation
+        self.variables = variables
+        self.future = future
+
+
+class GraphQLBatcher:
+    def __init__(self, window=0.01, max_batch=20, mode="alias"):
+        if mode not in ("alias", "array"):
+            raise ValueError(f"unknown batch mode {mode!r}, expected 'alias' or 'array'")
+        self.window = window
+        self.max_batch = max_batch
+        self.mode = mode
+        self.pending = {}
+        self.batches = 0
+        self.calls = 0
+
+    async def execute(self, lens, operation_name, variables, headers):
+        # queue one call and wait for its share of the batched response
+        operation = OPERATIONS[operation_name]
+        # calls can only share a request when they go to the same place with the same token,
+        # and queries and mutations never share a document
+        key = (lens.url, headers.get('x-access-token'), operation.kind)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if key not in self.pending:
+            timer = loop.call_later(self.window, self._start_flush, lens, key, headers)
+            self.pending[key] = ([], timer)
+        batch, timer = self.pending[key]
+        batch.append(PendingCall(operation, variables, future))
+        if len(batch) >= self.max_batch:
+            timer.cancel()
+            self._start_flush(lens, key, headers)
+        return await future
+
+    def _start_flush(self, lens, key, headers):
+        batch, _ = self.pending.pop(key)
+        asyncio.ensure_future(self.flush(lens, key, headers, batch))
+
+    async def flush(self, lens, key, headers, batch):
+        self.batches += 1
+        self.calls += len(batch)
+        try:
+            if self.mode == "array":
+                results = await self._send_array(lens, key, headers, batch)
+            else:
+                results = await self._send_aliased(lens, key, headers, batch)
+        except Exception as e:
+            for call in batch:
+                if not call.future.done():
+                    call.future.set_exception(e)
+            return
+        for call, result in zip(batch, results):
+            if not call.future.done():
+                call.future.set_result(result)
+
+    async def _post(self, lens, key, headers, body):
+        mutation = key[2] == 'mutation'
+        account = lens.address if key[1] else None
+        response = await lens.scheduler.request(lens.get_session(), 'POST', lens.url, account=account,
+                                                idempotent=not mutation, headers=headers, data=body)
+        async with response:
+            if response.status != 200:
+                raise BatchError(f"batch of {key[2]} failed: {response.status}")
+            return loads(await response.read())
+
+    async def _send_array(self, lens, key, headers, batch):
+        body = b'[' + b','.join(call.operation.payload(call.variables) for call in batch) + b']'
+        data = await self._post(lens, key, headers, body)
+        if not isinstance(data, list) or len(data) != len(batch):
+            raise BatchError(f"server did not answer the array batch: {str(data)[:200]}")
+        return data
+
+    async def _send_aliased(self, lens, key, headers, batch):
+        definitions = []
+        selections = []
+        fragments = []
+        variables = {}
+        for index, call in enumerate(batch):
+            alias = f"a{index}"
+            call_definitions, selection = call.operation.aliased(alias)
+            if call_definitions:
+                definitions.append(call_definitions)
+            selections.append(selection)
+            fragments.extend(name for name in call.operation.fragments if name not in fragments)
+            variables.update({f"{name}_{alias}": value for name, value in call.variables.items()})
+        header = f"{key[2]} Batch({', '.join(definitions)})" if definitions else f"{key[2]} Batch"
+        document = "\n\n".join([header + " {\n  " + "\n  ".join(selections) + "\n}"] +
+                               [FRAGMENTS[name].strip() for name in fragments])
+        body = json.dumps({"operationName": "Batch", "query": document, "variables": variables},
+                          separators=(',', ':')).encode()
+        data = await self._post(lens, key, headers, body)
+
+        # split the answer back into one response per call, errors go to the call they belong to
+        fields = data.get('data') or {}
+        errors = data.get('errors') or []
+        results = []
+        for index, call in enumerate(batch):
+            alias = f"a{index}"
+            result = {"data": {call.operation.root_field: fields.get(alias)}}
+            call_errors = [error for error in errors
+                           if not error.get('path') or error['path'][0] == alias]
+            if call_errors:
+                result["errors"] = call_errors
+                if alias not in fields:
+                    result["data"] = None
+            results.append(result)
+        return results
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from batching import GraphQLBatcher
+from ledger import ActionLedger
+from lens import Lens
+from mockserver import start_server
+from scheduler import RequestScheduler
+
+# python -m benchmarks.bench_batching --likes 100 --latency 0.05
+
+PRIVATE_KEY = "0x" + "11" * 32
+
+
+async def like_all(lens, publication_ids):
+    # a fresh ledger, every run sends all of its likes
+    lens.ledger = ActionLedger()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(lens.like(publication_id) for publication_id in publication_ids))
+    return time.perf_counter() - start, sum(results)
+
+
+async def main(likes, latency, window, max_batch):
+    runner, url = await start_server(latency=latency)
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None)
+    lens = Lens(PRIVATE_KEY, login=False, url=url)
+    publication_ids = [f"0x01-0x{index:04x}" for index in range(likes)]
+    rows = []
+    try:
+        async with lens:
+            await lens.ensure_login()
+            with contextlib.redirect_stdout(io.StringIO()):
+                # one request per like, the way the bot has always done it
+                lens.batching = False
+                rows.append(("one request per like", likes) + await like_all(lens, publication_ids))
+                for mode in ("alias", "array"):
+                    lens.batching = True
+                    lens.batcher = GraphQLBatcher(window=window, max_batch=max_batch, mode=mode)
+                    elapsed, ok = await like_all(lens, publication_ids)
+                    rows.append((f"batched, {mode}", lens.batcher.batches, elapsed, ok))
+    finally:
+        await runner.cleanup()
+
+    print(f"{likes} likes, {latency * 1000:.0f}ms mock server latency, {window * 1000:.0f}ms window, "
+          f"up to {max_batch} per batch")
+    print(f"{'':22} {'requests':>8} {'seconds':>8} {'likes/s':>8} {'ok':>5}")
+    for name, requests, elapsed, ok in rows:
+        print(f"{name:22} {requests:>8} {elapsed:>8.3f} {likes / elapsed:>8.0f} {ok:>5}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--likes", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--window", type=float, default=0.01)
+    parser.add_argument("--max-batch", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.likes, args.latency, args.window, args.max_batch))
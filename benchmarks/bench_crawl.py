@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import resource
+import tempfile
+import time
+
+from crawler import Crawler
+from lens import Lens
+from mockserver import start_server
+from scheduler import RequestScheduler
+
+# crawl the mock server's graph, every profile there has 200 followers and follows 200
+#
+#   python -m benchmarks.bench_crawl --depth 2 --degree 100 --concurrency 1 8 32
+
+
+async def crawl(url, path, depth, degree, concurrency):
+    lens = Lens("0x" + "11" * 32, login=False, url=url, metadata_url=url + "metadata/")
+    crawler = Crawler(lens, path, max_depth=depth, concurrency=concurrency, max_degree=degree)
+    with contextlib.redirect_stdout(io.StringIO()):
+        await crawler.seed_account()
+        start = time.perf_counter()
+        counts = await crawler.crawl()
+        elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    candidates = crawler.candidates(limit=20)
+    ranking = time.perf_counter() - start
+    crawler.close()
+    return counts, elapsed, ranking, candidates
+
+
+async def main(depth, degree, latency, concurrency_levels):
+    runner, url = await start_server(latency=latency)
+    # measure the crawl, not the rate limits
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None)
+    rows = []
+    try:
+        for concurrency in concurrency_levels:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "graph.sqlite")
+                counts, elapsed, ranking, candidates = await crawl(url, path, depth, degree, concurrency)
+                size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            rows.append((concurrency, counts, elapsed, ranking, size))
+    finally:
+        await Lens.close_session()
+        await runner.cleanup()
+
+    print(f"depth {depth}, {degree} followers and {degree} following per profile, "
+          f"{latency * 1000:.0f}ms mock server latency")
+    print(f"{'in flight':>10} {'profiles':>9} {'expanded':>9} {'edges':>8} {'expanded/s':>11} {'seconds':>8} "
+          f"{'ranking ms':>11} {'db MB':>6}")
+    for concurrency, counts, elapsed, ranking, size in rows:
+        profiles = counts["pending"] + counts["expanded"]
+        print(f"{concurrency:>10} {profiles:>9} {counts['expanded']:>9} {counts['edges']:>8} "
+              f"{counts['expanded'] / elapsed:>11.0f} {elapsed:>8.2f} {ranking * 1000:>11.1f} {size / 1e6:>6.1f}")
+    print(f"top candidates: {candidates[:5]}")
+    print(f"peak rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--degree", type=int, default=100, help="followers and following read per profile")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+    asyncio.run(main(args.depth, args.degree, args.latency, args.concurrency))
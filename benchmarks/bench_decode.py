@@ -0,0 +1,122 @@
+import argparse
+import json
+import time
+
+import models
+from mockserver import profile
+
+# decoding a big response: what response.json() did, the fast backend, and the fast backend
+# reading the same field through result objects. the objects are views of the decoded items, they
+# are there for convenience and should cost about what the dicts do, not save anything
+#
+#   python -m benchmarks.bench_decode --items 50
+#   python -m benchmarks.bench_decode --response timeline.json --kind timeline   # a recorded response
+
+
+def full_profile(index):
+    # shaped like ProfileFields, the mock server keeps its profiles smaller
+    data = profile(index)
+    data.update({
+        "bio": "gm " * 40,
+        "attributes": [{"key": key, "value": f"{key} of {index}", "__typename": "Attribute"}
+                       for key in ("location", "website", "twitter", "app")],
+        "picture": {"original": {"url": f"ipfs://bafybeig{index:052d}", "__typename": "Media"},
+                    "__typename": "MediaSet"},
+        "followModule": None,
+    })
+    return data
+
+
+def full_publication(index):
+    # shaped like PostFields
+    return {
+        "id": f"0x01-0x{index:04x}", "__typename": "Post", "profile": full_profile(index % 50),
+        "reaction": None, "mirrors": [], "hasCollectedByMe": False,
+        "onChainContentURI": f"ar://{index:043d}", "isGated": False,
+        "canComment": {"result": True, "__typename": "CanCommentResponse"},
+        "canMirror": {"result": True, "__typename": "CanMirrorResponse"},
+        "canDecrypt": {"result": False, "reasons": None, "__typename": "CanDecryptResponse"},
+        "collectModule": {"__typename": "FreeCollectModuleSettings", "type": "FreeCollectModule",
+                          "contractAddress": "0x" + "23" * 20, "followerOnly": False},
+        "stats": {"totalUpvotes": index, "totalAmountOfMirrors": 3, "totalAmountOfCollects": 1,
+                  "totalAmountOfComments": 7, "__typename": "PublicationStats"},
+        "metadata": {"name": f"Post by @mock{index}.lens", "description": "lorem ipsum " * 30,
+                     "content": "lorem ipsum " * 30, "image": None,
+                     "attributes": [{"traitType": "type", "value": "text_only",
+                                     "__typename": "MetadataAttributeOutput"}],
+                     "media": [{"original": {"url": f"ipfs://bafy{index:056d}", "mimeType": "image/png",
+                                            "__typename": "Media"}, "__typename": "MediaSet"}],
+                     "__typename": "MetadataOutput"},
+        "hidden": False, "createdAt": "2022-11-01T00:00:00.000Z", "appId": "Lenster",
+    }
+
+
+def timeline_page(items):
+    return {"data": {"feed": {"items": [{"root": full_publication(index), "electedMirror": None, "mirrors": [],
+                                         "collects": [], "reactions": [], "comments": [],
+                                         "__typename": "FeedItem"} for index in range(items)],
+                              "pageInfo": {"next": "cursor", "__typename": "PaginatedResultInfo"}}}}
+
+
+def followers_page(items):
+    return {"data": {"followers": {"items": [{"wallet": {"address": f"0x{index:040x}",
+                                                         "defaultProfile": full_profile(index)},
+                                              "totalAmountOfTimesFollowed": 1} for index in range(items)],
+                                   "pageInfo": {"next": "cursor", "__typename": "PaginatedResultInfo"}}}}
+
+
+DECODERS = {
+    # what every method did: aiohttp decodes the text with json.loads, then dicts all the way
+    "timeline": (
+        ("json + dicts", lambda body: [item['root']['id'] for item in
+                                       json.loads(body.decode())['data']['feed']['items']]),
+        ("fast backend + dicts", lambda body: [item['root']['id'] for item in
+                                               models.loads(body)['data']['feed']['items']]),
+        ("fast backend + objects", lambda body: [models.feed_item(item).id for item in
+                                                 models.loads(body)['data']['feed']['items']]),
+    ),
+    "followers": (
+        ("json + dicts", lambda body: [item['wallet']['defaultProfile']['handle'] for item in
+                                       json.loads(body.decode())['data']['followers']['items']]),
+        ("fast backend + dicts", lambda body: [item['wallet']['defaultProfile']['handle'] for item in
+                                               models.loads(body)['data']['followers']['items']]),
+        ("fast backend + objects", lambda body: [models.follower(item).handle for item in
+                                                 models.loads(body)['data']['followers']['items']]),
+    ),
+}
+
+
+def measure(decode, body, seconds):
+    runs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        decode(body)
+        runs += 1
+    return (time.perf_counter() - start) / runs
+
+
+def main(items, kinds, response, seconds):
+    print(f"fast backend: {models.loads.__module__}")
+    for kind in kinds:
+        if response:
+            with open(response, 'rb') as f:
+                body = f.read()
+        else:
+            body = json.dumps(timeline_page(items) if kind == "timeline" else followers_page(items)).encode()
+        print(f"{kind}: {len(body) / 1024:.0f} KB")
+        print(f"  {'':24} {'ms/page':>8} {'MB/s':>7}")
+        baseline = None
+        for name, decode in DECODERS[kind]:
+            elapsed = measure(decode, body, seconds)
+            baseline = baseline or elapsed
+            print(f"  {name:24} {elapsed * 1000:>8.3f} {len(body) / elapsed / 1e6:>7.0f}  ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50, help="items per generated page")
+    parser.add_argument("--kind", choices=sorted(DECODERS), nargs="+", default=sorted(DECODERS))
+    parser.add_argument("--response", help="recorded response body to decode instead of a generated page")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each decoder")
+    args = parser.parse_args()
+    main(args.items, args.kind, args.response, args.seconds)
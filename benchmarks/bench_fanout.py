@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+from fanout import Action, run_batch
+from ledger import ActionLedger
+from lens import Lens
+from mockserver import start_server
+from scheduler import RequestScheduler
+
+# python -m benchmarks.bench_fanout --accounts 200 --latency 0.05
+
+
+def make_keys(count):
+    return ["0x" + f"{index + 1:064x}" for index in range(count)]
+
+
+async def main(accounts, latency, concurrency_levels, per_account):
+    runner, url = await start_server(latency=latency)
+    # measure the executor, not the rate limits
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None)
+    keys = make_keys(accounts)
+    # get_lens builds the clients, the environment points them at the mock server
+    os.environ["LENS_API_URL"] = url
+    os.environ["LENS_METADATA_URL"] = url + "metadata/"
+    actions = [Action.like("0x01-0x01"), Action.mirror("0x01-0x02"), Action.post("hello")]
+    try:
+        # the lens methods print every result, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            await run_batch(keys, [], concurrency=max(concurrency_levels))
+            login = time.perf_counter() - start
+            rows = []
+            for concurrency in concurrency_levels:
+                # a fresh ledger, otherwise every level after the first only repeats what is done
+                Lens.ledger = ActionLedger()
+                start = time.perf_counter()
+                results = await run_batch(keys, actions, concurrency=concurrency, per_account=per_account)
+                elapsed = time.perf_counter() - start
+                failed = sum(not account.ok for account in results)
+                rows.append((concurrency, len(keys) * len(actions) / elapsed, elapsed, failed))
+    finally:
+        await Lens.close_session()
+        await runner.cleanup()
+
+    print(f"{accounts} accounts, {len(actions)} actions each, {latency * 1000:.0f}ms mock server latency")
+    print(f"login of all accounts: {login:.2f}s")
+    print(f"{'in flight':>10} {'actions/s':>10} {'seconds':>8} {'failed':>7}")
+    for concurrency, rate, elapsed, failed in rows:
+        print(f"{concurrency:>10} {rate:>10.0f} {elapsed:>8.2f} {failed:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--per-account", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(main(args.accounts, args.latency, args.concurrency, args.per_account))
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from lens import Lens, lens_client
+from mockserver import start_server
+from scheduler import RequestScheduler
+from warmup import WarmUp
+
+# python -m benchmarks.bench_login --accounts 200 --latency 0.05
+
+
+def make_keys(start, count):
+    # every variant logs in its own accounts, the clients stay logged in between variants
+    return ["0x" + f"{index + 1:064x}" for index in range(start, start + count)]
+
+
+async def one_by_one(keys):
+    for key in keys:
+        await lens_client(key)
+
+
+async def warm_up(keys, concurrency, executor):
+    # seconds until the first account can be used and until all of them can
+    start = time.perf_counter()
+    first = None
+    async for status in WarmUp(keys, concurrency, executor):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def main(accounts, latency, concurrency, workers):
+    runner, url = await start_server(latency=latency)
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None)
+    os.environ["LENS_API_URL"] = url
+    rows = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            await one_by_one(make_keys(0, accounts))
+            rows.append(("one by one", time.perf_counter() - start, None))
+            variants = [("warm up, threads", ThreadPoolExecutor(workers)),
+                        # spawned, a forked worker would inherit the open connections of this process
+                        ("warm up, processes", ProcessPoolExecutor(workers, multiprocessing.get_context("spawn")))]
+            for index, (name, executor) in enumerate(variants, 1):
+                with executor:
+                    first, elapsed = await warm_up(make_keys(index * accounts, accounts), concurrency, executor)
+                    rows.append((name, elapsed, first))
+    finally:
+        await Lens.close_session()
+        await runner.cleanup()
+
+    print(f"{accounts} accounts, {latency * 1000:.0f}ms mock server latency, {concurrency} requests in flight, "
+          f"{workers} signing workers, {os.cpu_count()} cpus")
+    print(f"{'':20} {'all ready s':>12} {'accounts/s':>11} {'first ready s':>14}")
+    for name, elapsed, first in rows:
+        first = f"{first:>14.3f}" if first is not None else f"{'':>14}"
+        print(f"{name:20} {elapsed:>12.2f} {accounts / elapsed:>11.0f} {first}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every mock server response")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    asyncio.run(main(args.accounts, args.latency, args.concurrency, args.workers))
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import resource
+import socket
+import time
+
+from mockserver import add_file, start_server
+
+# moving photos and videos from telegram to ipfs through media.py, against the mock server in a
+# process of its own: throughput and peak memory of streaming each file through, next to reading
+# each file whole before uploading it, and what sending the same files again costs
+#
+#   python -m benchmarks.bench_media --files 16 --size 8 --concurrency 4
+#
+# every run is a fresh process, its peak rss is the memory the files took on top of the imports
+
+
+def serve_mock(port, files, size):
+    async def serve():
+        runner, _ = await start_server(port=port)
+        for index in range(files):
+            add_file(runner.app, size, f"file{index}")
+        await asyncio.Event().wait()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(serve())
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def buffered(uploader, file_id, file_unique_id, mime_type):
+    # the file read whole, then uploaded: what a script that downloads and uploads again does
+    from lens import Lens
+    media = uploader.store.for_file(file_unique_id)
+    if media is not None:
+        return media
+    async with uploader.uploads:
+        file = await uploader.bot.get_file(file_id)
+        async with Lens.get_session().get(uploader.bot.file_url(file['file_path'])) as download:
+            data = await download.read()
+
+        async def whole():
+            yield data
+
+        media = await uploader.upload(whole(), mime_type, file['file_path'])
+    return uploader.store.add(media, file_unique_id)
+
+
+async def move_files(mode, url, files, concurrency):
+    from lens import Lens
+    from media import MediaUploader
+    from telegram_api import TelegramBot
+    uploader = MediaUploader(TelegramBot("mock", url.rstrip("/")), upload_url=url + "ipfs/add",
+                             max_uploads=concurrency)
+    move = uploader.upload_telegram_file if mode == "streamed" else \
+        lambda *args: buffered(uploader, *args)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(move(f"file{index}", f"unique-file{index}", "video/mp4") for index in range(files)))
+        elapsed = time.perf_counter() - start
+        uploaded = uploader.uploaded
+        start = time.perf_counter()
+        await asyncio.gather(*(move(f"file{index}", f"unique-file{index}", "video/mp4") for index in range(files)))
+        again = time.perf_counter() - start
+    finally:
+        await Lens.close_session()
+    return {"seconds": elapsed, "bytes": uploader.bytes_uploaded, "uploaded": uploaded,
+            "again": again, "uploaded again": uploader.uploaded - uploaded}
+
+
+def run(mode, url, files, concurrency, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = asyncio.run(move_files(mode, url, files, concurrency))
+    result["peak rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put(result)
+
+
+def main(args):
+    context = multiprocessing.get_context("spawn")
+    port = free_port()
+    size = int(args.size * 1024 * 1024)
+    server = context.Process(target=serve_mock, args=(port, args.files, size), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port}/"
+    time.sleep(1)
+    print(f"{args.files} files of {args.size:g}MB, {args.concurrency} at once")
+    print(f"{'':9} {'MB/s':>7} {'peak rss':>9} {'uploads':>8} {'sent again':>11} {'uploads':>8}")
+    try:
+        for mode in ("streamed", "buffered"):
+            results = context.Queue()
+            worker = context.Process(target=run, args=(mode, url, args.files, args.concurrency, results))
+            worker.start()
+            result = results.get()
+            worker.join()
+            print(f"{mode:9} {result['bytes'] / result['seconds'] / 2 ** 20:>7.0f} "
+                  f"{result['peak rss'] / 1024:>7.0f}MB {result['uploaded']:>8} "
+                  f"{result['again'] * 1000:>9.1f}ms {result['uploaded again']:>8}")
+    finally:
+        server.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--size", type=float, default=8, help="megabytes per file")
+    parser.add_argument("--concurrency", type=int, default=4, help="files on their way at once")
+    main(parser.parse_args())
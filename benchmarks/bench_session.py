@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+from lens import Lens
+from mockserver import start_server
+from scheduler import RequestScheduler
+
+# python -m benchmarks.bench_session --requests 2000 --concurrency 50
+
+PRIVATE_KEY = "0x" + "11" * 32
+
+
+async def session_per_call(lens):
+    # what every Lens method used to do: a new session, so a new connection, per request
+    payload = {"operationName": "Challenge", "variables": {"request": {"address": lens.address}}, "query": ""}
+    async with aiohttp.ClientSession(headers=lens.headers) as session:
+        async with session.post(lens.url, json=payload) as response:
+            return (await response.json())['data']['challenge']['text']
+
+
+async def pooled_session(lens):
+    return await lens.get_message_for_signature()
+
+
+async def run(call, lens, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await call(lens)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def main(requests, concurrency):
+    runner, url = await start_server()
+    # measure the connection pool, not the rate limits
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None)
+    lens = Lens(PRIVATE_KEY, login=False, url=url)
+    try:
+        async with lens:
+            before = await run(session_per_call, lens, requests, concurrency)
+            after = await run(pooled_session, lens, requests, concurrency)
+    finally:
+        await runner.cleanup()
+    print(f"session per call: {before:8.0f} req/s")
+    print(f"pooled session:   {after:8.0f} req/s  ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import secrets
+import socket
+import tempfile
+import time
+
+from mockserver import start_server
+from shard import Coordinator, HashRing, ShardError, spawn_workers
+from signing import address_of
+
+# the sharded mode on one box: a coordinator in this process, worker processes on a unix socket and
+# the mock server. actions/s with 1, 2, 4 workers, then what happens when a worker goes away and
+# when one joins: how many accounts move, how long until all of them answer again, and how many
+# moved accounts came with their tokens instead of a new login
+#
+#   python -m benchmarks.bench_shard --accounts 200 --workers 1 2 4
+#
+# the mock server runs in a process of its own, with many workers it becomes the bottleneck.
+# the workers run without rate limits, with them every worker gets its share of the same limits
+# and more workers do not mean more requests
+
+
+def make_keys(count):
+    return ["0x" + f"{index + 1:064x}" for index in range(count)]
+
+
+def serve_mock(port, latency):
+    async def serve():
+        await start_server(port=port, latency=latency)
+        await asyncio.Event().wait()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(serve())
+
+
+def start_mock(latency):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = multiprocessing.get_context("spawn").Process(target=serve_mock, args=(port, latency), daemon=True)
+    server.start()
+    return server, f"http://127.0.0.1:{port}/"
+
+
+SECRET = secrets.token_hex(32)
+
+
+def start_workers(count, path, keys, environ, first=0):
+    # the workers print every action and inherit our stdout, keep the report readable
+    stdout = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        return spawn_workers(count, path, keys, environ, first,
+                             scheduler_options={"endpoint_rate": None, "account_rate": None}, secret=SECRET)
+    finally:
+        os.dup2(stdout, 1)
+        os.close(stdout)
+
+
+async def run_actions(coordinator, addresses, per_account, round):
+    # a like of a publication nobody liked yet per call, the ledger does not answer any of them
+    async def one(address, index):
+        try:
+            return await coordinator.call(address, "like", f"0x{round:02x}-0x{index:x}")
+        except ShardError:
+            return False
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(address, index) for address in addresses for index in range(per_account)))
+    return len(results) / (time.perf_counter() - start), results.count(False) + results.count(None)
+
+
+async def until_answered(coordinator, addresses, timeout=60):
+    # seconds until every account gets an answer from its owner
+    start = time.perf_counter()
+    waiting = list(addresses)
+    while waiting and time.perf_counter() - start < timeout:
+        results = await asyncio.gather(*(coordinator.call(address, "upload", "ping") for address in waiting),
+                                       return_exceptions=True)
+        waiting = [address for address, result in zip(waiting, results) if isinstance(result, Exception)]
+        if waiting:
+            await asyncio.sleep(0.1)
+    return time.perf_counter() - start
+
+
+async def measure(workers, keys, addresses, environ, per_account, directory):
+    path = os.path.join(directory, f"shard-{workers}.sock")
+    coordinator = await Coordinator(path, SECRET, heartbeat_timeout=3).start()
+    processes = start_workers(workers, path, keys, environ)
+    try:
+        await coordinator.wait_for_workers(workers)
+        login = await until_answered(coordinator, addresses)
+        rate, failed = await run_actions(coordinator, addresses, per_account, workers)
+        result = {"workers": workers, "login": login, "rate": rate, "failed": failed}
+        if workers > 1:
+            # a worker dies: its accounts go to the others, which have to log them in
+            before = HashRing(coordinator.workers)
+            processes[0].kill()
+            start = time.perf_counter()
+            while len(coordinator.workers) == workers and time.perf_counter() - start < 10:
+                await asyncio.sleep(0.01)
+            after = HashRing(coordinator.workers)
+            result["moved on leave"] = sum(before.owner(a) != after.owner(a) for a in addresses)
+            result["leave to answered"] = await until_answered(coordinator, addresses)
+            # and one joins: the accounts it takes over come with their tokens
+            handoffs = coordinator.handoffs
+            processes += start_workers(1, path, keys, environ, first=workers)
+            await coordinator.wait_for_workers(workers)
+            result["moved on join"] = sum(after.owner(a) != coordinator.owner(a) for a in addresses)
+            result["join to answered"] = await until_answered(coordinator, addresses)
+            result["handed over"] = coordinator.handoffs - handoffs
+        return result
+    finally:
+        await coordinator.stop()
+        for process in processes:
+            process.join(10)
+
+
+async def main(args):
+    server, url = start_mock(args.latency)
+    keys = make_keys(args.accounts)
+    addresses = [address_of(key) for key in keys]
+    environ = {"LENS_API_URL": url, "LENS_METADATA_URL": url + "metadata/"}
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for workers in args.workers:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results.append(await measure(workers, keys, addresses, environ, args.per_account, directory))
+    finally:
+        server.kill()
+
+    print(f"{args.accounts} accounts, {args.per_account} likes each, {args.latency * 1000:.0f}ms mock server latency")
+    print(f"{'workers':>8} {'login':>7} {'actions/s':>10} {'failed':>7}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['login']:>6.2f}s {result['rate']:>10.0f} {result['failed']:>7}")
+    for result in results:
+        if "moved on leave" in result:
+            print(f"{result['workers']} workers, one leaves: {result['moved on leave']} accounts moved, "
+                  f"all answer after {result['leave to answered']:.2f}s; one joins: {result['moved on join']} moved, "
+                  f"{result['handed over']} with their tokens, all answer after {result['join to answered']:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--per-account", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    asyncio.run(main(parser.parse_args()))
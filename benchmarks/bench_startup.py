@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mockserver import STATE, add_update, start_server
+
+# how long a fresh bot process takes to be useful: import time of the modules it loads, and the
+# time from starting `python lensbot.py` to the "queued…" answer and to the finished post of a
+# message that is already waiting, all against the mock server
+#
+#   python -m benchmarks.bench_startup --runs 5
+#   python -m benchmarks.bench_startup --json startup.json
+#   python -m benchmarks.bench_startup --baseline startup.json    # exit code 1 when it got slower
+#
+# with --baseline the run fails when any number grows more than --tolerance.
+# "start to posted" includes the second telegram keeps between edits of the same chat
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("lensbot", "lens", "signing", "web3", "eth_account")
+IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)")
+
+
+def import_time(module):
+    # cumulative microseconds of the module itself, as python -X importtime reports it
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True).stderr
+    for cumulative, name in IMPORT_LINE.findall(output):
+        if name == module:
+            return int(cumulative) / 1e6
+    return None
+
+
+def first_use_time():
+    # what the first login pays on top of the imports: loading the signing code and deriving the address
+    code = ("import time, signing; start = time.perf_counter(); signing.address_of('0x' + '11' * 32); "
+            "print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True).stdout
+    return float(output)
+
+
+async def cold_start(directory):
+    # seconds from spawning the bot to its answer to a message that waits in telegram,
+    # and to the edit that reports the post as done
+    runner, url = await start_server()
+    app = runner.app
+    add_update(app, chat_id=1, text="gm")
+    env = dict(os.environ, TELEGRAM_TOKEN="mock", PK="0x" + "11" * 32, LENS_API_URL=url,
+               LENS_METADATA_URL=url + "metadata/", TELEGRAM_API_URL=url.rstrip("/"),
+               JOB_QUEUE=os.path.join(directory, "jobs.sqlite"), REPLY_MODE="edit")
+    for name in ("PROFILE_CACHE", "METRICS_PORT", "METRICS_LOG"):
+        env.pop(name, None)
+    start = time.monotonic()
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, "lensbot.py")], cwd=directory, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    answered = posted = None
+    try:
+        while posted is None and time.monotonic() - start < 30:
+            await asyncio.sleep(0.005)
+            for at, method, params in app[STATE].telegram_calls:
+                if answered is None and method == "sendMessage":
+                    answered = at - start
+                if posted is None and params.get("text", "").startswith("posted"):
+                    posted = at - start
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        await asyncio.get_running_loop().run_in_executor(None, bot.wait)
+        await runner.cleanup()
+    return answered, posted
+
+
+async def cold_starts(runs):
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            results.append(await cold_start(directory))
+    return results
+
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+
+def measure(runs):
+    results = {}
+    for module in MODULES:
+        results[f"import {module}"] = median([import_time(module) for _ in range(runs)])
+    results["first key use"] = median([first_use_time() for _ in range(runs)])
+    starts = asyncio.run(cold_starts(runs))
+    results["start to first answer"] = median([answered for answered, _ in starts])
+    results["start to posted"] = median([posted for _, posted in starts])
+    return results
+
+
+def regressions(results, baseline, tolerance, noise=0.02):
+    # web3 and eth_account are only there to compare with, a few milliseconds either way is noise
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before and seconds and name not in ("import web3", "import eth_account") \
+                and seconds > before * (1 + tolerance) + noise:
+            yield name, before, seconds
+
+
+def main(args):
+    results = measure(args.runs)
+    print(f"median of {args.runs} runs")
+    for name, seconds in results.items():
+        print(f"{name:24} {'-' if seconds is None else f'{seconds * 1000:.0f}ms':>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = list(regressions(results, baseline, args.tolerance))
+        for name, before, seconds in slower:
+            print(f"slower: {name} {before * 1000:.0f}ms -> {seconds * 1000:.0f}ms")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth, 0.2 is 20%%")
+    main(parser.parse_args())
@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from mockserver import STATE, add_update, start_server
+
+# message to post latency of the bot started as `python lensbot.py` against the mock server, once
+# polling and once in webhook mode. the same updates go in at the same pace both times: queued in
+# the mock telegram for getUpdates, or posted to the bot's webhook, --bulk of them per request.
+#
+#   python -m benchmarks.bench_webhook --messages 100 --rate 20
+#   python -m benchmarks.bench_webhook --updates recorded.json --bulk 10
+#
+# --updates replays recorded updates (a getUpdates result, a json array or one update per line).
+# each gets an update_id and a chat of its own, so every message can be told apart in the answers.
+# "accepted" is the "queued…" answer, "posted" when the mock server gets the CreatePostViaDispatcher
+# of the message, found by the content of the metadata it points to. the edit that reports the post
+# is not used, the bot spaces it a second after "queued…" for telegram. the bot posts with one
+# account, by default without request limits so "posted" is the bot's own latency and not the wait for
+# the account's limit. --limits keeps the scheduler's defaults, at a few messages a second "posted" is
+# then mostly its queue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "bench-secret"
+
+
+def synthetic_updates(count):
+    return [{"update_id": 0, "message": {"message_id": 1, "chat": {"id": 0, "type": "private"},
+                                         "date": int(time.time()), "text": f"gm {index}"}} for index in range(count)]
+
+
+def read_updates(path):
+    with open(path) as f:
+        data = f.read()
+    try:
+        updates = json.loads(data)
+    except ValueError:
+        updates = [json.loads(line) for line in data.splitlines() if line.strip()]
+    if isinstance(updates, dict):
+        updates = updates.get("result", [])
+    return [update for update in updates if "text" in (update.get("message") or {})]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def replay(updates, rate, bulk, deliver):
+    # bulk updates every bulk / rate seconds, returns when each was handed over
+    sent = {}
+    start = time.monotonic()
+    for index in range(0, len(updates), bulk):
+        await asyncio.sleep(max(0.0, start + index / rate - time.monotonic()))
+        batch = updates[index:index + bulk]
+        at = time.monotonic()
+        await deliver(batch)
+        for update in batch:
+            sent[update["message"]["chat"]["id"]] = at
+    return sent
+
+
+async def run(mode, updates, rate, bulk, latency, directory, limits):
+    runner, url = await start_server(latency=latency)
+    app = runner.app
+    env = dict(os.environ, TELEGRAM_TOKEN="mock", PK="0x" + "11" * 32, LENS_API_URL=url,
+               LENS_METADATA_URL=url + "metadata/", TELEGRAM_API_URL=url.rstrip("/"),
+               JOB_QUEUE=os.path.join(directory, f"{mode}.sqlite"), REPLY_MODE="edit")
+    for name in ("PROFILE_CACHE", "METRICS_PORT", "METRICS_LOG", "SHARD_LISTEN", "WEBHOOK_URL", "LENS_ENDPOINT_RATE",
+                 "LENS_ACCOUNT_RATE"):
+        env.pop(name, None)
+    if not limits:
+        env.update(LENS_ENDPOINT_RATE="off", LENS_ACCOUNT_RATE="off")
+    webhook = None
+    if mode == "webhook":
+        port = free_port()
+        webhook = f"http://127.0.0.1:{port}/telegram"
+        env.update(WEBHOOK_URL=webhook, WEBHOOK_LISTEN=f"127.0.0.1:{port}", WEBHOOK_SECRET=SECRET)
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, "lensbot.py")], cwd=directory, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    session = aiohttp.ClientSession()
+    accept_times = []
+
+    async def post(batch):
+        start = time.monotonic()
+        body = batch[0] if len(batch) == 1 else batch
+        async with session.post(webhook, json=body, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"webhook answered {response.status}")
+        accept_times.append(time.monotonic() - start)
+
+    async def queue(batch):
+        for update in batch:
+            add_update(app, update["message"]["chat"]["id"], update["message"]["text"])
+
+    try:
+        # both modes start sending once the bot is up and logged in
+        start = time.monotonic()
+        while mode == "webhook" and not any(method == "setWebhook" for _, method, _ in app[STATE].telegram_calls):
+            if time.monotonic() - start > 30:
+                raise RuntimeError("the bot did not set its webhook")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(max(0.0, start + 2 - time.monotonic()))
+        if mode == "webhook":
+            # a wrong secret is turned away
+            async with session.post(webhook, json=updates[0], headers={"X-Telegram-Bot-Api-Secret-Token": "x"}) as r:
+                if r.status != 401:
+                    raise RuntimeError(f"webhook answered {r.status} to a wrong secret")
+        sent = await replay(updates, rate, bulk, post if mode == "webhook" else queue)
+        chats = {}
+        for update in updates:
+            chats.setdefault(update["message"]["text"], []).append(update["message"]["chat"]["id"])
+        accepted, posted = {}, {}
+        deadline = time.monotonic() + 60 + len(updates)
+        while len(app[STATE].posts) < len(updates) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for at, method, params in app[STATE].telegram_calls:
+            if method == "sendMessage":
+                accepted.setdefault(params.get("chat_id"), at)
+        for at, content_uri in app[STATE].posts:
+            # messages with the same text are taken in the order they were sent
+            waiting = chats.get(json.loads(app[STATE].uploaded[content_uri.rsplit("/", 1)[-1]])["content"])
+            if waiting:
+                posted[waiting.pop(0)] = at
+    finally:
+        await session.close()
+        bot.send_signal(signal.SIGTERM)
+        await asyncio.get_running_loop().run_in_executor(None, bot.wait)
+        await runner.cleanup()
+    return {"accepted": [accepted[chat] - at for chat, at in sent.items() if chat in accepted],
+            "posted": [posted[chat] - at for chat, at in sent.items() if chat in posted],
+            "missing": len(updates) - len(posted), "accept_times": accept_times}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+
+async def main(args):
+    updates = read_updates(args.updates) if args.updates else synthetic_updates(args.messages)
+    for index, update in enumerate(updates):
+        # a chat per message, edits of different chats do not wait for each other
+        update["update_id"] = index + 1
+        update["message"]["chat"]["id"] = 10000 + index
+    print(f"{len(updates)} messages at {args.rate}/s, {args.bulk} per webhook request, "
+          f"{args.latency * 1000:.0f}ms mock server latency, request limits {'on' if args.limits else 'off'}")
+    print(f"{'':8} {'accepted p50':>13} {'p95':>7} {'posted p50':>11} {'p95':>7} {'max':>7} {'missing':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("polling", "webhook"):
+            result = await run(mode, updates, args.rate, args.bulk if mode == "webhook" else 1, args.latency,
+                               directory, args.limits)
+            accepted, posted = result["accepted"], result["posted"]
+            print(f"{mode:8} {statistics.median(accepted) * 1000:>11.0f}ms {percentile(accepted, 0.95) * 1000:>5.0f}ms "
+                  f"{statistics.median(posted) * 1000:>9.0f}ms {percentile(posted, 0.95) * 1000:>5.0f}ms "
+                  f"{max(posted) * 1000:>5.0f}ms {result['missing']:>8}")
+            if result["accept_times"]:
+                print(f"{'':8} webhook requests answered in {statistics.median(result['accept_times']) * 1000:.1f}ms "
+                      f"median, {max(result['accept_times']) * 1000:.1f}ms max")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=10, help="messages per second")
+    parser.add_argument("--bulk", type=int, default=1, help="updates per webhook request")
+    parser.add_argument("--updates", help="recorded updates to replay instead of generated ones")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--limits", action="store_true", help="keep the scheduler's default request limits")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+from ledger import ActionLedger
+from lens import Lens, lens_client
+from mockserver import start_server
+from scheduler import RequestScheduler
+
+# throughput and p50/p99 latency per operation against the local mock server, one account and many
+#
+#   python -m benchmarks.bench_workload --accounts 50 --latency 0.02 --json after.json
+#   python -m benchmarks.bench_workload --accounts 50 --latency 0.02 --baseline after.json
+#
+# with --baseline the run fails (exit code 1) when any throughput drops more than --tolerance
+
+# what one round of the workload does on an account
+WORKLOAD = (
+    ("post", lambda lens, index: lens.post(f"benchmark post {index}")),
+    ("like", lambda lens, index: lens.like(f"0x01-0x{index:04x}")),
+    ("mirror", lambda lens, index: lens.mirror(f"0x01-0x{index:04x}")),
+    ("follow", lambda lens, index: lens.follow(f"mock{index % 200}.lens")),
+    ("feed", lambda lens, index: lens.get_feed()),
+    ("followers", lambda lens, index: lens.get_followers(lens.user_id)),
+)
+
+
+def make_keys(count):
+    return ["0x" + f"{index + 1:064x}" for index in range(count)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_workload(keys, rounds, concurrency):
+    # every account runs rounds of WORKLOAD, at most concurrency calls are in flight overall.
+    # a fresh ledger, so repeated runs send the same calls
+    Lens.ledger = ActionLedger()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {name: [] for name, _ in WORKLOAD}
+    failures = {name: 0 for name, _ in WORKLOAD}
+
+    async def call(lens, name, action, index):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await action(lens, index)
+            except Exception:
+                ok = False
+            latencies[name].append(time.perf_counter() - start)
+            if ok is False or ok is None:
+                failures[name] += 1
+
+    clients = await asyncio.gather(*(lens_client(key) for key in keys))
+    start = time.perf_counter()
+    await asyncio.gather(*(call(lens, name, action, index)
+                           for lens in clients
+                           for index in range(rounds)
+                           for name, action in WORKLOAD))
+    elapsed = time.perf_counter() - start
+    return {name: {"calls": len(values), "per_second": len(values) / elapsed,
+                   "p50_ms": percentile(values, 0.5) * 1000, "p99_ms": percentile(values, 0.99) * 1000,
+                   "failed": failures[name]}
+            for name, values in latencies.items()}
+
+
+def report(title, results):
+    print(title)
+    print(f"  {'operation':10} {'calls':>7} {'calls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for name, row in results.items():
+        print(f"  {name:10} {row['calls']:>7} {row['per_second']:>9.0f} {row['p50_ms']:>8.1f} "
+              f"{row['p99_ms']:>8.1f} {row['failed']:>7}")
+
+
+def regressions(results, baseline, tolerance):
+    for workload, rows in results.items():
+        for name, row in rows.items():
+            before = (baseline.get(workload) or {}).get(name)
+            if before and row["per_second"] < before["per_second"] * (1 - tolerance):
+                yield f"{workload}/{name}: {before['per_second']:.0f} -> {row['per_second']:.0f} calls/s"
+
+
+async def main(args):
+    runner, url = await start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    # measure the client, not the rate limits
+    Lens.scheduler = RequestScheduler(endpoint_rate=None, account_rate=None, backoff_base=0.01)
+    os.environ["LENS_API_URL"] = url
+    os.environ["LENS_METADATA_URL"] = url + "metadata/"
+    keys = make_keys(args.accounts)
+    results = {}
+    try:
+        # the lens methods print every result, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["single"] = await run_workload(keys[:1], args.rounds * args.accounts, args.concurrency)
+            results["multi"] = await run_workload(keys, args.rounds, args.concurrency)
+    finally:
+        await Lens.tracker.close()
+        await Lens.close_session()
+        await runner.cleanup()
+
+    print(f"{args.accounts} accounts, {args.rounds} rounds each, {args.concurrency} in flight, "
+          f"{args.latency * 1000:.0f}ms+{args.jitter * 1000:.0f}ms mock server latency, "
+          f"{args.error_rate:.0%} injected errors")
+    report("single account", results["single"])
+    report(f"{args.accounts} accounts", results["multi"])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = list(regressions(results, baseline, args.tolerance))
+        for line in slower:
+            print(f"regression {line}")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5, help="workload rounds per account")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every mock server response")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed drop in calls/s, 0.2 is 20%%")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # least recently used entries go first once maxsize is reached, entries expire after ttl seconds
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self.data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    async def get_or_load(self, key, loader):
+        # concurrent lookups of the same key share one loader call,
+        # falsy results (the lens methods return False on failure) are not cached
+        value = self.get(key)
+        if value is not None:
+            return value
+        future = self.loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # nobody else may be waiting, do not warn about an unread exception
+            future.exception()
+            raise
+        else:
+            if value:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self.loading[key]
+
+    def dump(self):
+        now = time.time()
+        return [[key, expires_at, value] for key, (expires_at, value) in self.data.items() if expires_at > now]
+
+    def restore(self, entries):
+        now = time.time()
+        for key, expires_at, value in entries:
+            if expires_at > now:
+                self.data[key] = (expires_at, value)
+                self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+class ProfileCache:
+    # handle -> profile id and address -> profile, shared by every account
+    def __init__(self, maxsize=100000, ttl=24 * 60 * 60):
+        self.handles = TTLCache(maxsize, ttl)
+        self.addresses = TTLCache(maxsize, ttl)
+
+    def remember(self, profile):
+        # store what a profile query already returned, so later lookups never hit the api
+        if not profile or not profile.get('id'):
+            return
+        if profile.get('handle'):
+            self.handles.set(profile['handle'].lower(), profile['id'])
+        if profile.get('ownedBy'):
+            stats = profile.get('stats') or {}
+            self.addresses.set(profile['ownedBy'].lower(), {
+                "id": profile['id'],
+                "name": profile.get('name'),
+                "handle": profile.get('handle'),
+                "totalFollowers": stats.get('totalFollowers'),
+                "totalFollowing": stats.get('totalFollowing'),
+            })
+
+    def save(self, path):
+        # write to a temporary file first so a crash never leaves half a snapshot
+        snapshot = {"handles": self.handles.dump(), "addresses": self.addresses.dump()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            print(f"profile cache {path} is unreadable, starting cold: {e}")
+            return False
+        self.handles.restore(snapshot.get("handles", []))
+        self.addresses.restore(snapshot.get("addresses", []))
+        return True
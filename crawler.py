@@ -0,0 +1,241 @@
+import asyncio
+import sqlite3
+import time
+
+
+# breadth first crawl of the follow graph around some profiles, to find accounts worth following.
+#
+#   crawler = Crawler(lens, "graph.sqlite", max_depth=2)
+#   await crawler.seed_account()                     # the ego network of the bot's own profile
+#   await crawler.crawl()
+#   for handle, overlap in crawler.candidates(limit=20):
+#       await lens.follow(handle)
+#
+# everything lives in sqlite: the nodes table is the visited set and the frontier (nodes that are
+# not expanded yet), edges are two integers each. a node and its edges are written in one
+# transaction, so a crawl that stops half way carries on from the next unexpanded node.
+# memory stays flat however big the graph gets, only the queue and one page per worker are held.
+
+PENDING = 0
+EXPANDED = 1
+
+
+def node_id(profile_id):
+    # lens profile ids are hex numbers, the integer keeps edges small
+    return int(profile_id, 16)
+
+
+class Node:
+    def __init__(self, id, profile_id, address, handle, depth):
+        self.id = id
+        self.profile_id = profile_id
+        self.address = address
+        self.handle = handle
+        self.depth = depth
+
+    def __repr__(self):
+        return f"<Node {self.profile_id} {self.handle} depth {self.depth}>"
+
+
+class GraphStore:
+    # an edge (src, dst) means src follows dst
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.executescript("""
+            create table if not exists nodes (
+                id integer primary key,
+                profile_id text not null,
+                address text,
+                handle text,
+                depth integer not null,
+                state integer not null default 0,
+                expanded_at real
+            );
+            create index if not exists nodes_frontier on nodes (state, depth, id);
+            create table if not exists edges (
+                src integer not null,
+                dst integer not null,
+                primary key (src, dst)
+            ) without rowid;
+            create index if not exists edges_dst on edges (dst, src);
+        """)
+
+    def add(self, nodes):
+        # nodes are (profile_id, address, handle, depth). a node found again keeps its lowest depth
+        # and fills in what it was missing
+        self.db.executemany(
+            "insert into nodes (id, profile_id, address, handle, depth) values (?, ?, ?, ?, ?) "
+            "on conflict (id) do update set depth = min(depth, excluded.depth), "
+            "address = coalesce(address, excluded.address), handle = coalesce(handle, excluded.handle)",
+            [(node_id(profile_id), profile_id, address, handle, depth)
+             for profile_id, address, handle, depth in nodes])
+
+    def expanded(self, node, neighbours, edges):
+        # neighbours of node and the edges between them, node is done once this returns
+        with self.db:
+            self.db.execute("begin")
+            self.add(neighbours)
+            self.db.executemany("insert or ignore into edges values (?, ?)", edges)
+            self.db.execute("update nodes set state = ?, expanded_at = ? where id = ?",
+                            (EXPANDED, time.time(), node.id))
+
+    def next_depth(self):
+        # depth of the closest node still to expand, None when the frontier is empty
+        row = self.db.execute("select min(depth) from nodes where state = ?", (PENDING,)).fetchone()
+        return row[0]
+
+    def frontier(self, depth, chunk_size=500):
+        # nodes at depth still to expand, read a chunk at a time
+        after = -1
+        while True:
+            rows = self.db.execute(
+                "select id, profile_id, address, handle, depth from nodes "
+                "where state = ? and depth = ? and id > ? order by id limit ?",
+                (PENDING, depth, after, chunk_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield Node(*row)
+            after = rows[-1][0]
+
+    def candidates(self, profile_id, limit=50, min_overlap=1):
+        # profiles followed by the profiles profile_id follows, ranked by how many of them do,
+        # leaving out profile_id itself and whoever it already follows
+        me = node_id(profile_id)
+        return self.db.execute(
+            "select nodes.handle, count(*) as overlap from edges as mine "
+            "join edges as theirs on theirs.src = mine.dst "
+            "join nodes on nodes.id = theirs.dst "
+            "where mine.src = ? and theirs.dst != ? and nodes.handle is not null "
+            "and theirs.dst not in (select dst from edges where src = ?) "
+            "group by theirs.dst having overlap >= ? order by overlap desc, theirs.dst limit ?",
+            (me, me, me, min_overlap, limit)).fetchall()
+
+    def size(self):
+        return self.db.execute("select count(*) from nodes").fetchone()[0]
+
+    def counts(self):
+        nodes = dict(self.db.execute("select state, count(*) from nodes group by state").fetchall())
+        edges = self.db.execute("select count(*) from edges").fetchone()[0]
+        return {"pending": nodes.get(PENDING, 0), "expanded": nodes.get(EXPANDED, 0), "edges": edges}
+
+    def close(self):
+        self.db.close()
+
+
+class Crawler:
+    def __init__(self, lens, store, max_depth=2, concurrency=8, max_degree=500, max_nodes=None,
+                 direction="both", page_size=50):
+        # store is a GraphStore or the path of its sqlite file.
+        # nodes up to max_depth hops from a seed are stored, the ones closer than that are expanded.
+        # max_degree caps the followers and following read per profile, hubs have hundred thousands.
+        # direction is "followers", "following" or "both"
+        if direction not in ("followers", "following", "both"):
+            raise ValueError(f"unknown direction {direction!r}, expected followers, following or both")
+        self.lens = lens
+        self.store = store if isinstance(store, GraphStore) else GraphStore(store)
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.max_degree = max_degree
+        self.max_nodes = max_nodes
+        self.direction = direction
+        self.page_size = page_size
+        self.seeds = []
+        self.expanded = 0
+        self.edges = 0
+        self.failed = 0
+
+    def seed(self, profile_id, address=None, handle=None):
+        # without an address only the followers of the seed are read, the following query needs it
+        self.store.add([(profile_id, address, handle, 0)])
+        self.seeds.append(profile_id)
+
+    async def seed_account(self):
+        # the profile of the account lens is logged in with
+        if not await self.lens.ensure_login():
+            print(f"{self.lens.address} crawl: not logged in")
+            return False
+        self.seed(self.lens.user_id, self.lens.address, self.lens.user_handle)
+        return True
+
+    async def neighbours(self, node):
+        # (profile_id, address, handle) of each neighbour and the edges to them
+        found = []
+        edges = []
+        if self.direction in ("followers", "both"):
+            async for edge in self.lens.iter_followers(node.profile_id, self.max_degree, page_size=self.page_size,
+                                                       projection="ids"):
+                if edge.profile is not None:
+                    found.append((edge.profile.id, edge.address, edge.handle))
+                    edges.append((node_id(edge.profile.id), node.id))
+        if self.direction in ("following", "both") and node.address:
+            async for edge in self.lens.iter_following(node.address, self.max_degree, page_size=self.page_size,
+                                                       projection="ids"):
+                if edge.profile is not None:
+                    found.append((edge.profile.id, edge.address, edge.handle))
+                    edges.append((node.id, node_id(edge.profile.id)))
+        return found, edges
+
+    async def expand(self, node):
+        try:
+            found, edges = await self.neighbours(node)
+        except Exception as e:
+            # stays in the frontier, the next crawl tries again
+            print(f"crawl {node.profile_id} failed: {e}")
+            self.failed += 1
+            return
+        self.store.expanded(node, [(profile_id, address, handle, node.depth + 1)
+                                   for profile_id, address, handle in found], edges)
+        self.expanded += 1
+        self.edges += len(edges)
+
+    def full(self):
+        if self.max_nodes is None:
+            return False
+        return self.store.size() >= self.max_nodes
+
+    async def crawl_depth(self, depth):
+        # expand every node at depth with at most concurrency of them in flight.
+        # the queue is bounded, the frontier is read from sqlite as the workers catch up
+        queue = asyncio.Queue(self.concurrency * 2)
+
+        async def work():
+            while True:
+                node = await queue.get()
+                if node is None:
+                    return
+                await self.expand(node)
+
+        workers = [asyncio.ensure_future(work()) for _ in range(self.concurrency)]
+        try:
+            for index, node in enumerate(self.store.frontier(depth)):
+                if index % 1000 == 999 and self.full():
+                    break
+                await queue.put(node)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def crawl(self):
+        # walks out from the seeds one depth at a time, carrying on where the last crawl stopped.
+        # returns the store counts
+        depth = self.store.next_depth()
+        while depth is not None and depth < self.max_depth and not self.full():
+            started = time.perf_counter()
+            await self.crawl_depth(depth)
+            print(f"crawl depth {depth} done in {time.perf_counter() - started:.1f}s: {self.store.counts()}")
+            depth += 1
+        return self.store.counts()
+
+    def candidates(self, profile_id=None, limit=50, min_overlap=1):
+        # (handle, overlap) pairs to hand to lens.follow, for the first seed by default
+        profile_id = profile_id or (self.seeds[0] if self.seeds else self.lens.user_id)
+        return self.store.candidates(profile_id, limit, min_overlap)
+
+    def close(self):
+        self.store.close()
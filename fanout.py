@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from lens import lens_client
+
+
+# run the same actions on many accounts at once
+#
+#   results = await run_batch(keys, [Action.like('0x6acb-0x0343'), Action.follow('0x0cc9')])
+
+ACTIONS = ('post', 'like', 'mirror', 'follow')
+
+
+class Action:
+    def __init__(self, name, *args):
+        if name not in ACTIONS:
+            raise ValueError(f"unknown action {name!r}, expected one of {', '.join(ACTIONS)}")
+        self.name = name
+        self.args = args
+
+    @classmethod
+    def post(cls, text):
+        return cls('post', text)
+
+    @classmethod
+    def like(cls, publication_id):
+        return cls('like', publication_id)
+
+    @classmethod
+    def mirror(cls, publication_id):
+        return cls('mirror', publication_id)
+
+    @classmethod
+    def follow(cls, user_handle):
+        return cls('follow', user_handle)
+
+    async def run(self, lens):
+        return await getattr(lens, self.name)(*self.args)
+
+    def __repr__(self):
+        return f"{self.name}({', '.join(map(repr, self.args))})"
+
+
+class ActionResult:
+    def __init__(self, action, ok, result=None, error=None, elapsed=0.0):
+        self.action = action
+        self.ok = ok
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'failed: {self.error}'
+        return f"<{self.action!r} {status} {self.elapsed * 1000:.0f}ms>"
+
+
+class AccountResult:
+    def __init__(self, address, handle=None, error=None):
+        self.address = address
+        self.handle = handle
+        # login failed, no action ran
+        self.error = error
+        self.results = []
+
+    @property
+    def ok(self):
+        return self.error is None and all(result.ok for result in self.results)
+
+    def __repr__(self):
+        return f"<{self.handle or self.address} {self.results if self.error is None else self.error}>"
+
+
+async def run_batch(private_keys, actions, concurrency=50, per_account=2):
+    # actions is one list for every key or a dict of key -> list, at most `concurrency`
+    # requests are in flight overall and `per_account` for a single account.
+    # returns one AccountResult per key, in the order of private_keys
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def run_action(lens, account_limit, action):
+        async with account_limit, in_flight:
+            start = time.perf_counter()
+            try:
+                result = await action.run(lens)
+            except Exception as e:
+                return ActionResult(action, False, error=e, elapsed=time.perf_counter() - start)
+            ok = bool(result)
+            return ActionResult(action, ok, result=result, error=None if ok else 'no result',
+                                elapsed=time.perf_counter() - start)
+
+    async def run_account(private_key):
+        account_actions = actions[private_key] if isinstance(actions, dict) else actions
+        async with in_flight:
+            try:
+                lens = await lens_client(private_key)
+            except Exception as e:
+                return AccountResult(None, error=e)
+        if lens.user_id is None:
+            return AccountResult(lens.address, error='login failed')
+        account = AccountResult(lens.address, lens.user_handle)
+        account_limit = asyncio.Semaphore(per_account)
+        account.results = await asyncio.gather(*(run_action(lens, account_limit, action)
+                                                 for action in account_actions))
+        return account
+
+    return await asyncio.gather(*(run_account(private_key) for private_key in private_keys))
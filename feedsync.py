@@ -0,0 +1,143 @@
+import hashlib
+import math
+import sqlite3
+import time
+
+
+# incremental feed sync: only publications that were never handed out before come out of sync().
+#
+#   feed = FeedSync(lens, "feed.sqlite")
+#   async for publication_id in feed.sync():
+#       await lens.like(publication_id)
+#
+# lens feed cursors only walk back in time, so the checkpoint is the newest publication seen
+# per profile plus every publication id handed out. a sync walks from the top of the feed
+# and stops once a whole page in a row is made of publications it has already seen.
+
+
+class BloomFilter:
+    # fixed size whatever the number of ids, a miss means the id was never added
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class FeedStore:
+    # sqlite file with every publication id handed out and the newest one per profile
+    def __init__(self, path, capacity=100000):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            create table if not exists seen (publication_id text primary key, seen_at real);
+            create table if not exists checkpoint (profile_id text primary key, head text, synced_at real);
+        """)
+        self.recent = BloomFilter(capacity)
+        for (publication_id,) in self.db.execute("select publication_id from seen"):
+            self.recent.add(publication_id)
+        self.hits = 0
+        self.lookups = 0
+
+    def seen(self, publication_id):
+        # the filter answers most new ids without touching sqlite, a maybe is checked for real
+        if publication_id not in self.recent:
+            return False
+        self.lookups += 1
+        found = self.db.execute("select 1 from seen where publication_id = ?", (publication_id,)).fetchone()
+        if found:
+            self.hits += 1
+        return found is not None
+
+    def mark(self, publication_ids):
+        now = time.time()
+        with self.db:
+            self.db.executemany("insert or ignore into seen values (?, ?)",
+                                [(publication_id, now) for publication_id in publication_ids])
+        for publication_id in publication_ids:
+            self.recent.add(publication_id)
+
+    def head(self, profile_id):
+        row = self.db.execute("select head from checkpoint where profile_id = ?", (profile_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_head(self, profile_id, publication_id):
+        with self.db:
+            self.db.execute("insert or replace into checkpoint values (?, ?, ?)",
+                            (profile_id, publication_id, time.time()))
+
+    def close(self):
+        self.db.close()
+
+
+class FeedSync:
+    def __init__(self, lens, store, page_size=50, max_items=1000):
+        # store is a FeedStore or the path of its sqlite file
+        self.lens = lens
+        self.store = store if isinstance(store, FeedStore) else FeedStore(store)
+        self.page_size = page_size
+        self.max_items = max_items
+        self.new = 0
+        self.skipped = 0
+
+    async def sync(self):
+        # yields the id of every publication that is new since the last sync, newest first.
+        # ids are written to the store once the walk is done, so a sync that breaks off half way
+        # hands the same publications out again next time instead of losing them
+        if not await self.lens.ensure_login():
+            print(f"{self.lens.address} feed sync: not logged in")
+            return
+        profile_id = self.lens.user_id
+        head = self.store.head(profile_id)
+        fresh = []
+        fresh_ids = set()
+        walked = 0
+        seen_in_a_row = 0
+
+        def known(publication_id):
+            return publication_id in fresh_ids or self.store.seen(publication_id)
+
+        def caught_up(item):
+            nonlocal walked, seen_in_a_row
+            publication_id = item.id
+            walked += 1
+            # the newest publication of the last sync, unless a mirror brought it back to the top
+            if publication_id == head and walked > 1:
+                return True
+            seen_in_a_row = seen_in_a_row + 1 if known(publication_id) else 0
+            # old publications come back to the top too, so a single known id is not enough
+            return seen_in_a_row >= self.page_size
+
+        newest = None
+        async for item in self.lens.iter_feed(self.max_items, caught_up, self.page_size, projection="ids"):
+            publication_id = item.id
+            if newest is None:
+                newest = publication_id
+            if known(publication_id):
+                self.skipped += 1
+                continue
+            fresh.append(publication_id)
+            fresh_ids.add(publication_id)
+            self.new += 1
+            yield publication_id
+        if fresh:
+            self.store.mark(fresh)
+        if newest is not None:
+            self.store.set_head(profile_id, newest)
+
+    async def sync_all(self):
+        return [publication_id async for publication_id in self.sync()]
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import json
+import sqlite3
+import time
+import uuid
+
+
+# durable queue between the telegram side and lens. a job is written to sqlite before anyone is
+# told it was accepted, workers take it from there, and whatever was pending or running when
+# the process died is picked up again on the next start.
+#
+#   queue = JobQueue("jobs.sqlite")
+#   queue.enqueue("post", {"text": "gm"}, key=f"update-{update_id}", group=chat_id)
+#   workers = JobWorkers(queue, handler, workers=8).start()
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, id, key, action, args, context, state, attempts):
+        self.id = id
+        self.key = key
+        self.action = action
+        self.args = args
+        # what the caller needs once the job is done, the chat to answer for example
+        self.context = context
+        # progress the handler saved with JobQueue.checkpoint, survives restarts
+        self.state = state
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.action} {self.key}>"
+
+
+class JobQueue:
+    def __init__(self, path, max_attempts=5, retry_delay=5):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.db = sqlite3.connect(path, isolation_level=None)
+        # wal keeps enqueues cheap and lets another process read the queue while we write
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
+        self.db.executescript("""
+            create table if not exists jobs (
+                id integer primary key,
+                key text unique not null,
+                action text not null,
+                args text not null,
+                context text,
+                state text,
+                grp text,
+                status text not null,
+                attempts integer not null default 0,
+                not_before real not null default 0,
+                result text,
+                error text,
+                created real not null,
+                updated real not null
+            );
+            create index if not exists jobs_status on jobs (status, not_before);
+            create index if not exists jobs_group on jobs (grp, status);
+        """)
+        self.ready = asyncio.Event()
+        self.recovered = self.recover()
+
+    def recover(self):
+        # jobs that were running when the process stopped start over
+        now = time.time()
+        return self.db.execute("update jobs set status = ?, updated = ? where status = ?",
+                               (PENDING, now, RUNNING)).rowcount
+
+    def enqueue(self, action, args, key=None, context=None, group=None):
+        # returns (job id, True) for a new job, (id of the existing job, False) when key was seen before.
+        # jobs of the same group run one at a time, in the order they were enqueued
+        key = key or str(uuid.uuid4())
+        now = time.time()
+        cursor = self.db.execute(
+            "insert or ignore into jobs (key, action, args, context, state, grp, status, created, updated) "
+            "values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, action, json.dumps(args), json.dumps(context), json.dumps({}),
+             None if group is None else str(group), PENDING, now, now))
+        if cursor.rowcount:
+            self.ready.set()
+            return cursor.lastrowid, True
+        return self.db.execute("select id from jobs where key = ?", (key,)).fetchone()[0], False
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # enqueues inside share one commit, for a burst of updates
+        with self.db:
+            self.db.execute("begin")
+            yield
+
+    def claim(self):
+        # the oldest job that is due and whose group is not busy, None when there is nothing to do.
+        # a group is busy while one of its jobs runs or an earlier one waits for its retry
+        now = time.time()
+        row = self.db.execute(
+            "select id, key, action, args, context, state, attempts from jobs "
+            "where status = ? and not_before <= ? and (grp is null or not exists "
+            "(select 1 from jobs earlier where earlier.grp = jobs.grp and "
+            "(earlier.status = ? or (earlier.status = ? and earlier.id < jobs.id)))) order by id limit 1",
+            (PENDING, now, RUNNING, PENDING)).fetchone()
+        if row is None:
+            return None
+        claimed = self.db.execute("update jobs set status = ?, attempts = attempts + 1, updated = ? "
+                                  "where id = ? and status = ?", (RUNNING, now, row[0], PENDING)).rowcount
+        if not claimed:
+            return None
+        id, key, action, args, context, state, attempts = row
+        return Job(id, key, action, json.loads(args), json.loads(context), json.loads(state or '{}'),
+                   attempts + 1)
+
+    def checkpoint(self, job):
+        # save job.state, a retried or recovered job starts from there
+        self.db.execute("update jobs set state = ?, updated = ? where id = ?",
+                        (json.dumps(job.state), time.time(), job.id))
+
+    def update_context(self, job_id, **values):
+        # add to the context of a job after it was enqueued, a job claimed from now on sees it
+        row = self.db.execute("select context from jobs where id = ?", (job_id,)).fetchone()
+        if row is None:
+            return False
+        context = dict(json.loads(row[0]) or {}, **values)
+        self.db.execute("update jobs set context = ?, updated = ? where id = ?",
+                        (json.dumps(context), time.time(), job_id))
+        return True
+
+    def release(self, job):
+        # hand a job that was interrupted back without counting the attempt
+        self.db.execute("update jobs set status = ?, attempts = attempts - 1, updated = ? "
+                        "where id = ? and status = ?", (PENDING, time.time(), job.id, RUNNING))
+        self.ready.set()
+
+    def complete(self, job, result=None):
+        self.db.execute("update jobs set status = ?, result = ?, updated = ? where id = ?",
+                        (DONE, json.dumps(result), time.time(), job.id))
+
+    def fail(self, job, error):
+        # back to pending with a growing delay, or failed for good after max_attempts.
+        # returns True when the job will be tried again
+        now = time.time()
+        if job.attempts < self.max_attempts:
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            self.db.execute("update jobs set status = ?, error = ?, not_before = ?, updated = ? where id = ?",
+                            (PENDING, str(error), now + delay, now, job.id))
+            self.ready.set()
+            return True
+        self.db.execute("update jobs set status = ?, error = ?, updated = ? where id = ?",
+                        (FAILED, str(error), now, job.id))
+        return False
+
+    def next_due(self):
+        # seconds until the next pending job is due, None when nothing is pending
+        row = self.db.execute("select min(not_before) from jobs where status = ?", (PENDING,)).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def counts(self):
+        return dict(self.db.execute("select status, count(*) from jobs group by status").fetchall())
+
+    def purge(self, older_than=7 * 24 * 60 * 60):
+        # forget finished jobs, their keys stop protecting against duplicates
+        return self.db.execute("delete from jobs where status in (?, ?) and updated < ?",
+                               (DONE, FAILED, time.time() - older_than)).rowcount
+
+    def close(self):
+        self.db.close()
+
+
+class JobWorkers:
+    # handler(job) does the work and returns its result. raising makes the job run again later,
+    # on_failed(job, error) hears about jobs that ran out of attempts
+    def __init__(self, queue, handler, workers=4, on_failed=None, idle_interval=1):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.on_failed = on_failed
+        self.idle_interval = idle_interval
+        self.tasks = []
+        self.stopping = False
+
+    def start(self):
+        self.stopping = False
+        self.tasks = [asyncio.ensure_future(self.work()) for _ in range(self.workers)]
+        return self
+
+    async def wait_for_job(self):
+        due = self.queue.next_due()
+        timeout = self.idle_interval if due is None else min(due, self.idle_interval)
+        self.queue.ready.clear()
+        try:
+            await asyncio.wait_for(self.queue.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def work(self):
+        while not self.stopping:
+            job = self.queue.claim()
+            if job is None:
+                await self.wait_for_job()
+                continue
+            try:
+                result = await self.handler(job)
+            except asyncio.CancelledError:
+                # stopped half way, the next start runs it again
+                self.queue.release(job)
+                raise
+            except Exception as e:
+                if not self.queue.fail(job, e):
+                    print(f"{job} failed for good after {job.attempts} attempts: {e}")
+                    if self.on_failed is not None:
+                        try:
+                            await self.on_failed(job, e)
+                        except Exception as callback_error:
+                            print(f"{job} failure callback failed: {callback_error}")
+            else:
+                self.queue.complete(job, result)
+
+    async def stop(self, timeout=30):
+        # running jobs get timeout seconds to finish, the rest stays in the queue for the next start
+        self.stopping = True
+        self.queue.ready.set()
+        if self.tasks:
+            _, still_running = await asyncio.wait(self.tasks, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
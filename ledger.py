@@ -0,0 +1,120 @@
+import sqlite3
+import time
+from collections import Counter
+
+# what every account has already liked, mirrored and followed, so the same mutation is never
+# sent twice. filled from successful mutations and from what the full feed returns anyway: the
+# reaction, mirrors and canMirror fields of each publication and isFollowedByMe of its author.
+#
+#   Lens.ledger = ActionLedger("ledger.sqlite")
+#   await lens.like(publication_id)     # sent
+#   await lens.like(publication_id)     # answered from the ledger, counted in saved
+#
+# without a path it only lives in memory. an account's entries are read the first time the
+# account is used, writes go through to sqlite as they happen.
+
+ACTIONS = ('like', 'mirror', 'follow')
+
+
+class ActionLedger:
+    def __init__(self, path=None, settle_time=600):
+        # a read older than the indexer may still say "not followed" right after a follow went out,
+        # reads only undo entries older than settle_time seconds
+        self.path = path
+        self.settle_time = settle_time
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, isolation_level=None)
+            self.db.execute("pragma journal_mode=wal")
+            self.db.execute("pragma synchronous=normal")
+            self.db.execute("""
+                create table if not exists actions (
+                    account text not null,
+                    action text not null,
+                    target text not null,
+                    source text,
+                    done_at real not null,
+                    primary key (account, action, target)
+                ) without rowid
+            """)
+        self.accounts = {}
+        # calls that never went out because the ledger answered them, per action
+        self.saved = Counter()
+
+    def entries(self, account):
+        # {(action, target): done_at} of account, loaded on first use
+        account = account.lower()
+        entries = self.accounts.get(account)
+        if entries is None:
+            entries = self.accounts[account] = {}
+            if self.db is not None:
+                for action, target, done_at in self.db.execute(
+                        "select action, target, done_at from actions where account = ?", (account,)):
+                    entries[action, target] = done_at
+        return entries
+
+    def done(self, account, action, target):
+        return (action, str(target)) in self.entries(account)
+
+    def skip(self, account, action, target):
+        # True when the action was done before, the caller answers without calling the api
+        if not self.done(account, action, target):
+            return False
+        self.saved[action] += 1
+        return True
+
+    def record(self, account, action, target, source='mutation'):
+        self.update(account, action, done=[target], source=source)
+
+    def update(self, account, action, done=(), undone=(), source='read'):
+        # targets that turned out to be done and not done (unliked on another app, say)
+        if action not in ACTIONS:
+            raise ValueError(f"unknown action {action!r}, expected one of {', '.join(ACTIONS)}")
+        entries = self.entries(account)
+        now = time.time()
+        done = [str(target) for target in done if (action, str(target)) not in entries]
+        undone = [str(target) for target in undone
+                  if entries.get((action, str(target)), now) < now - self.settle_time]
+        if not done and not undone:
+            return
+        for target in done:
+            entries[action, target] = now
+        for target in undone:
+            del entries[action, target]
+        if self.db is not None:
+            account = account.lower()
+            with self.db:
+                self.db.execute("begin")
+                self.db.executemany("insert or replace into actions values (?, ?, ?, ?, ?)",
+                                    [(account, action, target, source, now) for target in done])
+                self.db.executemany("delete from actions where account = ? and action = ? and target = ?",
+                                    [(account, action, target) for target in undone])
+
+    def observe_feed(self, account, items):
+        # raw items of the full Timeline query, fetched with account's profile as reactionRequest
+        liked, not_liked, mirrored, not_mirrored, followed, not_followed = [], [], [], [], [], []
+        for item in items:
+            root = item.get('root') or {}
+            publication_id = root.get('id')
+            if publication_id is None:
+                continue
+            if 'reaction' in root:
+                (liked if root['reaction'] == 'UPVOTE' else not_liked).append(publication_id)
+            if 'mirrors' in root:
+                # mirrored already, or not allowed to: either way a mirror would not go through
+                can_mirror = (root.get('canMirror') or {}).get('result', True)
+                (mirrored if root['mirrors'] or not can_mirror else not_mirrored).append(publication_id)
+            profile = root.get('profile') or {}
+            if profile.get('id') and 'isFollowedByMe' in profile:
+                (followed if profile['isFollowedByMe'] else not_followed).append(profile['id'])
+        self.update(account, 'like', liked, not_liked)
+        self.update(account, 'mirror', mirrored, not_mirrored)
+        self.update(account, 'follow', followed, not_followed)
+
+    def stats(self):
+        return {"accounts": len(self.accounts), "entries": sum(len(entries) for entries in self.accounts.values()),
+                "saved": dict(self.saved)}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
@@ -1,19 +1,90 @@
 import asyncio
 import aiohttp
-from web3 import Account
-from eth_account.messages import encode_defunct
 
+import base64
+import contextlib
 import json
+import os
+import threading
+import time
 import uuid
 
+from batching import BATCHABLE, GraphQLBatcher
+from cache import ProfileCache
+from ledger import ActionLedger
+from metrics import NULL_METRICS, Metrics
+from models import CONVERTERS, Profile, RelayResult, loads
+from operations import OPERATIONS, persisted_query_not_found, persisted_query_not_supported, projected
+from scheduler import RequestScheduler
+from signing import address_of, sign_challenge
+from tracker import TxTracker
 
 
 # pip install aiohttp web3 python-dotenv
 
+# lens access tokens live for 30 minutes, refresh tokens for 7 days
+ACCESS_TOKEN_LIFETIME = 30 * 60
+REFRESH_TOKEN_LIFETIME = 7 * 24 * 60 * 60
+# renew this many seconds before the access token actually expires
+TOKEN_REFRESH_MARGIN = 60
+
+# LENS_API_URL / LENS_METADATA_URL point every client somewhere else, mockserver.py for example
+API_URL = 'https://api.lens.dev/'
+METADATA_URL = 'https://metadata.lenster.xyz/'
+
+
+class NotExecuted(Exception):
+    # the api turned a mutation away without running it: a 4xx or 429, or errors and no data.
+    # sending it again cannot do it twice
+    pass
+
+
+def token_expiry(token, default_lifetime=ACCESS_TOKEN_LIFETIME):
+    # read the exp claim of a JWT, the signature is not checked
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return time.time() + default_lifetime
+
 
 class Lens:
-    def __init__(self, private_key):
-        self.url = 'https://api.lens.dev/'
+    # connection pool shared by every account, one aiohttp session per event loop
+    session_options = {
+        "limit": 100,
+        "limit_per_host": 50,
+        "ttl_dns_cache": 300,
+        "keepalive_timeout": 30,
+        "timeout": 30,
+        "connect_timeout": 10,
+    }
+    _sessions = {}
+    # rate limits and retries for every request to the api and the metadata server
+    scheduler = RequestScheduler()
+    # handle -> profile id and address -> profile, shared by every account
+    profile_cache = ProfileCache()
+    # like, mirror and profile lookups issued close together share one http request
+    batching = False
+    batcher = GraphQLBatcher()
+    # send only the sha256 of queries the server has already seen (automatic persisted queries)
+    persisted_queries = False
+    # api url -> sha256 of the queries it has seen, and the urls that do not do persisted queries
+    persisted_hashes = {}
+    persisted_unsupported = set()
+    # one poller following every relayed transaction until lens has indexed it
+    tracker = TxTracker()
+    # likes, mirrors and follows every account has done already, they are not sent again
+    ledger = ActionLedger()
+    # latency, error and traffic numbers, see metrics.py. off until enable_metrics()
+    metrics = NULL_METRICS
+    # signing is cpu work, it runs here instead of on the event loop. None is asyncio's default
+    # thread pool, a ProcessPoolExecutor signs on every core
+    signing_executor = None
+
+    def __init__(self, private_key, login=True, url=None, metadata_url=None):
+        self.url = url or os.environ.get('LENS_API_URL') or API_URL
+        self.metadata_url = metadata_url or os.environ.get('LENS_METADATA_URL') or METADATA_URL
         self.headers = {
             "referer": "https://lenster.xyz/",
             "origin": "https://lenster.xyz/",
@@ -24,83 +95,242 @@ class Lens:
         self.headers_with_access_token = None
 
         self.private_key = private_key
-        self.address = Account.privateKeyToAccount(private_key).address
+        self.address = address_of(private_key)
         self.access_token = None
+        self.access_token_expires_at = 0
+        self.refresh_token = None
+        self.refresh_token_expires_at = 0
         self.user_id = None
         self.user_handle = None
 
         self.tx_id = None
         self.tx_hash = None
 
-        asyncio.run(self.get_profile())
+        self._login_lock = asyncio.Lock()
+        if login:
+            asyncio.run(self._login_once())
+
+    async def _login_once(self):
+        try:
+            await self.get_profile()
+        finally:
+            await Lens.close_session()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await Lens.close_session()
+
+    @classmethod
+    def configure_session(cls, **options):
+        # only sessions created after this call pick up the new options
+        unknown = set(options) - set(cls.session_options)
+        if unknown:
+            raise ValueError(f"unknown session options: {', '.join(sorted(unknown))}")
+        cls.session_options.update(options)
+
+    @classmethod
+    def get_session(cls):
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(loop)
+        if session is None or session.closed:
+            for old_loop in [old_loop for old_loop in cls._sessions if old_loop.is_closed()]:
+                del cls._sessions[old_loop]
+            options = cls.session_options
+            connector = aiohttp.TCPConnector(limit=options["limit"],
+                                             limit_per_host=options["limit_per_host"],
+                                             ttl_dns_cache=options["ttl_dns_cache"],
+                                             keepalive_timeout=options["keepalive_timeout"])
+            timeout = aiohttp.ClientTimeout(total=options["timeout"], connect=options["connect_timeout"])
+            session = cls._sessions[loop] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return session
+
+    @classmethod
+    def enable_metrics(cls, metrics=None):
+        cls.metrics = cls.scheduler.metrics = metrics or Metrics()
+        return cls.metrics
+
+    @classmethod
+    def disable_metrics(cls):
+        cls.metrics = cls.scheduler.metrics = NULL_METRICS
+
+    @classmethod
+    async def close_session(cls):
+        session = cls._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    @contextlib.asynccontextmanager
+    async def graphql(self, operation_name, variables, headers=None):
+        # post a registered operation: async with self.graphql("Challenge", variables) as response
+        operation = OPERATIONS[operation_name]
+        persisted = self.persisted_queries and self.url not in self.persisted_unsupported
+        seen = self.persisted_hashes.setdefault(self.url, set()) if persisted else set()
+        hash_only = operation.sha256 in seen
+        session = self.get_session()
+
+        async def send(payload):
+            return await self.scheduler.request(session, 'POST', self.url, account=self.address,
+                                                idempotent=not operation.mutation,
+                                                headers=headers or self.headers, data=payload)
+
+        with self.metrics.timer("lens_graphql", operation=operation_name):
+            response = await send(operation.payload(variables, persisted, hash_only))
+            try:
+                if persisted:
+                    # the body is cached by aiohttp, callers can still read it
+                    try:
+                        data = loads(await response.read())
+                    except ValueError:
+                        data = None
+                    retry = None
+                    if persisted_query_not_supported(data, response.status):
+                        # not for this server, plain queries from now on
+                        self.persisted_unsupported.add(self.url)
+                        retry = operation.payload(variables)
+                    elif hash_only and persisted_query_not_found(data):
+                        # the server forgot the hash, send the full query once more
+                        seen.discard(operation.sha256)
+                        retry = operation.payload(variables, persisted)
+                    elif response.status == 200:
+                        seen.add(operation.sha256)
+                    if retry is not None:
+                        # the server did not run the operation, sending it again is safe
+                        response.release()
+                        response = await send(retry)
+                        await response.read()
+                        if response.status == 200 and self.url not in self.persisted_unsupported:
+                            seen.add(operation.sha256)
+                yield response
+            finally:
+                response.release()
+
+    async def graphql_data(self, operation_name, variables, headers=None):
+        # decoded response of an operation, batched with others when batching is on
+        if self.batching and operation_name in BATCHABLE:
+            with self.metrics.timer("lens_graphql", operation=operation_name):
+                return await self.batcher.execute(self, operation_name, variables, headers or self.headers)
+        async with self.graphql(operation_name, variables, headers) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=response.reason)
+            return loads(await response.read())
+
+    def set_tokens(self, access_token, refresh_token):
+        self.access_token = access_token
+        self.access_token_expires_at = token_expiry(access_token)
+        self.refresh_token = refresh_token
+        self.refresh_token_expires_at = token_expiry(refresh_token, REFRESH_TOKEN_LIFETIME)
+        self.headers_with_access_token = {
+            "referer": "https://lenster.xyz/",
+            "origin": "https://lenster.xyz/",
+            "content-type": "application/json",
+            "x-access-token": f"Bearer {access_token}",
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
+                          "like Gecko) Chrome/102.0.0.0 Safari/537.36 "
+        }
+
+    def is_logged_in(self):
+        return self.user_id is not None and \
+            time.time() < self.access_token_expires_at - TOKEN_REFRESH_MARGIN
+
+    async def ensure_login(self):
+        # reuse the tokens we already hold, refresh them when they are about to expire
+        # and only fall back to a full challenge/sign/authenticate round when we must
+        if self.is_logged_in():
+            return True
+        async with self._login_lock:
+            # concurrent callers wait for the first one instead of logging in again
+            if self.is_logged_in():
+                return True
+            if self.user_id is not None and self.refresh_token is not None \
+                    and time.time() < self.refresh_token_expires_at - TOKEN_REFRESH_MARGIN:
+                with self.metrics.timer("lens_login", kind="refresh"):
+                    refreshed = await self.refresh_access_token()
+                if refreshed:
+                    return True
+            with self.metrics.timer("lens_login", kind="signature"):
+                await self.get_profile()
+            if not self.is_logged_in():
+                self.metrics.inc("lens_login_failures_total")
+            return self.is_logged_in()
 
     async def get_message_for_signature(self):
-        payload = {
-            "operationName": "Challenge",
-            "variables": {
-                "request": {
-                    "address": f"{self.address}"
-                }
-            },
-            "query": "query Challenge($request: ChallengeRequest!) {\n  challenge(request: $request) {\n    text\n    "
-                     "__typename\n  }\n} "
+        variables = {
+            "request": {
+                "address": f"{self.address}"
+            }
         }
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    message = (await response.json())['data']['challenge']['text']
-                    return message
+            async with self.graphql("Challenge", variables, self.headers) as response:
+                message = loads(await response.read())['data']['challenge']['text']
+                return message
         except Exception as e:
             print(f"Request failed: get message for signature {e}")
             return False
 
     async def get_signature(self):
         message = await self.get_message_for_signature()
-        message_hash = encode_defunct(text=message)
-        signed_message = Account.sign_message(
-            message_hash, private_key=self.private_key)
-        signature = signed_message.signature.hex()
+        if not message:
+            return False
+        loop = asyncio.get_running_loop()
+        with self.metrics.timer("lens_sign"):
+            signature = await loop.run_in_executor(self.signing_executor, sign_challenge, self.private_key, message)
         return signature
 
-    async def get_access_token(self):
-        signature = await self.get_signature()
-        payload = {
-            "operationName": "Authenticate",
-            "variables": {
-                "request": {
-                    "address": f"{self.address}",
-                    "signature": f"{signature}"
-                }
-            },
-            "query": "mutation Authenticate($request: SignedAuthChallenge!) {\n  authenticate(request: $request) {\n  "
-                     "  accessToken\n    refreshToken\n    __typename\n  }\n} "
+    async def get_access_token(self, signature=None):
+        # signature of the current challenge when the caller already has one, see warmup.py
+        signature = signature or await self.get_signature()
+        if not signature:
+            return None
+        variables = {
+            "request": {
+                "address": f"{self.address}",
+                "signature": f"{signature}"
+            }
         }
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.url, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        access_token = data['data']['authenticate']['accessToken']
-                        # refresh_token = data['data']['authenticate']['refreshToken']
-                        self.access_token = access_token
-                        self.headers_with_access_token = {
-                            "referer": "https://lenster.xyz/",
-                            "origin": "https://lenster.xyz/",
-                            "content-type": "application/json",
-                            "x-access-token": f"Bearer {access_token}",
-                            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
-                                          "like Gecko) Chrome/102.0.0.0 Safari/537.36 "
-                        }
-                        # print("get access token success")
-                        return access_token
-                    else:
-                        print(f"Error: {response.status}")
+            async with self.graphql("Authenticate", variables, self.headers) as response:
+                if response.status == 200:
+                    data = loads(await response.read())
+                    access_token = data['data']['authenticate']['accessToken']
+                    refresh_token = data['data']['authenticate']['refreshToken']
+                    self.set_tokens(access_token, refresh_token)
+                    # print("get access token success")
+                    return access_token
+                else:
+                    print(f"Error: {response.status}")
 
         except aiohttp.ClientError as e:
             print(f"get access token fail: {e}")
 
-    async def get_profile(self):
-        access_token = await self.get_access_token()
+    async def refresh_access_token(self):
+        variables = {
+            "request": {
+                "refreshToken": f"{self.refresh_token}"
+            }
+        }
+        try:
+            async with self.graphql("Refresh", variables, self.headers) as response:
+                data = loads(await response.read())
+                access_token = data['data']['refresh']['accessToken']
+                refresh_token = data['data']['refresh']['refreshToken']
+                self.set_tokens(access_token, refresh_token)
+                return access_token
+        except Exception as e:
+            print(f"{self.address} refresh access token fail: {e}")
+            self.refresh_token = None
+            return False
+
+    async def get_profile(self, signature=None):
+        access_token = await self.get_access_token(signature)
+        cached = self.profile_cache.addresses.get(self.address.lower())
+        if access_token and cached:
+            self.user_id = cached["id"]
+            self.user_handle = cached["handle"]
+            return Profile(cached["id"], cached["handle"], cached["name"], self.address,
+                           cached["totalFollowers"], cached["totalFollowing"])
         headers = {
             "referer": "https://lenster.xyz/",
             "origin": "https://lenster.xyz/",
@@ -109,80 +339,77 @@ class Lens:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                           "Chrome/102.0.0.0 Safari/537.36 "
         }
-        payload = {
-            "operationName": "UserProfiles",
-            "variables": {
-                "ownedBy": self.address
-            },
-            "query": "query UserProfiles($ownedBy: [EthereumAddress!]) {\n  profiles(request: {ownedBy: $ownedBy}) {"
-                     "\n    items {\n      ...ProfileFields\n      interests\n      isDefault\n      dispatcher {\n   "
-                     "     canUseRelay\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n  "
-                     "userSigNonces {\n    lensHubOnChainSigNonce\n    __typename\n  }\n}\n\nfragment ProfileFields "
-                     "on Profile {\n  id\n  name\n  handle\n  bio\n  ownedBy\n  isFollowedByMe\n  stats {\n    "
-                     "totalFollowers\n    totalFollowing\n    __typename\n  }\n  attributes {\n    key\n    value\n   "
-                     " __typename\n  }\n  picture {\n    ... on MediaSet {\n      original {\n        url\n        "
-                     "__typename\n      }\n      __typename\n    }\n    ... on NftImage {\n      uri\n      "
-                     "__typename\n    }\n    __typename\n  }\n  followModule {\n    __typename\n  }\n  __typename\n} "
+        variables = {
+            "ownedBy": self.address
         }
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.url, headers=headers, data=json.dumps(payload)) as response:
-                    data = await response.json()
-                    result = {
-                        "id": data["data"]["profiles"]["items"][0]["id"],
-                        "name": data["data"]["profiles"]["items"][0]["name"],
-                        "handle": data["data"]["profiles"]["items"][0]["handle"],
-                        "totalFollowers": data["data"]["profiles"]["items"][0]["stats"]["totalFollowers"],
-                        "totalFollowing": data["data"]["profiles"]["items"][0]["stats"]["totalFollowing"]
-                    }
-                    # print("get user profile success")
-                    self.user_id = data["data"]["profiles"]["items"][0]["id"]
-                    self.user_handle = data["data"]["profiles"]["items"][0]["handle"]
-                    # return result
+            async with self.graphql("UserProfiles", variables, headers) as response:
+                data = loads(await response.read())
+                item = data["data"]["profiles"]["items"][0]
+                profile = Profile.from_data(item)
+                # print("get user profile success")
+                self.profile_cache.remember(item)
+                self.user_id = profile.id
+                self.user_handle = profile.handle
+                return profile
         except Exception as e:
             print(f"{self.address} failed to get profile: {e}")
             return False
 
-    async def get_post_context_arid(self, post_context):
-        # Arweave id
-        url = "https://metadata.lenster.xyz/"
-
+    async def get_post_context_arid(self, post_context, metadata_id=None, media=None):
+        # Arweave id. uploading again with the same metadata_id gives the same post.
+        # media are uploaded Media (media.py), the first one is the post's main content
+        media = media or []
+        main = media[0] if media else None
         payload = {
             "version": "2.0.0",
-            "metadata_id": str(uuid.uuid4()),
+            "metadata_id": metadata_id or str(uuid.uuid4()),
             "description": post_context,
             "content": post_context,
             "external_url": f"https://lenster.xyz/u/{self.user_handle}",
-            "image": None,
-            "imageMimeType": "image/svg+xml",
+            "image": main.url if main is not None and main.kind == "IMAGE" else None,
+            "imageMimeType": main.mime_type if main is not None and main.kind == "IMAGE" else "image/svg+xml",
             "name": f"Post by @{self.user_handle}",
             "tags": [],
-            "animation_url": None,
-            "mainContentFocus": "TEXT_ONLY",
+            "animation_url": main.url if main is not None and main.kind != "IMAGE" else None,
+            "mainContentFocus": main.kind if main is not None else "TEXT_ONLY",
             "contentWarning": None,
             "attributes": [{
                 "traitType": "type",
                 "displayType": "string",
-                "value": "text_only"
+                "value": main.kind.lower() if main is not None else "text_only"
             }],
-            "media": [],
+            "media": [{"item": item.url, "type": item.mime_type, "altTag": ""} for item in media],
             "locale": "en-US",
             "appId": "Lenster"
         }
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=self.headers, json=payload) as response:
-                    data = await response.json()
+        try:
+            # metadata_id makes the upload safe to send twice
+            with self.metrics.timer("lens_metadata_upload"):
+                response = await self.scheduler.request(self.get_session(), 'POST', self.metadata_url,
+                                                        account=self.address, headers=self.headers, json=payload)
+                async with response:
+                    data = loads(await response.read())
                     # print("get post_context arid success")
                     return data['id']
-            except Exception as e:
-                print(
-                    f"{self.user_handle} get post context arid failed: {e}")
-                return False
+        except Exception as e:
+            print(
+                f"{self.user_handle} get post context arid failed: {e}")
+            return False
 
-    async def post(self, post_context):
-        arid = await self.get_post_context_arid(post_context)
+    def track(self, tx_id=None, tx_hash=None, proxy_action_id=None, callback=None):
+        # future resolving to a TxStatus once the transaction is indexed, see tracker.py
+        return self.tracker.track(self, tx_id, tx_hash, proxy_action_id, callback)
+
+    async def post(self, post_context, on_indexed=None, media=None):
+        arid = await self.get_post_context_arid(post_context, media=media)
+        if not arid:
+            return False
+        return await self.create_post(arid, post_context, on_indexed)
+
+    async def relay_post(self, arid, post_context, on_indexed=None):
+        # RelayResult of the dispatcher, its reason says why nothing was relayed. raises on request errors
         headers = {
             "referer": "https://claim.lens.xyz/",
             "origin": "https://claim.lens.xyz",
@@ -191,114 +418,156 @@ class Lens:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                           "Chrome/102.0.0.0 Safari/537.36 "
         }
-        payload = {
-            "operationName": "CreatePostViaDispatcher",
-            "variables": {
-                "request": {
-                    "profileId": self.user_id,
-                    "contentURI": f"https://arweave.net/{arid}",
-                    "collectModule": {
-                        "revertCollectModule": True
-                    },
-                    "referenceModule": {
-                        "degreesOfSeparationReferenceModule": {
-                            "commentsRestricted": True,
-                            "mirrorsRestricted": True,
-                            "degreesOfSeparation": 2
-                        }
+        variables = {
+            "request": {
+                "profileId": self.user_id,
+                "contentURI": f"https://arweave.net/{arid}",
+                "collectModule": {
+                    "revertCollectModule": True
+                },
+                "referenceModule": {
+                    "degreesOfSeparationReferenceModule": {
+                        "commentsRestricted": True,
+                        "mirrorsRestricted": True,
+                        "degreesOfSeparation": 2
                     }
                 }
-            },
-            "query": "mutation CreatePostViaDispatcher($request: CreatePublicPostRequest!) {\n  "
-                     "createPostViaDispatcher(request: $request) {\n    ...RelayerResultFields\n    __typename\n  "
-                     "}\n}\n\nfragment RelayerResultFields on RelayResult {\n  ... on RelayerResult {\n    txHash\n   "
-                     " txId\n    __typename\n  }\n  ... on RelayError {\n    reason\n    __typename\n  }\n  "
-                     "__typename\n} "
+            }
         }
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(self.url, headers=headers, json=payload) as response:
-                    data = await response.json()
-                    if data['data']['createPostViaDispatcher']['txId'] != "":
-                        # print(f"{self.user_handle} post: {post_context} success")
-                        return f"{self.user_handle} post: {post_context} success"
-                    else:
-                        # print(f"{self.user_handle} post fail")
-                        return print(f"{self.user_handle} post fail")
-
-            except Exception as e:
-                print(f"{self.user_handle} post fail: {e}")
-                return False
+        try:
+            async with self.graphql("CreatePostViaDispatcher", variables, headers) as response:
+                status = response.status
+                body = await response.read()
+            if 400 <= status < 500:
+                raise NotExecuted(f"CreatePostViaDispatcher answered {status}")
+            data = loads(body)
+            if data.get('data') is None and data.get('errors'):
+                raise NotExecuted(f"CreatePostViaDispatcher answered {data['errors'][0].get('message')}")
+            relayed = RelayResult.from_data(data['data']['createPostViaDispatcher'])
+        except Exception:
+            self.metrics.inc("lens_actions_total", action="post", result="failed")
+            raise
+        if relayed.ok:
+            self.tx_id = relayed.tx_id
+            self.tx_hash = relayed.tx_hash
+            self.track(self.tx_id, self.tx_hash, callback=on_indexed)
+            self.metrics.inc("lens_actions_total", action="post", result="ok")
+        else:
+            self.metrics.inc("lens_actions_total", action="post", result="failed")
+        return relayed
+
+    async def create_post(self, arid, post_context, on_indexed=None):
+        try:
+            relayed = await self.relay_post(arid, post_context, on_indexed)
+        except Exception as e:
+            print(f"{self.user_handle} post fail: {e}")
+            return False
+        if relayed.ok:
+            # print(f"{self.user_handle} post: {post_context} success")
+            return f"{self.user_handle} post: {post_context} success"
+        # print(f"{self.user_handle} post fail")
+        return print(f"{self.user_handle} post fail")
+
+    async def post_many(self, post_contexts, upload_workers=4, submit_workers=2, on_indexed=None):
+        # metadata uploads run side by side and every finished upload goes straight on to the
+        # dispatcher, so a slow upload never holds back the posts behind it.
+        # results are in the order of post_contexts, a failed upload is False
+        results = [False] * len(post_contexts)
+        uploads = asyncio.Queue()
+        submissions = asyncio.Queue()
+        for item in enumerate(post_contexts):
+            uploads.put_nowait(item)
+
+        # uploading only needs the handle, so a token refresh can happen while the first uploads run
+        login = asyncio.ensure_future(self.ensure_login())
+        if self.user_handle is None:
+            await asyncio.shield(login)
+
+        async def upload():
+            while not uploads.empty():
+                index, post_context = uploads.get_nowait()
+                arid = await self.get_post_context_arid(post_context)
+                if arid:
+                    await submissions.put((index, post_context, arid))
+
+        async def submit():
+            logged_in = await asyncio.shield(login)
+            while True:
+                item = await submissions.get()
+                if item is None:
+                    return
+                index, post_context, arid = item
+                if logged_in:
+                    results[index] = await self.create_post(arid, post_context, on_indexed)
+
+        uploaders = [asyncio.ensure_future(upload()) for _ in range(min(upload_workers, len(post_contexts)))]
+        submitters = [asyncio.ensure_future(submit()) for _ in range(submit_workers)]
+        try:
+            await asyncio.gather(*uploaders)
+            for _ in submitters:
+                submissions.put_nowait(None)
+            await asyncio.gather(*submitters)
+        finally:
+            for task in uploaders + submitters:
+                task.cancel()
+        return results
 
     async def get_recommended_users(self):
 
-        payload = {"operationName": "RecommendedProfiles", "variables": {"options": {"shuffle": False}},
-                   "query": "query RecommendedProfiles($options: RecommendedProfileOptions) {\n  recommendedProfiles("
-                            "options: $options) {\n    ...ProfileFields\n    isFollowedByMe\n    __typename\n  "
-                            "}\n}\n\nfragment ProfileFields on Profile {\n  id\n  name\n  handle\n  bio\n  ownedBy\n  "
-                            "isFollowedByMe\n  stats {\n    totalFollowers\n    totalFollowing\n    __typename\n  }\n "
-                            " attributes {\n    key\n    value\n    __typename\n  }\n  picture {\n    ... on MediaSet "
-                            "{\n      original {\n        url\n        __typename\n      }\n      __typename\n    }\n "
-                            "   ... on NftImage {\n      uri\n      __typename\n    }\n    __typename\n  }\n  "
-                            "followModule {\n    __typename\n  }\n  __typename\n}"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, data=json.dumps(payload), headers=self.headers) as response:
-                data = await response.json()
-                recommended_users_list = []
-                for user in data['data']['recommendedProfiles']:
-                    recommended_users_list.append(user['handle'])
-                print(recommended_users_list)
-                return recommended_users_list
+        variables = {"options": {"shuffle": False}}
+        async with self.graphql("RecommendedProfiles", variables, self.headers) as response:
+            data = loads(await response.read())
+            recommended_users_list = []
+            for user in data['data']['recommendedProfiles']:
+                self.profile_cache.remember(user)
+                recommended_users_list.append(user['handle'])
+            print(recommended_users_list)
+            return recommended_users_list
 
     async def get_profile_by_handle(self, user_handle):
         # get the profile id then you can follow
         # user_profile = await self.get_profile()
-        payload = {
-            'operationName': 'Profile',
-            'variables': {
-                'request': {
-                    'handle': user_handle
-                },
-                'who': self.user_id
+        # cached, and concurrent lookups of the same handle share one request
+        return await self.profile_cache.handles.get_or_load(
+            user_handle.lower(), lambda: self.fetch_profile_id(user_handle))
+
+    async def fetch_profile_id(self, user_handle):
+        variables = {
+            'request': {
+                'handle': user_handle
             },
-            'query': 'query Profile($request: SingleProfileQueryRequest!, $who: ProfileId) {\n  profile(request: '
-                     '$request) {\n    id\n    handle\n    ownedBy\n    name\n    bio\n    metadata\n    '
-                     'followNftAddress\n    isFollowedByMe\n    isFollowing(who: $who)\n    attributes {\n      key\n '
-                     '     value\n      __typename\n    }\n    dispatcher {\n      canUseRelay\n      __typename\n    '
-                     '}\n    onChainIdentity {\n      proofOfHumanity\n      sybilDotOrg {\n        verified\n        '
-                     'source {\n          twitter {\n            handle\n            __typename\n          }\n        '
-                     '  __typename\n        }\n        __typename\n      }\n      ens {\n        name\n        '
-                     '__typename\n      }\n      worldcoin {\n        isHuman\n        __typename\n      }\n      '
-                     '__typename\n    }\n    stats {\n      totalFollowers\n      totalFollowing\n      totalPosts\n  '
-                     '    totalComments\n      totalMirrors\n      __typename\n    }\n    picture {\n      ... on '
-                     'MediaSet {\n        original {\n          url\n          __typename\n        }\n        '
-                     '__typename\n      }\n      ... on NftImage {\n        uri\n        __typename\n      }\n      '
-                     '__typename\n    }\n    coverPicture {\n      ... on MediaSet {\n        original {\n          '
-                     'url\n          __typename\n        }\n        __typename\n      }\n      __typename\n    }\n    '
-                     'followModule {\n      __typename\n    }\n    __typename\n  }\n} '
+            'who': self.user_id
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, data=json.dumps(payload), headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if 'profile' in data['data']:
-                        print(
-                            f"{user_handle}'s profile_id is {data['data']['profile']['id']}")
-                        return data['data']['profile']['id']
-                        # 'isFollowedByMe': data['data']['profile']['isFollowedByMe'],
-                        # 'isFollowing': data['data']['profile']['isFollowing']
+        try:
+            data = await self.graphql_data("Profile", variables, self.headers)
+        except Exception as e:
+            print(
+                f'{self.user_handle} request fail: {e}')
+            return False
+        if (data.get('data') or {}).get('profile'):
+            print(
+                f"{user_handle}'s profile_id is {data['data']['profile']['id']}")
+            return data['data']['profile']['id']
+            # 'isFollowedByMe': data['data']['profile']['isFollowedByMe'],
+            # 'isFollowing': data['data']['profile']['isFollowing']
+
+        else:
+            print(
+                f'{self.user_handle} fail to get profile id: {data}')
+            return False
 
-                    else:
-                        print(
-                            f'{self.user_handle} fail to get profile id: {data}')
-                        return False
-                else:
-                    print(
-                        f'{self.user_handle} request fail: {response.status}')
-                    return False
+    def already_done(self, action, target):
+        # the ledger knows this action went through before, no need to ask the api
+        if not self.ledger.skip(self.address, action, target):
+            return False
+        print(f"{self.user_handle} {action} {target} already done")
+        self.metrics.inc("lens_calls_saved_total", action=action)
+        return True
 
-    async def follow(self, user_handle):
+    async def follow(self, user_handle, on_indexed=None):
         to_be_follow_profile_id = await self.get_profile_by_handle(user_handle)
+        if to_be_follow_profile_id and self.already_done("follow", to_be_follow_profile_id):
+            return True
         headers = {
             "referer": "https://claim.lens.xyz/",
             "origin": "https://claim.lens.xyz",
@@ -307,58 +576,67 @@ class Lens:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                           "Chrome/102.0.0.0 Safari/537.36 "
         }
-        payload = {
-            'operationName': 'ProxyAction',
-            'variables': {
-                'request': {
-                    'follow': {
-                        'freeFollow': {
-                            'profileId': to_be_follow_profile_id
-                        }
+        variables = {
+            'request': {
+                'follow': {
+                    'freeFollow': {
+                        'profileId': to_be_follow_profile_id
                     }
                 }
-            },
-            'query': 'mutation ProxyAction($request: ProxyActionRequest!) {\n  proxyAction(request: $request)\n}'
+            }
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, data=json.dumps(payload), headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    print(data)
-                    print(
-                        f"{self.user_handle} follow {to_be_follow_profile_id} success")
-                else:
-                    print(
-                        f"{self.user_handle} follow {to_be_follow_profile_id}  fail : {response.status}")
-                    return False
+        async with self.graphql("ProxyAction", variables, headers) as response:
+            if response.status == 200:
+                data = loads(await response.read())
+                print(data)
+                proxy_action_id = (data.get('data') or {}).get('proxyAction')
+                if proxy_action_id:
+                    self.track(proxy_action_id=proxy_action_id, callback=on_indexed)
+                    self.ledger.record(self.address, "follow", to_be_follow_profile_id)
+                print(
+                    f"{self.user_handle} follow {to_be_follow_profile_id} success")
+                self.metrics.inc("lens_actions_total", action="follow", result="ok")
+                return True
+            else:
+                print(
+                    f"{self.user_handle} follow {to_be_follow_profile_id}  fail : {response.status}")
+                self.metrics.inc("lens_actions_total", action="follow", result="failed")
+                return False
 
     async def like(self, publication_id):
         # need to get publication_id first  publication_id : 0x012ba5-0x0122
-        payload = {
-            "operationName": "AddReaction",
-            "variables": {
-                "request": {
-                    "profileId": f"{self.user_id}",
-                    "reaction": "UPVOTE",
-                    "publicationId": f"{publication_id}"
-                }
-            },
-            "query": "mutation AddReaction($request: ReactionRequest!) {\n  addReaction(request: $request)\n}"
+        if self.already_done("like", publication_id):
+            return True
+        variables = {
+            "request": {
+                "profileId": f"{self.user_id}",
+                "reaction": "UPVOTE",
+                "publicationId": f"{publication_id}"
+            }
         }
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    data = await response.json()
-                    if data['data']['addReaction'] is None:
-                        print(
-                            f"{self.user_handle} like {publication_id} success ")
-                    else:
-                        print(f"{self.user_handle} like fail")
+            # reactions need the access token like every other mutation
+            headers = self.headers_with_access_token or self.headers
+            data = await self.graphql_data("AddReaction", variables, headers)
+            if data['data']['addReaction'] is None and not data.get('errors'):
+                print(
+                    f"{self.user_handle} like {publication_id} success ")
+                self.ledger.record(self.address, "like", publication_id)
+                self.metrics.inc("lens_actions_total", action="like", result="ok")
+                return True
+            else:
+                print(f"{self.user_handle} like fail")
+                self.metrics.inc("lens_actions_total", action="like", result="failed")
+                return False
         except Exception as e:
             print(e)
+            self.metrics.inc("lens_actions_total", action="like", result="failed")
+            return False
 
-    async def mirror(self, publication_id):
+    async def mirror(self, publication_id, on_indexed=None):
         # need to get publication_id first  publication_id : 0x012ba5-0x0122
+        if self.already_done("mirror", publication_id):
+            return True
         headers = {
             "referer": "https://claim.lens.xyz/",
             "origin": "https://claim.lens.xyz",
@@ -367,82 +645,71 @@ class Lens:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                           "Chrome/102.0.0.0 Safari/537.36 "
         }
-        payload = {"operationName": "CreateMirrorViaDispatcher", "variables": {
+        variables = {
             "request": {"profileId": f"{self.user_id}", "publicationId": f"{publication_id}",
-                        "referenceModule": {"followerOnlyReferenceModule": False}}},
-                   "query": "mutation CreateMirrorViaDispatcher($request: CreateMirrorRequest!) {\n  "
-                            "createMirrorViaDispatcher(request: $request) {\n    ...RelayerResultFields\n    "
-                            "__typename\n  }\n}\n\nfragment RelayerResultFields on RelayResult {\n  ... on "
-                            "RelayerResult {\n    txHash\n    txId\n    __typename\n  }\n  ... on RelayError {\n    "
-                            "reason\n    __typename\n  }\n  __typename\n}"}
+                        "referenceModule": {"followerOnlyReferenceModule": False}}}
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    data = await response.json()
-                    if data['data']['createMirrorViaDispatcher']['txHash'] is not None:
-                        print(
-                            f"{self.user_handle} mirror {publication_id} success ")
-                    else:
-                        print(f"{self.user_handle} mirror fail")
+            data = await self.graphql_data("CreateMirrorViaDispatcher", variables, headers)
+            relayed = RelayResult.from_data(data['data']['createMirrorViaDispatcher'])
+            if relayed.ok:
+                self.tx_id = relayed.tx_id
+                self.tx_hash = relayed.tx_hash
+                self.track(self.tx_id, self.tx_hash, callback=on_indexed)
+                print(
+                    f"{self.user_handle} mirror {publication_id} success ")
+                self.ledger.record(self.address, "mirror", publication_id)
+                self.metrics.inc("lens_actions_total", action="mirror", result="ok")
+                return True
+            else:
+                print(f"{self.user_handle} mirror fail")
+                self.metrics.inc("lens_actions_total", action="mirror", result="failed")
+                return False
         except Exception as e:
             print(e)
+            self.metrics.inc("lens_actions_total", action="mirror", result="failed")
+            return False
 
-    async def get_followers(self, profile_id):
-
-        payload = {"operationName": "Followers", "variables": {"request": {"profileId": f"{profile_id}", "limit": 30}},
-                   "query": "query Followers($request: FollowersRequest!) {\n  followers(request: $request) {\n    "
-                            "items {\n      wallet {\n        address\n        defaultProfile {\n          "
-                            "...ProfileFields\n          isFollowedByMe\n          __typename\n        }\n        "
-                            "__typename\n      }\n      totalAmountOfTimesFollowed\n      __typename\n    }\n    "
-                            "pageInfo {\n      next\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment "
-                            "ProfileFields on Profile {\n  id\n  name\n  handle\n  bio\n  ownedBy\n  isFollowedByMe\n "
-                            " stats {\n    totalFollowers\n    totalFollowing\n    __typename\n  }\n  attributes {\n  "
-                            "  key\n    value\n    __typename\n  }\n  picture {\n    ... on MediaSet {\n      "
-                            "original {\n        url\n        __typename\n      }\n      __typename\n    }\n    ... "
-                            "on NftImage {\n      uri\n      __typename\n    }\n    __typename\n  }\n  followModule {"
-                            "\n    __typename\n  }\n  __typename\n}"}
+    async def get_followers(self, profile_id, projection=None):
+        # handles, or Profile objects filled up to projection ("ids", "summary" or "full")
+        variables = {"request": {"profileId": f"{profile_id}", "limit": 30}}
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    data = await response.json()
-                    followers_list = []
-                    for follower in data['data']['followers']['items']:
-                        handle = follower['wallet']['defaultProfile']['handle']
-                        followers_list.append(handle)
-                    print(followers_list)
-                    return followers_list
+            async with self.graphql(projected("Followers", projection or "ids"), variables,
+                                    self.headers) as response:
+                data = loads(await response.read())
+                followers_list = []
+                for follower in data['data']['followers']['items']:
+                    self.profile_cache.remember(follower['wallet']['defaultProfile'])
+                    if projection is None:
+                        followers_list.append(follower['wallet']['defaultProfile']['handle'])
+                    else:
+                        followers_list.append(CONVERTERS["Followers"](follower))
+                print(followers_list)
+                return followers_list
 
         except Exception as e:
             print(e)
 
-    async def get_following(self, address):
-        payload = {"operationName": "Following",
-                   "variables": {"request": {"address": f"{address}", "limit": 30}},
-                   "query": "query Following($request: FollowingRequest!) {\n  following(request: $request) {\n    "
-                            "items {\n      profile {\n        ...ProfileFields\n        isFollowedByMe\n        "
-                            "__typename\n      }\n      totalAmountOfTimesFollowing\n      __typename\n    }\n    "
-                            "pageInfo {\n      next\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment "
-                            "ProfileFields on Profile {\n  id\n  name\n  handle\n  bio\n  ownedBy\n  isFollowedByMe\n "
-                            " stats {\n    totalFollowers\n    totalFollowing\n    __typename\n  }\n  attributes {\n  "
-                            "  key\n    value\n    __typename\n  }\n  picture {\n    ... on MediaSet {\n      "
-                            "original {\n        url\n        __typename\n      }\n      __typename\n    }\n    ... "
-                            "on NftImage {\n      uri\n      __typename\n    }\n    __typename\n  }\n  followModule {"
-                            "\n    __typename\n  }\n  __typename\n}"}
+    async def get_following(self, address, projection=None):
+        # handles, or Profile objects filled up to projection ("ids", "summary" or "full")
+        variables = {"request": {"address": f"{address}", "limit": 30}}
         try:
-            async with aiohttp.ClientSession(headers=self.headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    data = await response.json()
-                    following_list = []
-                    for follower in data['data']['following']['items']:
-                        handle = follower['profile']['handle']
-                        following_list.append(handle)
-                    print(following_list)
-                    return following_list
+            async with self.graphql(projected("Following", projection or "ids"), variables,
+                                    self.headers) as response:
+                data = loads(await response.read())
+                following_list = []
+                for follower in data['data']['following']['items']:
+                    self.profile_cache.remember(follower['profile'])
+                    if projection is None:
+                        following_list.append(follower['profile']['handle'])
+                    else:
+                        following_list.append(CONVERTERS["Following"](follower))
+                print(following_list)
+                return following_list
         except Exception as e:
             print(e)
 
-    async def get_feed(self):
-        # get publication_id
+    async def get_feed(self, projection=None):
+        # publication ids, or Publication objects filled up to projection ("ids", "summary" or "full")
         headers = {
             "referer": "https://claim.lens.xyz/",
             "origin": "https://claim.lens.xyz",
@@ -451,132 +718,137 @@ class Lens:
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
                           "Chrome/102.0.0.0 Safari/537.36 "
         }
-        payload = {"operationName": "Timeline",
-                   "variables": {"request": {"profileId": f"{self.user_id}", "limit": 10,
-                                             "feedEventItemTypes": ["POST", "COMMENT",
-                                                                    "COLLECT_POST",
-                                                                    "COLLECT_COMMENT",
-                                                                    "MIRROR"]},
-                                 "reactionRequest": {"profileId": f"{self.user_id}"},
-                                 "profileId": f"{self.user_id}"},
-                   "query": "query Timeline($request: FeedRequest!, $reactionRequest: ReactionFieldResolverRequest, "
-                            "$profileId: ProfileId) {\n  feed(request: $request) {\n    items {\n      root {\n       "
-                            " ... on Post {\n          ...PostFields\n          __typename\n        }\n        ... on "
-                            "Comment {\n          ...CommentFields\n          __typename\n        }\n        "
-                            "__typename\n      }\n      electedMirror {\n        mirrorId\n        profile {\n        "
-                            "  ...ProfileFields\n          __typename\n        }\n        timestamp\n        "
-                            "__typename\n      }\n      mirrors {\n        profile {\n          ...ProfileFields\n    "
-                            "      __typename\n        }\n        timestamp\n        __typename\n      }\n      "
-                            "collects {\n        profile {\n          ...ProfileFields\n          __typename\n        "
-                            "}\n        timestamp\n        __typename\n      }\n      reactions {\n        profile {"
-                            "\n          ...ProfileFields\n          __typename\n        }\n        reaction\n        "
-                            "timestamp\n        __typename\n      }\n      comments {\n        ...CommentFields\n     "
-                            "   __typename\n      }\n      __typename\n    }\n    pageInfo {\n      next\n      "
-                            "__typename\n    }\n    __typename\n  }\n}\n\nfragment PostFields on Post {\n  id\n  "
-                            "profile {\n    ...ProfileFields\n    __typename\n  }\n  reaction(request: "
-                            "$reactionRequest)\n  mirrors(by: $profileId)\n  hasCollectedByMe\n  onChainContentURI\n  "
-                            "isGated\n  canComment(profileId: $profileId) {\n    result\n    __typename\n  }\n  "
-                            "canMirror(profileId: $profileId) {\n    result\n    __typename\n  }\n  canDecrypt("
-                            "profileId: $profileId) {\n    result\n    reasons\n    __typename\n  }\n  collectModule "
-                            "{\n    ...CollectModuleFields\n    __typename\n  }\n  stats {\n    ...StatsFields\n    "
-                            "__typename\n  }\n  metadata {\n    ...MetadataFields\n    __typename\n  }\n  hidden\n  "
-                            "createdAt\n  appId\n  __typename\n}\n\nfragment ProfileFields on Profile {\n  id\n  "
-                            "name\n  handle\n  bio\n  ownedBy\n  isFollowedByMe\n  stats {\n    totalFollowers\n    "
-                            "totalFollowing\n    __typename\n  }\n  attributes {\n    key\n    value\n    "
-                            "__typename\n  }\n  picture {\n    ... on MediaSet {\n      original {\n        url\n     "
-                            "   __typename\n      }\n      __typename\n    }\n    ... on NftImage {\n      uri\n      "
-                            "__typename\n    }\n    __typename\n  }\n  followModule {\n    __typename\n  }\n  "
-                            "__typename\n}\n\nfragment CollectModuleFields on CollectModule {\n  ... on "
-                            "FreeCollectModuleSettings {\n    type\n    contractAddress\n    followerOnly\n    "
-                            "__typename\n  }\n  ... on FeeCollectModuleSettings {\n    type\n    referralFee\n    "
-                            "contractAddress\n    followerOnly\n    amount {\n      ...ModuleFeeAmountFields\n      "
-                            "__typename\n    }\n    __typename\n  }\n  ... on LimitedFeeCollectModuleSettings {\n    "
-                            "type\n    collectLimit\n    referralFee\n    contractAddress\n    followerOnly\n    "
-                            "amount {\n      ...ModuleFeeAmountFields\n      __typename\n    }\n    __typename\n  }\n "
-                            " ... on LimitedTimedFeeCollectModuleSettings {\n    type\n    collectLimit\n    "
-                            "endTimestamp\n    referralFee\n    contractAddress\n    followerOnly\n    amount {\n     "
-                            " ...ModuleFeeAmountFields\n      __typename\n    }\n    __typename\n  }\n  ... on "
-                            "TimedFeeCollectModuleSettings {\n    type\n    endTimestamp\n    referralFee\n    "
-                            "contractAddress\n    followerOnly\n    amount {\n      ...ModuleFeeAmountFields\n      "
-                            "__typename\n    }\n    __typename\n  }\n  ... on MultirecipientFeeCollectModuleSettings "
-                            "{\n    type\n    contractAddress\n    amount {\n      ...ModuleFeeAmountFields\n      "
-                            "__typename\n    }\n    optionalCollectLimit: collectLimit\n    referralFee\n    "
-                            "followerOnly\n    optionalEndTimestamp: endTimestamp\n    recipients {\n      "
-                            "recipient\n      split\n      __typename\n    }\n    __typename\n  }\n  "
-                            "__typename\n}\n\nfragment ModuleFeeAmountFields on ModuleFeeAmount {\n  asset {\n    "
-                            "symbol\n    decimals\n    address\n    __typename\n  }\n  value\n  "
-                            "__typename\n}\n\nfragment StatsFields on PublicationStats {\n  totalUpvotes\n  "
-                            "totalAmountOfMirrors\n  totalAmountOfCollects\n  totalAmountOfComments\n  "
-                            "__typename\n}\n\nfragment MetadataFields on MetadataOutput {\n  name\n  content\n  "
-                            "image\n  attributes {\n    traitType\n    value\n    __typename\n  }\n  cover {\n    "
-                            "original {\n      url\n      __typename\n    }\n    __typename\n  }\n  media {\n    "
-                            "original {\n      url\n      mimeType\n      __typename\n    }\n    __typename\n  }\n  "
-                            "encryptionParams {\n    accessCondition {\n      or {\n        criteria {\n          "
-                            "...SimpleConditionFields\n          and {\n            criteria {\n              "
-                            "...SimpleConditionFields\n              __typename\n            }\n            "
-                            "__typename\n          }\n          or {\n            criteria {\n              "
-                            "...SimpleConditionFields\n              __typename\n            }\n            "
-                            "__typename\n          }\n          __typename\n        }\n        __typename\n      }\n  "
-                            "    __typename\n    }\n    __typename\n  }\n  __typename\n}\n\nfragment "
-                            "SimpleConditionFields on AccessConditionOutput {\n  nft {\n    contractAddress\n    "
-                            "chainID\n    contractType\n    tokenIds\n    __typename\n  }\n  eoa {\n    address\n    "
-                            "__typename\n  }\n  token {\n    contractAddress\n    amount\n    chainID\n    "
-                            "condition\n    decimals\n    __typename\n  }\n  follow {\n    profileId\n    "
-                            "__typename\n  }\n  collect {\n    publicationId\n    thisPublication\n    __typename\n  "
-                            "}\n  __typename\n}\n\nfragment CommentFields on Comment {\n  id\n  profile {\n    "
-                            "...ProfileFields\n    __typename\n  }\n  reaction(request: $reactionRequest)\n  mirrors("
-                            "by: $profileId)\n  hasCollectedByMe\n  onChainContentURI\n  isGated\n  canComment("
-                            "profileId: $profileId) {\n    result\n    __typename\n  }\n  canMirror(profileId: "
-                            "$profileId) {\n    result\n    __typename\n  }\n  canDecrypt(profileId: $profileId) {\n  "
-                            "  result\n    reasons\n    __typename\n  }\n  collectModule {\n    "
-                            "...CollectModuleFields\n    __typename\n  }\n  stats {\n    ...StatsFields\n    "
-                            "__typename\n  }\n  metadata {\n    ...MetadataFields\n    __typename\n  }\n  hidden\n  "
-                            "createdAt\n  appId\n  commentOn {\n    ... on Post {\n      ...PostFields\n      "
-                            "__typename\n    }\n    ... on Comment {\n      id\n      profile {\n        "
-                            "...ProfileFields\n        __typename\n      }\n      reaction(request: "
-                            "$reactionRequest)\n      mirrors(by: $profileId)\n      hasCollectedByMe\n      "
-                            "onChainContentURI\n      isGated\n      canComment(profileId: $profileId) {\n        "
-                            "result\n        __typename\n      }\n      canMirror(profileId: $profileId) {\n        "
-                            "result\n        __typename\n      }\n      canDecrypt(profileId: $profileId) {\n        "
-                            "result\n        reasons\n        __typename\n      }\n      collectModule {\n        "
-                            "...CollectModuleFields\n        __typename\n      }\n      metadata {\n        "
-                            "...MetadataFields\n        __typename\n      }\n      stats {\n        ...StatsFields\n  "
-                            "      __typename\n      }\n      mainPost {\n        ... on Post {\n          "
-                            "...PostFields\n          __typename\n        }\n        ... on Mirror {\n          "
-                            "...MirrorFields\n          __typename\n        }\n        __typename\n      }\n      "
-                            "hidden\n      createdAt\n      __typename\n    }\n    ... on Mirror {\n      "
-                            "...MirrorFields\n      __typename\n    }\n    __typename\n  }\n  "
-                            "__typename\n}\n\nfragment MirrorFields on Mirror {\n  id\n  profile {\n    "
-                            "...ProfileFields\n    __typename\n  }\n  reaction(request: $reactionRequest)\n  "
-                            "isGated\n  canComment(profileId: $profileId) {\n    result\n    __typename\n  }\n  "
-                            "canMirror(profileId: $profileId) {\n    result\n    __typename\n  }\n  canDecrypt("
-                            "profileId: $profileId) {\n    result\n    reasons\n    __typename\n  }\n  collectModule "
-                            "{\n    ...CollectModuleFields\n    __typename\n  }\n  stats {\n    ...StatsFields\n    "
-                            "__typename\n  }\n  metadata {\n    ...MetadataFields\n    __typename\n  }\n  hidden\n  "
-                            "mirrorOf {\n    ... on Post {\n      ...PostFields\n      __typename\n    }\n    ... on "
-                            "Comment {\n      id\n      profile {\n        ...ProfileFields\n        __typename\n     "
-                            " }\n      collectNftAddress\n      reaction(request: $reactionRequest)\n      mirrors("
-                            "by: $profileId)\n      onChainContentURI\n      isGated\n      canComment(profileId: "
-                            "$profileId) {\n        result\n        __typename\n      }\n      canMirror(profileId: "
-                            "$profileId) {\n        result\n        __typename\n      }\n      canDecrypt(profileId: "
-                            "$profileId) {\n        result\n        reasons\n        __typename\n      }\n      stats "
-                            "{\n        ...StatsFields\n        __typename\n      }\n      createdAt\n      "
-                            "__typename\n    }\n    __typename\n  }\n  createdAt\n  appId\n  __typename\n}"}
+        variables = self.feed_variables(projection or "ids")
+        variables['request']['limit'] = 10
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.post(self.url, json=payload) as response:
-                    data = await response.json()
-                    publication_id_from_feed = []
-                    for item in data['data']['feed']['items']:
-                        publication_id = item['root']['id']
-                        publication_id_from_feed.append(publication_id)
+            async with self.graphql(projected("Timeline", projection or "ids"), variables, headers) as response:
+                data = loads(await response.read())
+                if projection == "full":
+                    self.ledger.observe_feed(self.address, data['data']['feed']['items'])
+                publication_id_from_feed = []
+                for item in data['data']['feed']['items']:
+                    if projection is None:
+                        publication_id_from_feed.append(item['root']['id'])
+                    else:
+                        publication_id_from_feed.append(CONVERTERS["Timeline"](item))
 
-                    print(publication_id_from_feed)
-                    return publication_id_from_feed
+                print(publication_id_from_feed)
+                return publication_id_from_feed
 
         except Exception as e:
             print(e)
 
+    async def iter_pages(self, operation_name, variables, field, headers=None, page_size=50,
+                         max_items=None, until=None, convert=None, on_page=None):
+        # walk every page of a paginated query and yield its items one by one.
+        # the next page is already on its way while the caller handles the current one,
+        # stops after max_items items or at the first item for which until(item) is true.
+        # convert(item) turns raw items into result objects, items it turns into None are skipped,
+        # on_page(items) sees the raw items of every page
+        async def fetch(cursor):
+            request = dict(variables['request'], limit=page_size)
+            if cursor is not None:
+                request['cursor'] = cursor
+            async with self.graphql(operation_name, dict(variables, request=request), headers) as response:
+                data = loads(await response.read())
+            page = data['data'][field]
+            if on_page is not None:
+                on_page(page['items'])
+            return page['items'], page['pageInfo']['next']
+
+        count = 0
+        pending = asyncio.ensure_future(fetch(None))
+        try:
+            while pending is not None:
+                items, cursor = await pending
+                pending = None
+                more = cursor and items
+                # a page that may reach max_items is not followed up before it is used up, items that
+                # convert drops can still leave room for the next one
+                if more and (max_items is None or count + len(items) < max_items):
+                    pending = asyncio.ensure_future(fetch(cursor))
+                for item in items:
+                    if convert is not None:
+                        item = convert(item)
+                        if item is None:
+                            continue
+                    if until is not None and until(item):
+                        return
+                    yield item
+                    count += 1
+                    if max_items is not None and count >= max_items:
+                        return
+                if more and pending is None:
+                    pending = asyncio.ensure_future(fetch(cursor))
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    def iter_projected(self, operation_name, variables, field, headers, projection, page_size, max_items, until,
+                       on_page=None):
+        # without a projection the raw items of the full query, as before,
+        # otherwise result objects from models.py built from the matching slim query
+        if projection is None:
+            return self.iter_pages(operation_name, variables, field, headers, page_size, max_items, until,
+                                   on_page=on_page)
+        return self.iter_pages(projected(operation_name, projection), variables, field, headers, page_size,
+                               max_items, until, CONVERTERS[operation_name], on_page)
+
+    def iter_followers(self, profile_id, max_items=None, until=None, page_size=50, projection=None):
+        variables = {"request": {"profileId": f"{profile_id}"}}
+        return self.iter_projected("Followers", variables, "followers", self.headers, projection, page_size,
+                                   max_items, until)
+
+    def iter_following(self, address, max_items=None, until=None, page_size=50, projection=None):
+        variables = {"request": {"address": f"{address}"}}
+        return self.iter_projected("Following", variables, "following", self.headers, projection, page_size,
+                                   max_items, until)
+
+    def feed_variables(self, projection="full"):
+        variables = {"request": {"profileId": f"{self.user_id}",
+                                 "feedEventItemTypes": ["POST", "COMMENT",
+                                                        "COLLECT_POST",
+                                                        "COLLECT_COMMENT",
+                                                        "MIRROR"]}}
+        if projection == "full":
+            # only the full query asks whether we reacted to, mirrored or can comment on each item
+            variables["reactionRequest"] = {"profileId": f"{self.user_id}"}
+            variables["profileId"] = f"{self.user_id}"
+        return variables
+
+    def iter_feed(self, max_items=None, until=None, page_size=50, projection=None):
+        on_page = None
+        if (projection or "full") == "full":
+            # the full query says what this account liked, mirrored and follows, the ledger keeps it
+            def on_page(items):
+                self.ledger.observe_feed(self.address, items)
+        return self.iter_projected("Timeline", self.feed_variables(projection or "full"), "feed",
+                                   self.headers_with_access_token, projection, page_size, max_items, until, on_page)
+
+
+# one authenticated client per account for the whole process, keyed by address
+_clients = {}
+_addresses = {}
+_clients_lock = threading.Lock()
+
+
+def get_lens(private_key):
+    with _clients_lock:
+        address = _addresses.get(private_key)
+        if address is None:
+            address = _addresses[private_key] = address_of(private_key)
+        lens = _clients.get(address)
+        if lens is None:
+            lens = _clients[address] = Lens(private_key, login=False)
+        return lens
+
+
+async def lens_client(private_key):
+    # logged in client for private_key, only talks to the api when the tokens need renewing
+    lens = get_lens(private_key)
+    await lens.ensure_login()
+    return lens
+
 
 # if __name__ == '__main__':
     # bot = Lens()
@@ -590,6 +862,9 @@ class Lens:
     # asyncio.run(bot.post('Hello 23-3-15'))
     # asyncio.run(bot.comment('0xfb32-0x22', "hi there, how's going"))
 
+    # async for follower in bot.iter_followers('0xfb32', max_items=1000):
+    #     print(follower['wallet']['address'])
+
     # feed_id_list = asyncio.run(bot.get_feed())
     # asyncio.run(bot.post('Hello March 2023'))
     # for id in feed_id_list:
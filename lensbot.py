@@ -1,34 +1,364 @@
 import os
 import asyncio
-from telegram import Update, bot
-from telegram.ext import Updater, MessageHandler, Filters, CallbackContext
+import secrets
+import signal
+import uuid
+from urllib.parse import urlsplit
 
-from lens import Lens
+import aiohttp
+
+from jobqueue import JobQueue, JobWorkers
+from ledger import ActionLedger
+from lens import Lens, NotExecuted, get_lens, lens_client
+from media import Media, MediaStore, MediaUploader
+from metrics import JsonLogExporter, serve_prometheus
+from scheduler import RequestScheduler, limits_from_environ
+from shard import Coordinator, NotSent, relay_result, spawn_workers
+from signing import address_of
+from telegram_api import StatusMessages, TelegramBot, serve_webhook
+from warmup import WarmUp
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+def message_media(message):
+    # the files of a photo or video message to upload, telegram's largest size of a photo
+    if message.get('photo'):
+        photo = message['photo'][-1]
+        return [{"file_id": photo['file_id'], "file_unique_id": photo['file_unique_id'], "mime_type": "image/jpeg"}]
+    # telegram's videos and animations are mp4 when they do not say, a document has to say what it is
+    for field, default in (('video', 'video/mp4'), ('animation', 'video/mp4'), ('document', None)):
+        file = message.get(field)
+        mime_type = file.get('mime_type') or default if file else None
+        if mime_type and mime_type.split('/')[0] in ('image', 'video'):
+            return [{"file_id": file['file_id'], "file_unique_id": file['file_unique_id'], "mime_type": mime_type}]
+    return []
+
+
+def is_post_message(update):
+    # text messages that are not commands, and photos and videos with or without a caption
+    message = update.get('message')
+    if not message:
+        return False
+    if 'text' in message:
+        return not message['text'].startswith('/')
+    return bool(message_media(message))
+
+
 class TelegramLens:
 
-    def handle_chat(self, update: Update, _: CallbackContext):
-        user_message = update.message.text
+    def __init__(self, token=None, private_key=None, concurrency=8, shutdown_timeout=30,
+                 profile_cache_file=None, metrics_port=None, metrics_log=None, job_queue_file=None, reply_mode=None,
+                 telegram_api_url=None, ledger_file=None, shard_listen=None, shard_workers=None, webhook_url=None,
+                 webhook_listen=None, webhook_secret=None, media_cache_file=None, max_media_uploads=4,
+                 shard_secret=None):
+        # TELEGRAM_API_URL points the bot at another bot api server, mockserver.py for example
+        self.bot = TelegramBot(token or os.environ.get('TELEGRAM_TOKEN'),
+                               telegram_api_url or os.environ.get('TELEGRAM_API_URL') or 'https://api.telegram.org')
+        self.private_key = private_key or os.environ.get('PK')
+        # likes, mirrors and follows already done, so they are not sent again after a restart
+        self.ledger_file = ledger_file or os.environ.get('ACTION_LEDGER')
+        # snapshot of resolved handles and profiles, a restarted bot starts warm
+        self.profile_cache_file = profile_cache_file or os.environ.get('PROFILE_CACHE')
+        # prometheus /metrics on this port and/or a json line of metrics every minute in this file
+        self.metrics_port = metrics_port or os.environ.get('METRICS_PORT')
+        self.metrics_log = metrics_log or os.environ.get('METRICS_LOG')
+        # accepted messages wait here until a worker has posted them, across restarts too
+        self.job_queue_file = job_queue_file or os.environ.get('JOB_QUEUE') or 'jobs.sqlite'
+        # "edit": answer "queued…" right away and edit it as the post goes along,
+        # "reply": a single answer once the post is done
+        self.reply_mode = reply_mode or os.environ.get('REPLY_MODE') or 'edit'
+        # webhook mode: telegram posts updates to webhook_url instead of us polling for them, received on
+        # webhook_listen (host:port, what a proxy in front forwards to). without a secret every start makes one
+        self.webhook_url = webhook_url or os.environ.get('WEBHOOK_URL')
+        self.webhook_listen = webhook_listen or os.environ.get('WEBHOOK_LISTEN') or '0.0.0.0:8443'
+        self.webhook_secret = webhook_secret or os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+        # sqlite file of the photos and videos uploaded already, they are not uploaded again.
+        # at most max_media_uploads files move from telegram to ipfs at once
+        self.media_cache_file = media_cache_file or os.environ.get('MEDIA_CACHE')
+        self.max_media_uploads = max_media_uploads
+        # sharded mode: the lens work runs in the worker processes that connect to this address
+        # (host:port or a unix socket path), shard_workers of them are started here with our key
+        self.shard_listen = shard_listen or os.environ.get('SHARD_LISTEN')
+        self.shard_workers = int(shard_workers or os.environ.get('SHARD_WORKERS') or 0)
+        # workers prove they know it before they get any work. with only local workers and no
+        # SHARD_SECRET, one is made up for this run
+        self.shard_secret = shard_secret or os.environ.get('SHARD_SECRET')
+        if self.shard_listen and not self.shard_secret and self.shard_workers:
+            self.shard_secret = secrets.token_hex(32)
+        # LENS_ENDPOINT_RATE / LENS_ACCOUNT_RATE replace the request limits, here and in local workers
+        self.scheduler_options = limits_from_environ()
+        # at most this many posts run at once, across all chats
+        self.concurrency = concurrency
+        self.shutdown_timeout = shutdown_timeout
 
-        # if user_message.startswith("/"):
-            
-        lens = Lens(private_key=os.environ.get('PK'))
-        message = asyncio.run(lens.post(user_message))
+        self.stopping = None
+        self.offset = None
+        self.jobs = None
+        self.job_workers = None
+        self.warmup = None
+        self.replies = None
+        self.media = None
+        self.coordinator = None
+        self.address = None
 
-        update.message.reply_text(message)
+    def accept(self, updates):
+        # written to disk before the updates are confirmed to telegram, a worker posts them.
+        # telegram sends the same update again if we die before confirming, the key drops the copy.
+        # a getUpdates answer or a webhook body can hold many, they share one commit.
+        # jobs of a chat run one at a time, in the order they came in
+        accepted = []
+        with self.jobs.transaction():
+            for update in updates:
+                if not is_post_message(update):
+                    continue
+                message = update['message']
+                chat_id = message['chat']['id']
+                args = {"text": message.get('text') or message.get('caption') or ""}
+                media = message_media(message)
+                if media:
+                    args["media"] = media
+                job_id, new = self.jobs.enqueue("post", args, key=f"update-{update['update_id']}",
+                                                context={"chat_id": chat_id, "message_id": message['message_id']},
+                                                group=chat_id)
+                if new:
+                    accepted.append((job_id, message))
+        if self.reply_mode == 'edit':
+            for job_id, message in accepted:
+                # sent in the background, the next update does not wait for telegram
+                self.replies.show(job_id, message['chat']['id'], "queued…",
+                                  reply_to_message_id=message['message_id'])
 
-    def start(self):
-        updater = Updater(os.environ.get('TELEGRAM_TOKEN'))
-        dispatcher = updater.dispatcher
-        dispatcher.add_handler(MessageHandler(
-            Filters.text & ~Filters.command, self.handle_chat))
+    def show_status(self, job, text, final=False):
+        # edits the "queued…" answer of the job, in reply mode only the final text is sent
+        if self.reply_mode != 'edit' and not final:
+            return
+        self.replies.show(job.id, job.context['chat_id'], text, reply_to_message_id=job.context['message_id'],
+                          message_id=job.context.get('status_message_id'), final=final)
+
+    def status_sent(self, job_id, message_id):
+        # a restarted bot edits the same message
+        self.jobs.update_context(job_id, status_message_id=message_id)
+
+    def show_indexed(self, job, tx_status):
+        if self.reply_mode != 'edit':
+            return
+        if tx_status.indexed:
+            self.show_status(job, f"posted and indexed\ntx {tx_status.tx_hash}", final=True)
+        else:
+            self.show_status(job, f"posted, not indexed: {tx_status.reason}\ntx {tx_status.tx_hash}", final=True)
+
+    async def run_job(self, job):
+        # every step is saved before the next one starts: a retried job reuses the upload
+        # and never posts twice because the answer could not be sent
+        state = job.state
+        text = job.args['text']
+        if 'result' in state:
+            # finished by an older version of the bot
+            self.show_status(job, state['result'], final=True)
+            return state['result']
+        if 'relay' not in state and state.get('relaying'):
+            # the post went out in an earlier attempt and its answer was lost, or it did not:
+            # sending it again could post it twice, so nobody does
+            state['relay'] = {"tx_hash": None, "tx_id": None, "reason": "UNKNOWN"}
+            self.jobs.checkpoint(job)
+            self.show_status(job, "post may or may not have gone out, it was not sent again", final=True)
+            return state['relay']
+        if 'relay' not in state:
+            if job.args.get('media') and 'media' not in state:
+                # telegram's file ids outlive the retries, ipfs urls do not change
+                self.show_status(job, "uploading media…")
+                media = await asyncio.gather(*(
+                    self.media.upload_telegram_file(item['file_id'], item['file_unique_id'], item['mime_type'])
+                    for item in job.args['media']))
+                state['media'] = [item.as_dict() for item in media]
+                self.jobs.checkpoint(job)
+            self.show_status(job, "posting…")
+            if 'arid' not in state:
+                # the same metadata_id on every attempt, the upload is idempotent
+                state.setdefault('metadata_id', str(uuid.uuid4()))
+                self.jobs.checkpoint(job)
+                arid = await self.upload(text, state['metadata_id'], state.get('media', []))
+                if not arid:
+                    raise RuntimeError("metadata upload failed")
+                state['arid'] = arid
+                self.jobs.checkpoint(job)
+            # whatever fails before the marker is saved sent nothing and is tried again
+            await self.prepare_relay()
+            state['relaying'] = True
+            self.jobs.checkpoint(job)
+            try:
+                relayed = await self.relay(state['arid'], text, lambda tx_status: self.show_indexed(job, tx_status))
+            except (aiohttp.ClientConnectorError, NotExecuted, NotSent):
+                # never reached the dispatcher or turned away by it, safe to try again
+                state['relaying'] = False
+                self.jobs.checkpoint(job)
+                raise
+            state['relay'] = {"tx_hash": relayed.tx_hash, "tx_id": relayed.tx_id, "reason": relayed.reason}
+            self.jobs.checkpoint(job)
+        elif state['relay']['reason'] is None and self.coordinator is None:
+            # relayed before a restart, watch the transaction again
+            lens = await lens_client(self.private_key)
+            lens.track(state['relay']['tx_id'], state['relay']['tx_hash'],
+                       callback=lambda tx_status: self.show_indexed(job, tx_status))
+        relay = state['relay']
+        if relay['reason'] is not None:
+            # the dispatcher said no, trying again would not change its mind
+            self.show_status(job, f"post failed: {relay['reason']}", final=True)
+        else:
+            # in reply mode this is the answer, nobody hears about the indexing. neither in sharded
+            # mode, the worker that tracks the transaction does not report back
+            self.show_status(job, f"posted, waiting to be indexed\ntx {relay['tx_hash']}",
+                             final=self.reply_mode != 'edit' or self.coordinator is not None)
+        return relay
+
+    async def upload(self, text, metadata_id, media):
+        if self.coordinator is not None:
+            return await self.coordinator.call(self.address, "upload", text, metadata_id, media)
+        lens = await lens_client(self.private_key)
+        return await lens.get_post_context_arid(text, metadata_id, [Media.from_dict(item) for item in media])
 
-        updater.start_polling()
-        updater.idle()
+    async def prepare_relay(self):
+        # the login, or a worker to relay through, so relay() has nothing left to do but send
+        if self.coordinator is not None:
+            await self.coordinator.wait_for_owner(self.address, self.coordinator.call_timeout)
+            return
+        lens = await lens_client(self.private_key)
+        if not lens.is_logged_in():
+            raise RuntimeError("login failed")
+
+    async def relay(self, arid, text, on_indexed):
+        if self.coordinator is not None:
+            return relay_result(await self.coordinator.call(self.address, "relay", arid, text))
+        return await get_lens(self.private_key).relay_post(arid, text, on_indexed)
+
+    async def job_failed(self, job, error):
+        self.show_status(job, f"post failed: {error}", final=True)
+
+    async def poll(self):
+        while not self.stopping.is_set():
+            try:
+                updates = await self.bot.get_updates(offset=self.offset)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"get updates fail: {e}")
+                if 'webhook is active' in str(e):
+                    # left over from a start in webhook mode
+                    try:
+                        await self.bot.delete_webhook()
+                        continue
+                    except Exception as e:
+                        print(f"delete webhook fail: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not updates:
+                continue
+            try:
+                self.accept(updates)
+            except Exception as e:
+                # not confirmed, the next getUpdates hands them out again
+                print(f"accept updates fail: {e}")
+                await asyncio.sleep(1)
+                continue
+            self.offset = updates[-1]['update_id'] + 1
+
+    def stop(self):
+        self.stopping.set()
+
+    async def drain(self):
+        # posts that are still running get the rest of the timeout, queued ones wait for the next start
+        await self.job_workers.stop(self.shutdown_timeout)
+        await self.replies.flush(self.shutdown_timeout)
+        if self.offset is not None:
+            # confirm the handled updates so telegram does not send them again after a restart
+            try:
+                await self.bot.get_updates(offset=self.offset, timeout=0, limit=1)
+            except Exception as e:
+                print(f"confirm updates fail: {e}")
+
+    async def run(self):
+        if self.profile_cache_file:
+            Lens.profile_cache.load(self.profile_cache_file)
+        if self.ledger_file:
+            Lens.ledger = ActionLedger(self.ledger_file)
+        if self.scheduler_options:
+            Lens.scheduler = RequestScheduler(**self.scheduler_options)
+        metrics_server = metrics_log = None
+        if self.metrics_port or self.metrics_log:
+            Lens.enable_metrics()
+        if self.metrics_port:
+            metrics_server = await serve_prometheus(Lens.metrics, host="0.0.0.0", port=int(self.metrics_port))
+        if self.metrics_log:
+            metrics_log = JsonLogExporter(Lens.metrics, self.metrics_log).start()
+        self.stopping = asyncio.Event()
+        self.jobs = JobQueue(self.job_queue_file)
+        self.replies = StatusMessages(self.bot, on_sent=self.status_sent)
+        self.media = MediaUploader(self.bot, MediaStore(self.media_cache_file), max_uploads=self.max_media_uploads)
+        if self.jobs.recovered:
+            print(f"resuming {self.jobs.recovered} posts that were interrupted")
+        shard_processes = []
+        if self.shard_listen:
+            self.address = address_of(self.private_key)
+            self.coordinator = await Coordinator(self.shard_listen, self.shard_secret).start()
+            if self.shard_workers:
+                shard_processes = spawn_workers(self.shard_workers, self.shard_listen, [self.private_key],
+                                                scheduler_options=self.scheduler_options or None,
+                                                secret=self.shard_secret)
+        self.job_workers = JobWorkers(self.jobs, self.run_job, workers=self.concurrency,
+                                      on_failed=self.job_failed).start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # windows, ctrl+c still cancels run() and we drain below
+                pass
+
+        webhook = None
+        if self.webhook_url:
+            # updates go straight into the job queue, nothing waits on a long poll
+            host, port = self.webhook_listen.rsplit(':', 1)
+            webhook = await serve_webhook(self.accept, self.webhook_secret, host, int(port),
+                                          urlsplit(self.webhook_url).path or '/')
+            await self.bot.set_webhook(self.webhook_url, self.webhook_secret, max_connections=self.concurrency)
+            poller = asyncio.create_task(self.stopping.wait())
+        else:
+            poller = asyncio.create_task(self.poll())
+        # log in while waiting for the first message, the first post does not pay for it.
+        # started after the poller, so the first getUpdates is on its way while the signing code loads
+        # the workers log their own accounts in
+        self.warmup = WarmUp([] if self.coordinator else [self.private_key]).start()
+        stopped = asyncio.create_task(self.stopping.wait())
+        try:
+            await asyncio.wait([poller, stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            poller.cancel()
+            stopped.cancel()
+            self.warmup.task.cancel()
+            await asyncio.gather(poller, stopped, self.warmup.task, return_exceptions=True)
+            if webhook is not None:
+                # telegram keeps what arrives from now on until the next start
+                await webhook.cleanup()
+            await self.drain()
+            if self.coordinator is not None:
+                await self.coordinator.stop()
+            for process in shard_processes:
+                process.join(self.shutdown_timeout)
+            self.jobs.close()
+            self.media.store.close()
+            Lens.ledger.close()
+            await Lens.close_session()
+            if self.profile_cache_file:
+                Lens.profile_cache.save(self.profile_cache_file)
+            if metrics_log is not None:
+                await metrics_log.stop()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+
+    def start(self):
+        asyncio.run(self.run())
 
 
 if __name__ == '__main__':
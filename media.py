@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from lens import Lens
+from models import loads
+
+# photos and videos of telegram messages, moved to ipfs for the post's metadata. a file goes from
+# telegram's file server to the upload chunk by chunk, the whole of it is never in memory, and it
+# is hashed on the way through.
+#
+#   uploader = MediaUploader(bot)
+#   media = await uploader.upload_telegram_file(file_id, file_unique_id, "image/jpeg")
+#   await lens.post("look", media=[media])
+#
+# a file sent again is not moved again: telegram's file_unique_id stays the same for the same file,
+# the store knows the sha256 it had, and the sha256 its upload. a new file_unique_id of a size the
+# store has seen is downloaded and hashed first, content uploaded before is not uploaded again.
+# with a path the store survives restarts. at most max_uploads files are on their way at once,
+# each holds one chunk at a time.
+
+# LENS_MEDIA_URL is an ipfs http api add endpoint, IPFS_AUTH its "project id:secret"
+MEDIA_URL = 'https://ipfs.infura.io:5001/api/v0/add'
+CHUNK_SIZE = 64 * 1024
+# a big file may take longer than the session's 30 seconds, only a transfer that stalls fails
+READ_TIMEOUT = 60
+
+
+class Media:
+    def __init__(self, url, mime_type, sha256=None, size=None):
+        self.url = url
+        self.mime_type = mime_type
+        self.sha256 = sha256
+        self.size = size
+
+    @property
+    def kind(self):
+        # what lens calls the post's main content: IMAGE, VIDEO or AUDIO
+        return self.mime_type.split('/')[0].upper()
+
+    def as_dict(self):
+        return {"url": self.url, "mime_type": self.mime_type, "sha256": self.sha256, "size": self.size}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["url"], data["mime_type"], data.get("sha256"), data.get("size"))
+
+    def __repr__(self):
+        return f"<Media {self.mime_type} {self.url}>"
+
+
+class MediaStore:
+    # sha256 -> uploaded Media, and telegram file_unique_id -> sha256
+    def __init__(self, path=None):
+        self.db = None
+        self.by_hash = {}
+        self.by_file = {}
+        self.sizes = set()
+        if path is not None:
+            self.db = sqlite3.connect(path, isolation_level=None)
+            self.db.execute("pragma journal_mode=wal")
+            self.db.executescript("""
+                create table if not exists media (
+                    sha256 text primary key,
+                    url text not null,
+                    mime_type text not null,
+                    size integer,
+                    uploaded_at real not null
+                );
+                create table if not exists files (
+                    file_unique_id text primary key,
+                    sha256 text not null
+                );
+            """)
+            for sha256, url, mime_type, size in self.db.execute("select sha256, url, mime_type, size from media"):
+                self.by_hash[sha256] = Media(url, mime_type, sha256, size)
+                self.sizes.add(size)
+            self.by_file.update(self.db.execute("select file_unique_id, sha256 from files"))
+
+    def for_file(self, file_unique_id):
+        sha256 = self.by_file.get(file_unique_id)
+        return None if sha256 is None else self.by_hash.get(sha256)
+
+    def for_hash(self, sha256):
+        return self.by_hash.get(sha256)
+
+    def has_size(self, size):
+        # whether some uploaded content is size bytes long
+        return size is not None and size in self.sizes
+
+    def add(self, media, file_unique_id=None):
+        # the media uploaded first stays the one used for its content
+        media = self.by_hash.setdefault(media.sha256, media)
+        self.sizes.add(media.size)
+        if file_unique_id is not None:
+            self.by_file[file_unique_id] = media.sha256
+        if self.db is not None:
+            with self.db:
+                self.db.execute("begin")
+                self.db.execute("insert or ignore into media values (?, ?, ?, ?, ?)",
+                                (media.sha256, media.url, media.mime_type, media.size, time.time()))
+                if file_unique_id is not None:
+                    self.db.execute("insert or replace into files values (?, ?)", (file_unique_id, media.sha256))
+        return media
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+
+class MediaUploader:
+    def __init__(self, bot, store=None, upload_url=None, auth=None, max_uploads=4, chunk_size=CHUNK_SIZE,
+                 read_timeout=READ_TIMEOUT):
+        self.bot = bot
+        self.store = store or MediaStore()
+        self.upload_url = upload_url or os.environ.get('LENS_MEDIA_URL') or MEDIA_URL
+        auth = auth or os.environ.get('IPFS_AUTH')
+        self.auth = aiohttp.BasicAuth(*auth.split(':', 1)) if auth else None
+        self.chunk_size = chunk_size
+        # no limit on the whole transfer, read_timeout seconds without a byte from the other side is one
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=Lens.session_options["connect_timeout"],
+                                             sock_read=read_timeout)
+        self.uploads = asyncio.Semaphore(max_uploads)
+        # files with the same file_unique_id that arrive together are moved once
+        self.in_flight = {}
+        self.uploaded = 0
+        self.reused = 0
+        self.hash_downloads = 0
+        self.bytes_uploaded = 0
+
+    async def upload_telegram_file(self, file_id, file_unique_id, mime_type):
+        # the Media of a file of a telegram message, uploaded unless it was before
+        media = self.store.for_file(file_unique_id)
+        if media is not None:
+            self.reused += 1
+            return media
+        task = self.in_flight.get(file_unique_id)
+        if task is None:
+            task = self.in_flight[file_unique_id] = asyncio.ensure_future(
+                self.move(file_id, file_unique_id, mime_type))
+            task.add_done_callback(lambda _: self.in_flight.pop(file_unique_id, None))
+        else:
+            self.reused += 1
+        return await asyncio.shield(task)
+
+    async def move(self, file_id, file_unique_id, mime_type):
+        async with self.uploads:
+            file = await self.bot.get_file(file_id)
+            if self.store.has_size(file.get('file_size')):
+                # maybe content we have under another file_unique_id: a download to hash it is cheaper
+                # than an upload
+                media = self.store.for_hash(await self.hash_download(file))
+                if media is not None:
+                    self.reused += 1
+                    return self.store.add(media, file_unique_id)
+            async with Lens.get_session().get(self.bot.file_url(file['file_path']), timeout=self.timeout) as download:
+                download.raise_for_status()
+                media = await self.upload(download.content.iter_chunked(self.chunk_size), mime_type,
+                                          os.path.basename(file['file_path']))
+        # the same content under another file_unique_id (sent as a file instead of a photo, say) keeps
+        # the url of its first upload
+        return self.store.add(media, file_unique_id)
+
+    async def hash_download(self, file):
+        digest = hashlib.sha256()
+        async with Lens.get_session().get(self.bot.file_url(file['file_path']), timeout=self.timeout) as download:
+            download.raise_for_status()
+            async for chunk in download.content.iter_chunked(self.chunk_size):
+                digest.update(chunk)
+        self.hash_downloads += 1
+        return digest.hexdigest()
+
+    async def upload(self, chunks, mime_type, name):
+        # streams the async iterable chunks to ipfs as the one file of a multipart body, returns its Media
+        digest = hashlib.sha256()
+        size = 0
+
+        async def hashed():
+            nonlocal size
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                yield chunk
+
+        with aiohttp.MultipartWriter('form-data') as body:
+            part = body.append(hashed(), {'Content-Type': mime_type})
+            part.set_content_disposition('form-data', name='file', filename=name)
+            # a body that is half sent cannot be sent again, a failed upload fails the post attempt.
+            # the scheduler only paces it
+            await Lens.scheduler.acquire(urlsplit(self.upload_url).netloc)
+            async with Lens.get_session().post(self.upload_url, data=body, auth=self.auth,
+                                               timeout=self.timeout) as response:
+                response.raise_for_status()
+                data = loads(await response.read())
+        self.uploaded += 1
+        self.bytes_uploaded += size
+        return Media(f"ipfs://{data['Hash']}", mime_type, digest.hexdigest(), size)
@@ -0,0 +1,242 @@
+import asyncio
+import bisect
+import json
+import sys
+import time
+
+import aiohttp
+
+
+# counters, gauges and latency histograms for every lens operation.
+#
+#   Lens.enable_metrics()                          # off by default, NULL_METRICS costs next to nothing
+#   Lens.metrics.snapshot()                        # in process
+#   await serve_prometheus(Lens.metrics, port=9100)  # text format on /metrics
+#   JsonLogExporter(Lens.metrics, "metrics.log").start()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def error_category(error):
+    # coarse reason for the errors counter, so dashboards do not explode into one series per message
+    if isinstance(error, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f'http_{error.status}'
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return 'connection'
+    if isinstance(error, (KeyError, TypeError, ValueError)):
+        # the answer was not shaped like a success, usually graphql errors
+        return 'response'
+    return type(error).__name__
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Timer:
+    # with metrics.timer("lens_graphql", operation="Challenge"): ...
+    # latency histogram, in flight gauge and an error counter by category
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.metrics.gauge(f"{self.name}_in_flight", 1, **self.labels)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.metrics.observe(f"{self.name}_seconds", time.perf_counter() - self.start, **self.labels)
+        self.metrics.gauge(f"{self.name}_in_flight", -1, **self.labels)
+        if error is not None and not isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.metrics.inc(f"{self.name}_errors_total", category=error_category(error), **self.labels)
+        return False
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self):
+        # (name, ((label, value), ...)) -> number or Histogram
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, delta, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        # plain dicts, safe to json.dumps
+        def series(key):
+            name, labels = key
+            return {"name": name, "labels": dict(labels)}
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "counters": [dict(series(key), value=value) for key, value in self.counters.items()],
+            "gauges": [dict(series(key), value=value) for key, value in self.gauges.items()],
+            "histograms": [dict(series(key), count=histogram.count, sum=histogram.sum,
+                                p50=histogram.quantile(0.5), p99=histogram.quantile(0.99))
+                           for key, histogram in self.histograms.items()],
+        }
+
+    def prometheus(self):
+        # prometheus text exposition format
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def label_text(labels, extra=()):
+            pairs = [f'{name}="{escape(value)}"' for name, value in labels + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+            typed = set()
+            for (name, labels), value in sorted(values.items(), key=str):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{label_text(labels)} {value}")
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{name}_sum{label_text(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+
+class NullMetrics:
+    # same surface as Metrics, every call returns straight away
+    enabled = False
+    _timer = NullTimer()
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def gauge(self, name, delta, **labels):
+        pass
+
+    def set_gauge(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return self._timer
+
+    def snapshot(self):
+        return {}
+
+    def prometheus(self):
+        return ""
+
+
+NULL_METRICS = NullMetrics()
+
+
+async def serve_prometheus(metrics, host="127.0.0.1", port=9100, path="/metrics"):
+    # returns the aiohttp runner, await runner.cleanup() to stop serving
+    from aiohttp import web
+
+    async def handler(request):
+        return web.Response(text=metrics.prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get(path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class JsonLogExporter:
+    # one json snapshot per line every interval seconds, to a file or stdout
+    def __init__(self, metrics, path=None, interval=60):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.task = None
+
+    def write(self):
+        line = json.dumps(self.metrics.snapshot(), separators=(',', ':'))
+        if self.path is None:
+            print(line, file=sys.stdout, flush=True)
+        else:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # whatever happened since the last line
+        self.write()
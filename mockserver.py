@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import hashlib
+import json
+import random
+import re
+import time
+
+from aiohttp import web
+
+
+# local stand-in for api.lens.dev and the metadata server, so benchmarks and dry runs never
+# leave the machine. point the bot at it with LENS_API_URL=http://127.0.0.1:8765/ and
+# LENS_METADATA_URL=http://127.0.0.1:8765/metadata/
+#
+#   python mockserver.py --port 8765 --latency 0.05 --jitter 0.02 --error-rate 0.01
+
+class MockState:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, persisted_queries=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.persisted_queries = persisted_queries
+        # sha256 of the queries an "apollo" server was sent
+        self.persisted = set()
+        # the body of the latest metadata upload, and of every upload by the id it got
+        self.metadata = None
+        self.uploaded = {}
+        # (time.monotonic(), contentURI) of every CreatePostViaDispatcher that was answered
+        self.posts = []
+        self.telegram_updates = []
+        self.telegram_next_update = 1
+        self.telegram_queued = asyncio.Event()
+        # (time.monotonic(), method, params) of every bot api call but getUpdates
+        self.telegram_calls = []
+        self.telegram_files = {}
+        # file_id -> the file_id whose content it has
+        self.telegram_contents = {}
+
+
+# what the server is set up with and holds, and how often it did what: requests, uploads, errors,
+# persisted_hits, media_uploads, media_bytes
+STATE = web.AppKey("state", MockState)
+STATS = web.AppKey("stats", collections.Counter)
+
+
+def fake_jwt(lifetime):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b'=').decode()
+    return f"{encode({'alg': 'none'})}.{encode({'exp': int(time.time() + lifetime)})}.mock"
+
+
+BATCH_FIELDS = {"addReaction": "AddReaction", "createMirrorViaDispatcher": "CreateMirrorViaDispatcher",
+                "profile": "Profile", "hasTxHashBeenIndexed": "HasTxHashBeenIndexed",
+                "proxyActionStatus": "ProxyActionStatus"}
+ALIASED_FIELD = re.compile(r'(a\d+): (\w+)\(')
+
+# every profile has this many followers, follows this many profiles and sees this many feed items
+GRAPH_SIZE = 200
+# profile n follows n + offset for each of these offsets, so followers and following differ per
+# profile and neighbours share some of the profiles they follow, like a real graph does
+GRAPH_NODES = 1000000
+GRAPH_OFFSETS = random.Random(0).sample(range(1, 20 * GRAPH_SIZE), GRAPH_SIZE)
+
+
+def profile(index):
+    return {"id": f"0x{index:04x}", "name": None, "handle": f"mock{index}.lens", "bio": None,
+            "ownedBy": f"0x{index:040x}", "isFollowedByMe": False,
+            "stats": {"totalFollowers": GRAPH_SIZE, "totalFollowing": GRAPH_SIZE},
+            "attributes": [], "picture": None, "followModule": None, "__typename": "Profile"}
+
+
+def publication(index):
+    return {"id": f"0x01-0x{index:04x}", "__typename": "Post", "profile": profile(index % 50),
+            "stats": {"totalUpvotes": index, "totalAmountOfMirrors": 0, "totalAmountOfCollects": 0,
+                      "totalAmountOfComments": 0},
+            "metadata": {"content": f"mock post {index}"}, "createdAt": "2022-11-01T00:00:00.000Z",
+            "appId": "Lenster"}
+
+
+def page(variables, make_item):
+    # cursor is the offset of the next item, limit defaults to the api default of 10
+    request = variables.get("request") or {}
+    start = int(request.get("cursor") or 0)
+    end = min(GRAPH_SIZE, start + int(request.get("limit") or 10))
+    return {"items": [make_item(index) for index in range(start, end)],
+            "pageInfo": {"next": str(end) if end < GRAPH_SIZE else None}}
+
+
+def graph_node(variables, name):
+    # profile n is 0x...n and owned by the address 0x...n
+    try:
+        return int(str((variables.get("request") or {}).get(name)), 16) % GRAPH_NODES
+    except ValueError:
+        return 0
+
+
+def answer_batch(payload):
+    # one document with an aliased field per call, see batching.py
+    variables = payload.get("variables") or {}
+    data = {}
+    for alias, field in ALIASED_FIELD.findall(payload["query"]):
+        suffix = f"_{alias}"
+        call_variables = {name[:-len(suffix)]: value for name, value in variables.items() if name.endswith(suffix)}
+        data[alias] = answer({"operationName": BATCH_FIELDS[field], "variables": call_variables})[field]
+    return data
+
+
+def answer(payload):
+    operation = payload.get("operationName") or ""
+    variables = payload.get("variables") or {}
+    if operation == "Batch":
+        return answer_batch(payload)
+    if operation == "Challenge":
+        return {"challenge": {"text": "Sign in with Lens"}}
+    if operation in ("Authenticate", "Refresh"):
+        tokens = {"accessToken": fake_jwt(30 * 60), "refreshToken": fake_jwt(7 * 24 * 60 * 60)}
+        return {"authenticate" if operation == "Authenticate" else "refresh": tokens}
+    if operation == "UserProfiles":
+        owner = str(variables.get("ownedBy", "0x0"))
+        item = {"id": "0x" + owner[-4:], "name": None, "handle": f"{owner[-6:].lower()}.lens", "ownedBy": owner,
+                "stats": {"totalFollowers": 0, "totalFollowing": 0}}
+        return {"profiles": {"items": [item]}}
+    if operation == "Profile":
+        return {"profile": {"id": "0x" + str(abs(hash(variables["request"]["handle"])) % 65536)}}
+    if operation == "RecommendedProfiles":
+        return {"recommendedProfiles": [profile(index) for index in range(10)]}
+    if operation == "CreatePostViaDispatcher":
+        return {"createPostViaDispatcher": {"txHash": "0x" + "ab" * 32, "txId": "mock-tx"}}
+    if operation == "CreateMirrorViaDispatcher":
+        return {"createMirrorViaDispatcher": {"txHash": "0x" + "cd" * 32, "txId": "mock-tx"}}
+    if operation == "AddReaction":
+        return {"addReaction": None}
+    if operation == "ProxyAction":
+        return {"proxyAction": "mock-proxy-action"}
+    if operation == "HasTxHashBeenIndexed":
+        # everything is indexed by the time anyone asks
+        request = variables.get("request") or {}
+        return {"hasTxHashBeenIndexed": {"__typename": "TransactionIndexedResult", "indexed": True,
+                                         "txHash": request.get("txHash") or "0x" + "ab" * 32}}
+    if operation == "ProxyActionStatus":
+        return {"proxyActionStatus": {"__typename": "ProxyActionStatusResult", "status": "COMPLETE",
+                                      "txId": "mock-tx", "txHash": "0x" + "ef" * 32}}
+    # every projection of the paginated reads, the extra fields of the full answer do no harm
+    if operation.startswith("Followers"):
+        node = graph_node(variables, "profileId")
+        return {"followers": page(variables, lambda index: {
+            "wallet": {"address": f"0x{(node - GRAPH_OFFSETS[index]) % GRAPH_NODES:040x}",
+                       "defaultProfile": profile((node - GRAPH_OFFSETS[index]) % GRAPH_NODES)},
+            "totalAmountOfTimesFollowed": 1})}
+    if operation.startswith("Following"):
+        node = graph_node(variables, "address")
+        return {"following": page(variables, lambda index: {
+            "profile": profile((node + GRAPH_OFFSETS[index]) % GRAPH_NODES), "totalAmountOfTimesFollowing": 1})}
+    if operation.startswith("Timeline"):
+        return {"feed": page(variables, lambda index: {"root": publication(index)})}
+    return {}
+
+
+async def delay(app):
+    state = app[STATE]
+    latency = state.latency + random.uniform(0, state.jitter) if state.jitter else state.latency
+    if latency:
+        await asyncio.sleep(latency)
+
+
+def injected_error(app):
+    # a failing answer for error_rate of the requests, None for the rest
+    state = app[STATE]
+    if state.error_rate and random.random() < state.error_rate:
+        app[STATS]["errors"] += 1
+        status = state.error_status
+        headers = {"Retry-After": "1"} if status == 429 else None
+        return web.json_response({"errors": [{"message": "injected error"}]}, status=status, headers=headers)
+    return None
+
+
+def persisted_query_error(app, payload):
+    # the answer of a server in persisted_queries mode to a request it does not run, None when it does.
+    # "apollo" remembers the hashes it was sent with a query, "unsupported" turns every hash away and
+    # None ignores them, like a server that never heard of persisted queries
+    extension = (payload.get("extensions") or {}).get("persistedQuery")
+    mode = app[STATE].persisted_queries
+    if extension and mode == "unsupported":
+        return web.json_response({"errors": [{"message": "PersistedQueryNotSupported",
+                                              "extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}]}, status=400)
+    if extension and mode == "apollo":
+        if "query" in payload:
+            app[STATE].persisted.add(extension["sha256Hash"])
+        elif extension["sha256Hash"] in app[STATE].persisted:
+            app[STATS]["persisted_hits"] += 1
+        else:
+            return web.json_response({"errors": [{"message": "PersistedQueryNotFound",
+                                                  "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+        return None
+    if "query" not in payload:
+        return web.json_response({"errors": [{"message": "Must provide query string."}]}, status=400)
+    return None
+
+
+async def graphql(request):
+    payload = await request.json()
+    app = request.app
+    app[STATS]["requests"] += 1
+    await delay(app)
+    error = injected_error(app)
+    if error is None and not isinstance(payload, list):
+        error = persisted_query_error(app, payload)
+    if error is not None:
+        return error
+    if isinstance(payload, list):
+        return web.json_response([{"data": answer(item)} for item in payload])
+    if payload.get("operationName") == "CreatePostViaDispatcher":
+        app[STATE].posts.append((time.monotonic(), payload["variables"]["request"]["contentURI"]))
+    return web.json_response({"data": answer(payload)})
+
+
+async def metadata(request):
+    app = request.app
+    body = app[STATE].metadata = await request.read()
+    app[STATS]["uploads"] += 1
+    await delay(app)
+    error = injected_error(app)
+    if error is not None:
+        return error
+    # the same metadata gets the same id, like arweave's
+    arid = "ar-" + hashlib.sha256(body).hexdigest()[:40]
+    app[STATE].uploaded[arid] = body
+    return web.json_response({"id": arid})
+
+
+async def ipfs_add(request):
+    # the ipfs http api add of media.py, LENS_MEDIA_URL=<url>ipfs/add. reads the file as it arrives
+    app = request.app
+    digest = hashlib.sha256()
+    size = 0
+    reader = await request.multipart()
+    part = await reader.next()
+    while True:
+        chunk = await part.read_chunk()
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    app[STATS]["media_uploads"] += 1
+    app[STATS]["media_bytes"] += size
+    await delay(app)
+    error = injected_error(app)
+    if error is not None:
+        return error
+    return web.json_response({"Name": part.filename, "Hash": "Qm" + digest.hexdigest()[:44], "Size": str(size)})
+
+
+def file_chunks(file_id, size, chunk_size=64 * 1024):
+    # the content of a file added with add_file, the same every time
+    block = hashlib.sha256(file_id.encode()).digest() * (chunk_size // 32)
+    for start in range(0, size, chunk_size):
+        yield block[:min(chunk_size, size - start)]
+
+
+async def telegram_file(request):
+    # downloads of getFile's file_path, streamed
+    app = request.app
+    file_id = request.match_info["path"].rsplit("/", 1)[-1].split(".")[0]
+    size = app[STATE].telegram_files.get(file_id)
+    if size is None:
+        return web.Response(status=404)
+    await delay(app)
+    response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+    response.content_length = size
+    await response.prepare(request)
+    for chunk in file_chunks(app[STATE].telegram_contents.get(file_id, file_id), size):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def telegram(request):
+    # the bot api calls of telegram_api.py, TELEGRAM_API_URL=<url without the trailing /> points the bot here.
+    # getUpdates hands out what add_update queued, everything else is recorded in telegram_calls
+    state = request.app[STATE]
+    method = request.match_info["method"]
+    params = await request.json() if request.can_read_body else {}
+    updates = state.telegram_updates
+    if method == "getFile":
+        file_id = params["file_id"]
+        if file_id not in state.telegram_files:
+            return web.json_response({"ok": False, "description": "Bad Request: invalid file_id"})
+        return web.json_response({"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": f"unique-{file_id}", "file_size": state.telegram_files[file_id],
+            "file_path": f"photos/{file_id}.jpg"}})
+    if method == "getUpdates":
+        offset = params.get("offset") or 0
+        while updates and updates[0]["update_id"] < offset:
+            updates.pop(0)
+        if not updates and params.get("timeout"):
+            state.telegram_queued.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(state.telegram_queued.wait(), params["timeout"])
+        return web.json_response({"ok": True, "result": updates[:params.get("limit") or 100]})
+    state.telegram_calls.append((time.monotonic(), method, params))
+    return web.json_response({"ok": True, "result": {"message_id": 1000 + len(state.telegram_calls),
+                                                     "chat": {"id": params.get("chat_id")}}})
+
+
+def add_file(app, size, file_id=None, same_as=None):
+    # a file telegram's file server has, returns its file_id. with same_as another one's file_id,
+    # a file with the same content
+    state = app[STATE]
+    file_id = file_id or f"file{len(state.telegram_files) + 1}"
+    state.telegram_files[file_id] = size
+    if same_as is not None:
+        state.telegram_contents[file_id] = same_as
+    return file_id
+
+
+def add_update(app, chat_id, text, photo=None):
+    # a text message from chat_id, for the next getUpdates. with the file_id of add_file as photo,
+    # a photo message with text as its caption
+    state = app[STATE]
+    update_id = state.telegram_next_update
+    state.telegram_next_update += 1
+    message = {"message_id": update_id, "chat": {"id": chat_id}, "date": int(time.time())}
+    if photo is None:
+        message["text"] = text
+    else:
+        message["caption"] = text
+        message["photo"] = [{"file_id": photo, "file_unique_id": f"unique-{photo}", "width": 1280, "height": 960,
+                             "file_size": state.telegram_files[photo]}]
+    state.telegram_updates.append({"update_id": update_id, "message": message})
+    state.telegram_queued.set()
+    return update_id
+
+
+async def start_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                       persisted_queries=None):
+    # latency plus up to jitter seconds is added to every response,
+    # error_rate of the requests are answered with error_status instead.
+    # persisted_queries is "apollo", "unsupported" or None, see persisted_query_error().
+    # the app keeps its MockState under STATE and its counters under STATS.
+    # returns (runner, api url), uploads go to the api url + "metadata/", media to + "ipfs/add" and the
+    # telegram bot api is at the api url too, see telegram()
+    app = web.Application()
+    app[STATE] = MockState(latency, jitter, error_rate, error_status, persisted_queries)
+    app[STATS] = collections.Counter()
+    app.router.add_post("/", graphql)
+    app.router.add_post("/metadata/", metadata)
+    app.router.add_post("/ipfs/add", ipfs_add)
+    app.router.add_get("/file/bot{token}/{path:.*}", telegram_file)
+    app.router.add_post("/bot{token}/{method}", telegram)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--persisted-queries", choices=("apollo", "unsupported"))
+    args = parser.parse_args()
+
+    async def main():
+        runner, url = await start_server(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                                         args.error_status, args.persisted_queries)
+        print(f"mock lens api on {url}, metadata on {url}metadata/, media on {url}ipfs/add, "
+              f"telegram bot api on {url.rstrip('/')}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+import json
+
+try:
+    # several times faster than json on big feed and follower pages, and decodes bytes directly
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+# result objects read from api responses. each one is a view of the decoded item: a field is read
+# from it when asked for, so a page of results costs one small object per item and nothing is
+# copied. which fields are there depends on the projection the data was fetched with
+# (see PROJECTIONS in operations.py), the rest are None. data is the item itself, so a "full" read
+# that needs more than the fields reads it from there.
+
+
+def _stat(data, name):
+    stats = data.get('stats')
+    return stats.get(name) if stats else None
+
+
+class Profile:
+    __slots__ = ('data',)
+
+    def __init__(self, id, handle=None, name=None, owned_by=None, total_followers=None, total_following=None):
+        self.data = {"id": id, "handle": handle, "name": name, "ownedBy": owned_by,
+                     "stats": {"totalFollowers": total_followers, "totalFollowing": total_following}}
+
+    @classmethod
+    def from_data(cls, data):
+        if not data:
+            return None
+        profile = cls.__new__(cls)
+        profile.data = data
+        return profile
+
+    @property
+    def id(self):
+        return self.data['id']
+
+    @property
+    def handle(self):
+        return self.data.get('handle')
+
+    @property
+    def name(self):
+        return self.data.get('name')
+
+    @property
+    def owned_by(self):
+        return self.data.get('ownedBy')
+
+    @property
+    def total_followers(self):
+        return _stat(self.data, 'totalFollowers')
+
+    @property
+    def total_following(self):
+        return _stat(self.data, 'totalFollowing')
+
+    def __repr__(self):
+        return f"<Profile {self.id} {self.handle}>"
+
+
+class Publication:
+    __slots__ = ('data',)
+
+    def __init__(self, id, kind=None, profile_id=None, handle=None, content=None, created_at=None, app_id=None,
+                 upvotes=None, mirrors=None, collects=None, comments=None):
+        self.data = {"id": id, "__typename": kind, "profile": {"id": profile_id, "handle": handle},
+                     "metadata": {"content": content}, "createdAt": created_at, "appId": app_id,
+                     "stats": {"totalUpvotes": upvotes, "totalAmountOfMirrors": mirrors,
+                               "totalAmountOfCollects": collects, "totalAmountOfComments": comments}}
+
+    @classmethod
+    def from_data(cls, data):
+        if not data:
+            return None
+        publication = cls.__new__(cls)
+        publication.data = data
+        return publication
+
+    @property
+    def id(self):
+        return self.data['id']
+
+    @property
+    def kind(self):
+        return self.data.get('__typename')
+
+    @property
+    def profile_id(self):
+        profile = self.data.get('profile')
+        return profile.get('id') if profile else None
+
+    @property
+    def handle(self):
+        profile = self.data.get('profile')
+        return profile.get('handle') if profile else None
+
+    @property
+    def content(self):
+        metadata = self.data.get('metadata')
+        return metadata.get('content') if metadata else None
+
+    @property
+    def created_at(self):
+        return self.data.get('createdAt')
+
+    @property
+    def app_id(self):
+        return self.data.get('appId')
+
+    @property
+    def upvotes(self):
+        return _stat(self.data, 'totalUpvotes')
+
+    @property
+    def mirrors(self):
+        return _stat(self.data, 'totalAmountOfMirrors')
+
+    @property
+    def collects(self):
+        return _stat(self.data, 'totalAmountOfCollects')
+
+    @property
+    def comments(self):
+        return _stat(self.data, 'totalAmountOfComments')
+
+    def __repr__(self):
+        return f"<{self.kind or 'Publication'} {self.id}>"
+
+
+class FollowEdge:
+    # one entry of a followers or following page. wallets without a default profile have no profile
+    __slots__ = ('address', 'profile', 'times')
+
+    def __init__(self, address, profile=None, times=None):
+        self.address = address
+        self.profile = profile
+        # how often the follow nft was minted, summary and full only
+        self.times = times
+
+    @property
+    def handle(self):
+        return self.profile.handle if self.profile is not None else None
+
+    def __repr__(self):
+        return f"<FollowEdge {self.handle or self.address}>"
+
+
+class RelayResult:
+    # answer of the dispatcher mutations, either a transaction or the reason there is none
+    __slots__ = ('tx_hash', 'tx_id', 'reason')
+
+    def __init__(self, tx_hash=None, tx_id=None, reason=None):
+        self.tx_hash = tx_hash
+        self.tx_id = tx_id
+        self.reason = reason
+
+    @property
+    def ok(self):
+        return self.reason is None and bool(self.tx_id or self.tx_hash)
+
+    @classmethod
+    def from_data(cls, data):
+        if not data:
+            return cls(reason='empty answer')
+        return cls(data.get('txHash'), data.get('txId'), data.get('reason'))
+
+    def __repr__(self):
+        return f"<RelayResult {self.tx_hash}>" if self.ok else f"<RelayResult failed: {self.reason}>"
+
+
+# item of a paginated read -> result object, per operation
+def follower(item):
+    wallet = item['wallet']
+    return FollowEdge(wallet.get('address'), Profile.from_data(wallet.get('defaultProfile')),
+                      item.get('totalAmountOfTimesFollowed'))
+
+
+def following(item):
+    profile = Profile.from_data(item.get('profile'))
+    return FollowEdge(profile.owned_by if profile is not None else None, profile,
+                      item.get('totalAmountOfTimesFollowing'))
+
+
+def feed_item(item):
+    return Publication.from_data(item.get('root'))
+
+
+CONVERTERS = {"Followers": follower, "Following": following, "Timeline": feed_item}
@@ -0,0 +1,1074 @@
+import hashlib
+import json
+import re
+
+
+# every graphql operation the bot sends, built once at import.
+# fragments live in one place and each operation only carries the ones it uses.
+
+FRAGMENTS = {
+    "ProfileFields": """
+fragment ProfileFields on Profile {
+  id
+  name
+  handle
+  bio
+  ownedBy
+  isFollowedByMe
+  stats {
+    totalFollowers
+    totalFollowing
+    __typename
+  }
+  attributes {
+    key
+    value
+    __typename
+  }
+  picture {
+    ... on MediaSet {
+      original {
+        url
+        __typename
+      }
+      __typename
+    }
+    ... on NftImage {
+      uri
+      __typename
+    }
+    __typename
+  }
+  followModule {
+    __typename
+  }
+  __typename
+}
+""",
+    "ProfileSummaryFields": """
+fragment ProfileSummaryFields on Profile {
+  id
+  name
+  handle
+  ownedBy
+  stats {
+    totalFollowers
+    totalFollowing
+    __typename
+  }
+  __typename
+}
+""",
+    "PublicationSummaryFields": """
+fragment PublicationSummaryFields on FeedItemRoot {
+  ... on Post {
+    id
+    profile {
+      id
+      handle
+      __typename
+    }
+    stats {
+      ...StatsFields
+      __typename
+    }
+    metadata {
+      content
+      __typename
+    }
+    createdAt
+    appId
+    __typename
+  }
+  ... on Comment {
+    id
+    profile {
+      id
+      handle
+      __typename
+    }
+    stats {
+      ...StatsFields
+      __typename
+    }
+    metadata {
+      content
+      __typename
+    }
+    createdAt
+    appId
+    __typename
+  }
+  __typename
+}
+""",
+    "RelayerResultFields": """
+fragment RelayerResultFields on RelayResult {
+  ... on RelayerResult {
+    txHash
+    txId
+    __typename
+  }
+  ... on RelayError {
+    reason
+    __typename
+  }
+  __typename
+}
+""",
+    "PostFields": """
+fragment PostFields on Post {
+  id
+  profile {
+    ...ProfileFields
+    __typename
+  }
+  reaction(request: $reactionRequest)
+  mirrors(by: $profileId)
+  hasCollectedByMe
+  onChainContentURI
+  isGated
+  canComment(profileId: $profileId) {
+    result
+    __typename
+  }
+  canMirror(profileId: $profileId) {
+    result
+    __typename
+  }
+  canDecrypt(profileId: $profileId) {
+    result
+    reasons
+    __typename
+  }
+  collectModule {
+    ...CollectModuleFields
+    __typename
+  }
+  stats {
+    ...StatsFields
+    __typename
+  }
+  metadata {
+    ...MetadataFields
+    __typename
+  }
+  hidden
+  createdAt
+  appId
+  __typename
+}
+""",
+    "CollectModuleFields": """
+fragment CollectModuleFields on CollectModule {
+  ... on FreeCollectModuleSettings {
+    type
+    contractAddress
+    followerOnly
+    __typename
+  }
+  ... on FeeCollectModuleSettings {
+    type
+    referralFee
+    contractAddress
+    followerOnly
+    amount {
+      ...ModuleFeeAmountFields
+      __typename
+    }
+    __typename
+  }
+  ... on LimitedFeeCollectModuleSettings {
+    type
+    collectLimit
+    referralFee
+    contractAddress
+    followerOnly
+    amount {
+      ...ModuleFeeAmountFields
+      __typename
+    }
+    __typename
+  }
+  ... on LimitedTimedFeeCollectModuleSettings {
+    type
+    collectLimit
+    endTimestamp
+    referralFee
+    contractAddress
+    followerOnly
+    amount {
+      ...ModuleFeeAmountFields
+      __typename
+    }
+    __typename
+  }
+  ... on TimedFeeCollectModuleSettings {
+    type
+    endTimestamp
+    referralFee
+    contractAddress
+    followerOnly
+    amount {
+      ...ModuleFeeAmountFields
+      __typename
+    }
+    __typename
+  }
+  ... on MultirecipientFeeCollectModuleSettings {
+    type
+    contractAddress
+    amount {
+      ...ModuleFeeAmountFields
+      __typename
+    }
+    optionalCollectLimit: collectLimit
+    referralFee
+    followerOnly
+    optionalEndTimestamp: endTimestamp
+    recipients {
+      recipient
+      split
+      __typename
+    }
+    __typename
+  }
+  __typename
+}
+""",
+    "ModuleFeeAmountFields": """
+fragment ModuleFeeAmountFields on ModuleFeeAmount {
+  asset {
+    symbol
+    decimals
+    address
+    __typename
+  }
+  value
+  __typename
+}
+""",
+    "StatsFields": """
+fragment StatsFields on PublicationStats {
+  totalUpvotes
+  totalAmountOfMirrors
+  totalAmountOfCollects
+  totalAmountOfComments
+  __typename
+}
+""",
+    "MetadataFields": """
+fragment MetadataFields on MetadataOutput {
+  name
+  content
+  image
+  attributes {
+    traitType
+    value
+    __typename
+  }
+  cover {
+    original {
+      url
+      __typename
+    }
+    __typename
+  }
+  media {
+    original {
+      url
+      mimeType
+      __typename
+    }
+    __typename
+  }
+  encryptionParams {
+    accessCondition {
+      or {
+        criteria {
+          ...SimpleConditionFields
+          and {
+            criteria {
+              ...SimpleConditionFields
+              __typename
+            }
+            __typename
+          }
+          or {
+            criteria {
+              ...SimpleConditionFields
+              __typename
+            }
+            __typename
+          }
+          __typename
+        }
+        __typename
+      }
+      __typename
+    }
+    __typename
+  }
+  __typename
+}
+""",
+    "SimpleConditionFields": """
+fragment SimpleConditionFields on AccessConditionOutput {
+  nft {
+    contractAddress
+    chainID
+    contractType
+    tokenIds
+    __typename
+  }
+  eoa {
+    address
+    __typename
+  }
+  token {
+    contractAddress
+    amount
+    chainID
+    condition
+    decimals
+    __typename
+  }
+  follow {
+    profileId
+    __typename
+  }
+  collect {
+    publicationId
+    thisPublication
+    __typename
+  }
+  __typename
+}
+""",
+    "CommentFields": """
+fragment CommentFields on Comment {
+  id
+  profile {
+    ...ProfileFields
+    __typename
+  }
+  reaction(request: $reactionRequest)
+  mirrors(by: $profileId)
+  hasCollectedByMe
+  onChainContentURI
+  isGated
+  canComment(profileId: $profileId) {
+    result
+    __typename
+  }
+  canMirror(profileId: $profileId) {
+    result
+    __typename
+  }
+  canDecrypt(profileId: $profileId) {
+    result
+    reasons
+    __typename
+  }
+  collectModule {
+    ...CollectModuleFields
+    __typename
+  }
+  stats {
+    ...StatsFields
+    __typename
+  }
+  metadata {
+    ...MetadataFields
+    __typename
+  }
+  hidden
+  createdAt
+  appId
+  commentOn {
+    ... on Post {
+      ...PostFields
+      __typename
+    }
+    ... on Comment {
+      id
+      profile {
+        ...ProfileFields
+        __typename
+      }
+      reaction(request: $reactionRequest)
+      mirrors(by: $profileId)
+      hasCollectedByMe
+      onChainContentURI
+      isGated
+      canComment(profileId: $profileId) {
+        result
+        __typename
+      }
+      canMirror(profileId: $profileId) {
+        result
+        __typename
+      }
+      canDecrypt(profileId: $profileId) {
+        result
+        reasons
+        __typename
+      }
+      collectModule {
+        ...CollectModuleFields
+        __typename
+      }
+      metadata {
+        ...MetadataFields
+        __typename
+      }
+      stats {
+        ...StatsFields
+        __typename
+      }
+      mainPost {
+        ... on Post {
+          ...PostFields
+          __typename
+        }
+        ... on Mirror {
+          ...MirrorFields
+          __typename
+        }
+        __typename
+      }
+      hidden
+      createdAt
+      __typename
+    }
+    ... on Mirror {
+      ...MirrorFields
+      __typename
+    }
+    __typename
+  }
+  __typename
+}
+""",
+    "MirrorFields": """
+fragment MirrorFields on Mirror {
+  id
+  profile {
+    ...ProfileFields
+    __typename
+  }
+  reaction(request: $reactionRequest)
+  isGated
+  canComment(profileId: $profileId) {
+    result
+    __typename
+  }
+  canMirror(profileId: $profileId) {
+    result
+    __typename
+  }
+  canDecrypt(profileId: $profileId) {
+    result
+    reasons
+    __typename
+  }
+  collectModule {
+    ...CollectModuleFields
+    __typename
+  }
+  stats {
+    ...StatsFields
+    __typename
+  }
+  metadata {
+    ...MetadataFields
+    __typename
+  }
+  hidden
+  mirrorOf {
+    ... on Post {
+      ...PostFields
+      __typename
+    }
+    ... on Comment {
+      id
+      profile {
+        ...ProfileFields
+        __typename
+      }
+      collectNftAddress
+      reaction(request: $reactionRequest)
+      mirrors(by: $profileId)
+      onChainContentURI
+      isGated
+      canComment(profileId: $profileId) {
+        result
+        __typename
+      }
+      canMirror(profileId: $profileId) {
+        result
+        __typename
+      }
+      canDecrypt(profileId: $profileId) {
+        result
+        reasons
+        __typename
+      }
+      stats {
+        ...StatsFields
+        __typename
+      }
+      createdAt
+      __typename
+    }
+    __typename
+  }
+  createdAt
+  appId
+  __typename
+}
+""",
+}
+
+DOCUMENTS = {
+    "Challenge": """
+query Challenge($request: ChallengeRequest!) {
+  challenge(request: $request) {
+    text
+    __typename
+  }
+}
+""",
+    "Authenticate": """
+mutation Authenticate($request: SignedAuthChallenge!) {
+  authenticate(request: $request) {
+    accessToken
+    refreshToken
+    __typename
+  }
+}
+""",
+    "Refresh": """
+mutation Refresh($request: RefreshRequest!) {
+  refresh(request: $request) {
+    accessToken
+    refreshToken
+    __typename
+  }
+}
+""",
+    "UserProfiles": """
+query UserProfiles($ownedBy: [EthereumAddress!]) {
+  profiles(request: {ownedBy: $ownedBy}) {
+    items {
+      ...ProfileFields
+      interests
+      isDefault
+      dispatcher {
+        canUseRelay
+        __typename
+      }
+      __typename
+    }
+    __typename
+  }
+  userSigNonces {
+    lensHubOnChainSigNonce
+    __typename
+  }
+}
+""",
+    "CreatePostViaDispatcher": """
+mutation CreatePostViaDispatcher($request: CreatePublicPostRequest!) {
+  createPostViaDispatcher(request: $request) {
+    ...RelayerResultFields
+    __typename
+  }
+}
+""",
+    "RecommendedProfiles": """
+query RecommendedProfiles($options: RecommendedProfileOptions) {
+  recommendedProfiles(options: $options) {
+    ...ProfileFields
+    isFollowedByMe
+    __typename
+  }
+}
+""",
+    "Profile": """
+query Profile($request: SingleProfileQueryRequest!, $who: ProfileId) {
+  profile(request: $request) {
+    id
+    handle
+    ownedBy
+    name
+    bio
+    metadata
+    followNftAddress
+    isFollowedByMe
+    isFollowing(who: $who)
+    attributes {
+      key
+      value
+      __typename
+    }
+    dispatcher {
+      canUseRelay
+      __typename
+    }
+    onChainIdentity {
+      proofOfHumanity
+      sybilDotOrg {
+        verified
+        source {
+          twitter {
+            handle
+            __typename
+          }
+          __typename
+        }
+        __typename
+      }
+      ens {
+        name
+        __typename
+      }
+      worldcoin {
+        isHuman
+        __typename
+      }
+      __typename
+    }
+    stats {
+      totalFollowers
+      totalFollowing
+      totalPosts
+      totalComments
+      totalMirrors
+      __typename
+    }
+    picture {
+      ... on MediaSet {
+        original {
+          url
+          __typename
+        }
+        __typename
+      }
+      ... on NftImage {
+        uri
+        __typename
+      }
+      __typename
+    }
+    coverPicture {
+      ... on MediaSet {
+        original {
+          url
+          __typename
+        }
+        __typename
+      }
+      __typename
+    }
+    followModule {
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "ProxyAction": """
+mutation ProxyAction($request: ProxyActionRequest!) {
+  proxyAction(request: $request)
+}
+""",
+    "AddReaction": """
+mutation AddReaction($request: ReactionRequest!) {
+  addReaction(request: $request)
+}
+""",
+    "CreateMirrorViaDispatcher": """
+mutation CreateMirrorViaDispatcher($request: CreateMirrorRequest!) {
+  createMirrorViaDispatcher(request: $request) {
+    ...RelayerResultFields
+    __typename
+  }
+}
+""",
+    "Followers": """
+query Followers($request: FollowersRequest!) {
+  followers(request: $request) {
+    items {
+      wallet {
+        address
+        defaultProfile {
+          ...ProfileFields
+          isFollowedByMe
+          __typename
+        }
+        __typename
+      }
+      totalAmountOfTimesFollowed
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "Following": """
+query Following($request: FollowingRequest!) {
+  following(request: $request) {
+    items {
+      profile {
+        ...ProfileFields
+        isFollowedByMe
+        __typename
+      }
+      totalAmountOfTimesFollowing
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "Timeline": """
+query Timeline($request: FeedRequest!, $reactionRequest: ReactionFieldResolverRequest, $profileId: ProfileId) {
+  feed(request: $request) {
+    items {
+      root {
+        ... on Post {
+          ...PostFields
+          __typename
+        }
+        ... on Comment {
+          ...CommentFields
+          __typename
+        }
+        __typename
+      }
+      electedMirror {
+        mirrorId
+        profile {
+          ...ProfileFields
+          __typename
+        }
+        timestamp
+        __typename
+      }
+      mirrors {
+        profile {
+          ...ProfileFields
+          __typename
+        }
+        timestamp
+        __typename
+      }
+      collects {
+        profile {
+          ...ProfileFields
+          __typename
+        }
+        timestamp
+        __typename
+      }
+      reactions {
+        profile {
+          ...ProfileFields
+          __typename
+        }
+        reaction
+        timestamp
+        __typename
+      }
+      comments {
+        ...CommentFields
+        __typename
+      }
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "FollowersIds": """
+query FollowersIds($request: FollowersRequest!) {
+  followers(request: $request) {
+    items {
+      wallet {
+        address
+        defaultProfile {
+          id
+          handle
+          __typename
+        }
+        __typename
+      }
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "FollowersSummary": """
+query FollowersSummary($request: FollowersRequest!) {
+  followers(request: $request) {
+    items {
+      wallet {
+        address
+        defaultProfile {
+          ...ProfileSummaryFields
+          __typename
+        }
+        __typename
+      }
+      totalAmountOfTimesFollowed
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "FollowingIds": """
+query FollowingIds($request: FollowingRequest!) {
+  following(request: $request) {
+    items {
+      profile {
+        id
+        handle
+        ownedBy
+        __typename
+      }
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "FollowingSummary": """
+query FollowingSummary($request: FollowingRequest!) {
+  following(request: $request) {
+    items {
+      profile {
+        ...ProfileSummaryFields
+        __typename
+      }
+      totalAmountOfTimesFollowing
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "TimelineIds": """
+query TimelineIds($request: FeedRequest!) {
+  feed(request: $request) {
+    items {
+      root {
+        ... on Post {
+          id
+          __typename
+        }
+        ... on Comment {
+          id
+          __typename
+        }
+        __typename
+      }
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "TimelineSummary": """
+query TimelineSummary($request: FeedRequest!) {
+  feed(request: $request) {
+    items {
+      root {
+        ...PublicationSummaryFields
+        __typename
+      }
+      __typename
+    }
+    pageInfo {
+      next
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "HasTxHashBeenIndexed": """
+query HasTxHashBeenIndexed($request: HasTxHashBeenIndexedRequest!) {
+  hasTxHashBeenIndexed(request: $request) {
+    ... on TransactionIndexedResult {
+      indexed
+      txHash
+      __typename
+    }
+    ... on TransactionError {
+      reason
+      __typename
+    }
+    __typename
+  }
+}
+""",
+    "ProxyActionStatus": """
+query ProxyActionStatus($proxyActionId: ProxyActionId!) {
+  proxyActionStatus(proxyActionId: $proxyActionId) {
+    ... on ProxyActionStatusResult {
+      txHash
+      txId
+      status
+      __typename
+    }
+    ... on ProxyActionError {
+      reason
+      lastKnownTxId
+      __typename
+    }
+    ... on ProxyActionQueued {
+      queuedAt
+      __typename
+    }
+    __typename
+  }
+}
+""",
+}
+
+
+_FRAGMENT_SPREAD = re.compile(r'\.\.\.([A-Za-z_]\w*)')
+_DOCUMENT = re.compile(r'^(query|mutation)\s+\w+\s*(?:\((.*?)\))?\s*\{(.*)\}$', re.S)
+_VARIABLE = re.compile(r'\$(\w+)')
+
+
+def _fragments_for(document):
+    # fragments used by document, following fragments that use other fragments
+    names = []
+    pending = _FRAGMENT_SPREAD.findall(document)
+    while pending:
+        name = pending.pop(0)
+        if name not in names:
+            names.append(name)
+            pending.extend(_FRAGMENT_SPREAD.findall(FRAGMENTS[name]))
+    return names
+
+
+class Operation:
+    def __init__(self, name, document):
+        self.name = name
+        self.fragments = _fragments_for(document)
+        self.query = "\n\n".join([document.strip()] + [FRAGMENTS[fragment].strip()
+                                                       for fragment in self.fragments])
+        self.sha256 = hashlib.sha256(self.query.encode()).hexdigest()
+        self.kind, definitions, selection = _DOCUMENT.match(document.strip()).groups()
+        self.mutation = self.kind == 'mutation'
+        self.variable_definitions = definitions or ''
+        self.selection = selection.strip()
+        self.root_field = re.match(r'\w+', self.selection).group(0)
+
+        name_json = json.dumps(name)
+        persisted_query = '{"persistedQuery":{"version":1,"sha256Hash":"%s"}}' % self.sha256
+        self._head = ('{"operationName":%s,"query":%s,"variables":'
+                      % (name_json, json.dumps(self.query))).encode()
+        self._head_with_hash = ('{"operationName":%s,"query":%s,"extensions":%s,"variables":'
+                                % (name_json, json.dumps(self.query), persisted_query)).encode()
+        self._head_hash_only = ('{"operationName":%s,"extensions":%s,"variables":'
+                                % (name_json, persisted_query)).encode()
+
+    def payload(self, variables, persisted=False, hash_only=False):
+        # request body as bytes, only the variables are serialized per call. persisted adds the
+        # sha256 of the query, hash_only leaves the query out for a server that has seen it
+        if not persisted:
+            head = self._head
+        elif hash_only:
+            head = self._head_hash_only
+        else:
+            head = self._head_with_hash
+        return head + json.dumps(variables, separators=(',', ':')).encode() + b'}'
+
+    def aliased(self, alias):
+        # this operation as one aliased field of a combined document,
+        # every variable gets the alias as suffix so several copies can live side by side
+        def rename(text):
+            return _VARIABLE.sub(lambda match: f'${match.group(1)}_{alias}', text)
+        return rename(self.variable_definitions), f'{alias}: {rename(self.selection)}'
+
+    def __repr__(self):
+        return f"<Operation {self.name} {self.sha256[:12]}>"
+
+
+OPERATIONS = {name: Operation(name, document) for name, document in DOCUMENTS.items()}
+
+# read queries come in three sizes: "ids" asks for identifiers only, "summary" for what a listing
+# shows, "full" for everything the web app asks for
+PROJECTIONS = ("ids", "summary", "full")
+PROJECTED = {
+    "Followers": {"ids": "FollowersIds", "summary": "FollowersSummary", "full": "Followers"},
+    "Following": {"ids": "FollowingIds", "summary": "FollowingSummary", "full": "Following"},
+    "Timeline": {"ids": "TimelineIds", "summary": "TimelineSummary", "full": "Timeline"},
+}
+
+
+def projected(operation_name, projection):
+    # name of the operation_name variant that fetches projection
+    if projection not in PROJECTIONS:
+        raise ValueError(f"unknown projection {projection!r}, expected one of {', '.join(PROJECTIONS)}")
+    return PROJECTED[operation_name][projection]
+
+
+def persisted_query_not_found(data):
+    # apollo style answer when the server does not know the hash we sent
+    for error in (data or {}).get('errors') or []:
+        if error.get('message') == 'PersistedQueryNotFound' or \
+                (error.get('extensions') or {}).get('code') == 'PERSISTED_QUERY_NOT_FOUND':
+            return True
+    return False
+
+
+def persisted_query_not_supported(data, status):
+    # a server without persisted queries: apollo says so, others answer a hash without a query with
+    # a 400 "must provide query string"
+    for error in (data or {}).get('errors') or []:
+        message = error.get('message') or ''
+        if message == 'PersistedQueryNotSupported' or \
+                (error.get('extensions') or {}).get('code') == 'PERSISTED_QUERY_NOT_SUPPORTED':
+            return True
+        if status == 400 and 'must provide query' in message.lower():
+            return True
+    return False
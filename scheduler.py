@@ -0,0 +1,216 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from metrics import NULL_METRICS
+
+
+# every request to the lens api and the metadata server goes through here.
+# requests are spaced by token buckets per endpoint and per account,
+# 429 answers pause the whole endpoint for Retry-After seconds and
+# transient failures are retried with jittered exponential backoff.
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        # take a token now, returns how long the caller has to wait before using it
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def limits_from_environ(environ=None):
+    # RequestScheduler options from LENS_ENDPOINT_RATE and LENS_ACCOUNT_RATE: requests per second,
+    # with a burst of two seconds' worth, or "off". unset ones keep the defaults
+    environ = os.environ if environ is None else environ
+    options = {}
+    for name, kind in (("LENS_ENDPOINT_RATE", "endpoint"), ("LENS_ACCOUNT_RATE", "account")):
+        value = environ.get(name)
+        if not value:
+            continue
+        if value.lower() in ("off", "none"):
+            options[f"{kind}_rate"] = None
+        else:
+            options[f"{kind}_rate"] = float(value)
+            options[f"{kind}_burst"] = max(1.0, 2 * float(value))
+    return options
+
+
+class RequestScheduler:
+    def __init__(self, endpoint_rate=20, endpoint_burst=40, account_rate=5, account_burst=10,
+                 endpoint_limits=None, max_retries=4, backoff_base=0.5, backoff_max=30, metrics=None):
+        # rates are requests per second, None turns that limit off.
+        # endpoint_limits overrides the rate and burst for some hosts: {"api.lens.dev": (10, 20)}
+        self.endpoint_rate = endpoint_rate
+        self.endpoint_burst = endpoint_burst
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.endpoint_limits = endpoint_limits or {}
+        # the part of every endpoint limit this process may use, see share_endpoints
+        self.endpoint_share = 1.0
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = metrics or NULL_METRICS
+
+        self.endpoint_buckets = {}
+        self.account_buckets = {}
+        self.paused_until = {}
+
+        self.queue_depth = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def endpoint_limit(self, endpoint):
+        rate, burst = self.endpoint_limits.get(endpoint, (self.endpoint_rate, self.endpoint_burst))
+        if rate is None:
+            return None, None
+        return rate * self.endpoint_share, max(1.0, burst * self.endpoint_share)
+
+    def endpoint_bucket(self, endpoint):
+        if endpoint not in self.endpoint_buckets:
+            rate, burst = self.endpoint_limit(endpoint)
+            self.endpoint_buckets[endpoint] = TokenBucket(rate, burst) if rate is not None else None
+        return self.endpoint_buckets[endpoint]
+
+    def share_endpoints(self, share):
+        # several processes calling the same api (the workers of a sharded bot) split its limits,
+        # this one keeps share of each
+        self.endpoint_share = share
+        for endpoint, bucket in self.endpoint_buckets.items():
+            if bucket is not None:
+                bucket.rate, bucket.burst = self.endpoint_limit(endpoint)
+                bucket.tokens = min(bucket.tokens, bucket.burst)
+
+    def account_bucket(self, account):
+        if account not in self.account_buckets:
+            rate = self.account_rate
+            self.account_buckets[account] = TokenBucket(rate, self.account_burst) if rate is not None else None
+        return self.account_buckets[account]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def acquire(self, endpoint, account=None):
+        self.queue_depth += 1
+        start = time.monotonic()
+        try:
+            paused = self.paused_until.get(endpoint, 0) - start
+            while paused > 0:
+                await asyncio.sleep(paused)
+                paused = self.paused_until.get(endpoint, 0) - time.monotonic()
+            delay = 0.0
+            bucket = self.endpoint_bucket(endpoint)
+            if bucket is not None:
+                delay = bucket.reserve()
+            bucket = self.account_bucket(account) if account is not None else None
+            if bucket is not None:
+                delay = max(delay, bucket.reserve())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.queue_depth -= 1
+            waited = time.monotonic() - start
+            self.waits += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.metrics.observe("lens_scheduler_wait_seconds", waited, endpoint=endpoint)
+
+    async def request(self, session, method, url, account=None, idempotent=True, **kwargs):
+        # returns the aiohttp response, the caller releases it (async with response: ...).
+        # a request the server may have already handled (timeout, dropped connection)
+        # is only sent again when it is idempotent
+        endpoint = urlsplit(url).netloc
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            await self.acquire(endpoint, account)
+            self.requests += 1
+            if metrics.enabled:
+                metrics.inc("lens_requests_total", endpoint=endpoint)
+                body = kwargs.get('data')
+                if isinstance(body, (bytes, str)):
+                    metrics.inc("lens_bytes_sent_total", len(body), endpoint=endpoint)
+            try:
+                response = await session.request(method, url, **kwargs)
+            except aiohttp.ClientConnectorError:
+                # never reached the server, always safe to send again
+                metrics.inc("lens_retries_total", endpoint=endpoint, reason='connection')
+                if attempt >= self.max_retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                metrics.inc("lens_retries_total", endpoint=endpoint,
+                            reason='timeout' if isinstance(e, asyncio.TimeoutError) else 'connection')
+            else:
+                if metrics.enabled:
+                    metrics.inc("lens_responses_total", endpoint=endpoint, status=response.status)
+                    if response.content_length:
+                        metrics.inc("lens_bytes_received_total", response.content_length, endpoint=endpoint)
+                if response.status not in RETRY_STATUSES or attempt >= self.max_retries or \
+                        (response.status != 429 and not idempotent):
+                    return response
+                delay = retry_after(response)
+                metrics.inc("lens_retries_total", endpoint=endpoint, reason=f'http_{response.status}')
+                if response.status == 429:
+                    self.throttled += 1
+                    delay = self.backoff(attempt) if delay is None else delay
+                    # everyone waits for this endpoint, not just this request
+                    self.paused_until[endpoint] = max(self.paused_until.get(endpoint, 0),
+                                                      time.monotonic() + delay)
+                    delay = 0
+                response.release()
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    self.retries += 1
+                    attempt += 1
+                    continue
+            self.retries += 1
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "wait_avg": self.wait_total / self.waits if self.waits else 0.0,
+            "wait_max": self.wait_max,
+            "paused_endpoints": sorted(endpoint for endpoint, until in self.paused_until.items()
+                                       if until > time.monotonic()),
+        }
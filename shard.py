@@ -0,0 +1,556 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import struct
+import time
+
+from models import RelayResult, loads
+
+# spread accounts over worker processes, on one machine or several. every account belongs to one
+# worker, picked by consistent hashing of its address over the workers that are up and hold its
+# key, so a worker joining or leaving only moves the accounts it takes or gives up. the worker owning an account
+# keeps its logged in Lens client, the coordinator only routes calls to it.
+#
+#   coordinator = await Coordinator("/tmp/lens.sock").start()          # or "0.0.0.0:7100"
+#   workers = spawn_workers(4, "/tmp/lens.sock", private_keys)          # or python shard.py worker ...
+#   arid = await coordinator.call(address, "upload", "gm", metadata_id)
+#
+# when the owner of an account changes, the worker giving it up hands its tokens to the new owner
+# through the coordinator, which then does not need to sign a new login. messages are length
+# prefixed json over a unix or tcp socket, tokens included: keep tcp on a private network.
+# a worker joins only when it proves it knows the coordinator's secret (SHARD_SECRET), it answers
+# a fresh challenge with its hmac.
+
+
+class ShardError(Exception):
+    pass
+
+
+class NotSent(ShardError):
+    # the call never reached lens: no worker for the account came up, the worker had no key for it,
+    # could not log it in, or lens turned the call away. making it again is safe
+    pass
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    # replicas points per worker keep the accounts evenly spread
+    def __init__(self, workers=(), replicas=100):
+        self.replicas = replicas
+        self.points = []
+        self.owners = []
+        self.workers = set()
+        for worker in workers:
+            self.add(worker)
+
+    def add(self, worker):
+        if worker in self.workers:
+            return
+        self.workers.add(worker)
+        for replica in range(self.replicas):
+            point = ring_hash(f"{worker}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, worker)
+
+    def remove(self, worker):
+        if worker not in self.workers:
+            return
+        self.workers.discard(worker)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != worker]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def owner(self, address, among=None):
+        # among keeps the choice to some of the workers, the first of them after the address
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, ring_hash(address.lower()))
+        if among is None:
+            return self.owners[index % len(self.points)]
+        for step in range(len(self.points)):
+            owner = self.owners[(index + step) % len(self.points)]
+            if owner in among:
+                return owner
+        return None
+
+
+# transport: a 4 byte length, then a json object
+
+async def send(writer, message):
+    data = json.dumps(message, separators=(',', ':')).encode()
+    writer.write(struct.pack('>I', len(data)) + data)
+    await writer.drain()
+
+
+async def receive(reader, max_size=None):
+    # None once the other side is gone, or sent more than max_size bytes or something that is not json
+    try:
+        header = await reader.readexactly(4)
+        size = struct.unpack('>I', header)[0]
+        if max_size is not None and size > max_size:
+            return None
+        return loads(await reader.readexactly(size))
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        return None
+
+
+def shard_secret(secret=None):
+    secret = secret or os.environ.get('SHARD_SECRET')
+    if not secret:
+        raise ShardError("no shard secret, set SHARD_SECRET to the same value for the coordinator and the workers")
+    return secret.encode() if isinstance(secret, str) else secret
+
+
+def proof(secret, challenge, worker):
+    return hmac.new(secret, f"{challenge}:{worker}".encode(), hashlib.sha256).hexdigest()
+
+
+def is_unix(address):
+    return '/' in address
+
+
+async def connect(address):
+    if is_unix(address):
+        return await asyncio.open_unix_connection(address)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+
+async def listen(address, handler):
+    if is_unix(address):
+        if os.path.exists(address):
+            os.remove(address)
+        return await asyncio.start_unix_server(handler, address)
+    host, port = address.rsplit(':', 1)
+    return await asyncio.start_server(handler, host, int(port))
+
+
+# what a worker can do with an account's client. results have to be json
+
+async def upload(lens, text, metadata_id=None, media=None):
+    from media import Media
+    return await lens.get_post_context_arid(text, metadata_id, [Media.from_dict(item) for item in media or ()])
+
+
+async def relay(lens, arid, text):
+    relayed = await lens.relay_post(arid, text)
+    return {"tx_hash": relayed.tx_hash, "tx_id": relayed.tx_id, "reason": relayed.reason}
+
+
+CALLS = {
+    "post": lambda lens, text: lens.post(text),
+    "upload": upload,
+    "relay": relay,
+    "like": lambda lens, publication_id: lens.like(publication_id),
+    "mirror": lambda lens, publication_id: lens.mirror(publication_id),
+    "follow": lambda lens, user_handle: lens.follow(user_handle),
+}
+
+
+class WorkerConnection:
+    def __init__(self, name, writer, accounts=()):
+        self.name = name
+        self.writer = writer
+        # the addresses it has keys for
+        self.accounts = set(accounts)
+        self.last_seen = time.monotonic()
+        self.pending = {}
+
+
+class Coordinator:
+    def __init__(self, address, secret=None, heartbeat_timeout=15, call_timeout=120, replicas=100, hello_timeout=10):
+        # workers that were not heard from for heartbeat_timeout seconds count as gone.
+        # secret is SHARD_SECRET when None, there is no coordinator without one
+        self.address = address
+        self.secret = shard_secret(secret)
+        self.hello_timeout = hello_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.call_timeout = call_timeout
+        self.ring = HashRing(replicas=replicas)
+        self.workers = {}
+        # address -> names of the workers with its key
+        self.holders = {}
+        self.server = None
+        self.checker = None
+        self.handlers = set()
+        self.next_id = 0
+        self.changed = asyncio.Event()
+        self.calls = 0
+        self.handoffs = 0
+
+    async def start(self):
+        self.server = await listen(self.address, self.connected)
+        self.checker = asyncio.ensure_future(self.check_heartbeats())
+        return self
+
+    async def connected(self, reader, writer):
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            await self.serve(reader, writer)
+        finally:
+            self.handlers.discard(handler)
+
+    async def authenticate(self, reader, writer):
+        # the hello of the worker on the other end, None when it does not know the secret
+        challenge = os.urandom(16).hex()
+        try:
+            await send(writer, {"type": "challenge", "challenge": challenge})
+            hello = await asyncio.wait_for(receive(reader, max_size=1 << 20), self.hello_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            return None
+        if not isinstance(hello, dict) or hello.get("type") != "hello":
+            return None
+        name, given, accounts = hello.get("worker"), hello.get("proof"), hello.get("accounts")
+        if not isinstance(name, str) or not name or not isinstance(given, str):
+            return None
+        if not isinstance(accounts, list) or not all(isinstance(address, str) for address in accounts):
+            return None
+        if not hmac.compare_digest(given, proof(self.secret, challenge, name)):
+            print(f"shard worker {name} turned away, wrong secret")
+            return None
+        return hello
+
+    async def serve(self, reader, writer):
+        hello = await self.authenticate(reader, writer)
+        if hello is None:
+            writer.close()
+            return
+        worker = WorkerConnection(hello["worker"], writer, (address.lower() for address in hello["accounts"]))
+        old = self.workers.get(worker.name)
+        if old is not None:
+            # the same worker again, after a restart
+            self.leave(old, "replaced")
+        self.workers[worker.name] = worker
+        self.ring.add(worker.name)
+        for address in worker.accounts:
+            self.holders.setdefault(address, set()).add(worker.name)
+        print(f"shard worker {worker.name} joined, {len(self.workers)} workers")
+        await self.broadcast_members()
+        try:
+            while True:
+                message = await receive(reader)
+                if message is None:
+                    break
+                worker.last_seen = time.monotonic()
+                kind = message.get("type")
+                if kind == "result":
+                    future = worker.pending.pop(message["id"], None)
+                    if future is not None and not future.done():
+                        if message["ok"]:
+                            future.set_result(message.get("result"))
+                        elif message.get("sent") is False:
+                            future.set_exception(NotSent(message.get("error")))
+                        else:
+                            future.set_exception(ShardError(message.get("error")))
+                elif kind == "handoff":
+                    await self.forward_handoff(message["accounts"])
+        finally:
+            if self.workers.get(worker.name) is worker:
+                self.leave(worker, "disconnected")
+                await self.broadcast_members()
+
+    def leave(self, worker, reason):
+        del self.workers[worker.name]
+        self.ring.remove(worker.name)
+        for address in worker.accounts:
+            holders = self.holders.get(address)
+            if holders is not None:
+                holders.discard(worker.name)
+                if not holders:
+                    del self.holders[address]
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(ShardError(f"worker {worker.name} {reason} before answering"))
+        worker.pending.clear()
+        worker.writer.close()
+        print(f"shard worker {worker.name} {reason}, {len(self.workers)} workers")
+
+    async def broadcast_members(self):
+        members = sorted(self.workers)
+        self.changed.set()
+        self.changed = asyncio.Event()
+        for worker in list(self.workers.values()):
+            owned = [address for address in worker.accounts if self.owner(address) == worker.name]
+            try:
+                await send(worker.writer, {"type": "members", "members": members, "owned": owned})
+            except ConnectionError:
+                pass
+
+    async def forward_handoff(self, accounts):
+        # tokens of accounts a worker gave up, to each account's new owner
+        by_owner = {}
+        for address, session in accounts.items():
+            by_owner.setdefault(self.owner(address), {})[address] = session
+        for owner, owned in by_owner.items():
+            worker = self.workers.get(owner)
+            if worker is not None:
+                self.handoffs += len(owned)
+                await send(worker.writer, {"type": "handoff", "accounts": owned})
+
+    async def check_heartbeats(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_timeout / 3)
+            now = time.monotonic()
+            silent = [worker for worker in self.workers.values()
+                      if now - worker.last_seen > self.heartbeat_timeout]
+            for worker in silent:
+                self.leave(worker, "timed out")
+            if silent:
+                await self.broadcast_members()
+
+    async def wait_for_workers(self, count, timeout=30):
+        deadline = time.monotonic() + timeout
+        while len(self.workers) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise NotSent(f"{len(self.workers)} of {count} workers after {timeout}s")
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_for_owner(self, address, timeout=30):
+        # the name of the worker that owns address, once a worker with its key is up
+        deadline = time.monotonic() + timeout
+        while True:
+            owner = self.owner(address)
+            if owner is not None:
+                return owner
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise NotSent(f"no worker with the key of {address} after {timeout}s")
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def owner(self, address):
+        # None while no worker holds its key
+        holders = self.holders.get(address.lower())
+        return self.ring.owner(address, holders) if holders else None
+
+    async def call(self, address, method, *args):
+        # run method of CALLS for the account on the worker that owns it, returns its result.
+        # raises NotSent when the call never reached lens, ShardError when the worker went away
+        # meanwhile: then it may or may not have happened, which is why it is not sent again here
+        if method not in CALLS:
+            raise ValueError(f"unknown call {method!r}, expected one of {', '.join(CALLS)}")
+        # starting up, or between the last worker with the key leaving and the next joining
+        worker = self.workers[await self.wait_for_owner(address, self.call_timeout)]
+        self.next_id += 1
+        call_id = self.next_id
+        future = worker.pending[call_id] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+        try:
+            await send(worker.writer, {"type": "call", "id": call_id, "account": address, "method": method,
+                                       "args": list(args)})
+            return await asyncio.wait_for(future, self.call_timeout)
+        finally:
+            worker.pending.pop(call_id, None)
+
+    async def stop(self):
+        if self.checker is not None:
+            self.checker.cancel()
+        if self.server is not None:
+            self.server.close()
+        for worker in list(self.workers.values()):
+            self.leave(worker, "stopped")
+        # the connections end once the workers see theirs closed
+        if self.handlers:
+            await asyncio.wait(self.handlers, timeout=5)
+        if self.server is not None:
+            await self.server.wait_closed()
+
+
+class ShardWorker:
+    def __init__(self, name, coordinator_address, private_keys, secret=None, heartbeat=5, handoff_wait=1.0):
+        self.name = name
+        self.secret = shard_secret(secret)
+        self.coordinator_address = coordinator_address
+        self.private_keys = list(private_keys)
+        self.heartbeat = heartbeat
+        self.handoff_wait = handoff_wait
+        self.keys = {}
+        self.owned = set()
+        self.writer = None
+        self.tasks = set()
+        self.handled = 0
+
+    def accounts(self):
+        # address -> private key of every key this worker was given
+        from signing import address_of
+        return {address_of(private_key).lower(): private_key for private_key in self.private_keys}
+
+    async def run(self):
+        # serves until the coordinator goes away
+        loop = asyncio.get_running_loop()
+        self.keys = await loop.run_in_executor(None, self.accounts)
+        reader, self.writer = await self.connect()
+        challenge = await receive(reader)
+        if not challenge or challenge.get("type") != "challenge":
+            self.writer.close()
+            raise ShardError(f"no challenge from the coordinator at {self.coordinator_address}")
+        await send(self.writer, {"type": "hello", "worker": self.name, "accounts": sorted(self.keys),
+                                 "proof": proof(self.secret, challenge["challenge"], self.name)})
+        pinger = asyncio.ensure_future(self.ping())
+        try:
+            while True:
+                message = await receive(reader)
+                if message is None:
+                    return
+                kind = message.get("type")
+                if kind == "members":
+                    await self.rebalance(message["members"], message["owned"])
+                elif kind == "call":
+                    task = asyncio.ensure_future(self.handle_call(message))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+                elif kind == "handoff":
+                    self.adopt(message["accounts"])
+        finally:
+            pinger.cancel()
+            for task in list(self.tasks):
+                task.cancel()
+            self.writer.close()
+            from lens import Lens
+            await Lens.close_session()
+
+    async def connect(self, attempts=50):
+        # the coordinator may still be starting
+        for attempt in range(attempts):
+            try:
+                return await connect(self.coordinator_address)
+            except (ConnectionError, FileNotFoundError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(0.2)
+
+    async def ping(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await send(self.writer, {"type": "ping"})
+
+    async def rebalance(self, members, owned):
+        # owned is what the coordinator made ours out of our keys
+        from lens import Lens, _addresses, _clients
+        owned = set(owned) & set(self.keys)
+        lost = self.owned - owned
+        gained = owned - self.owned
+        self.owned = owned
+        # the api limits are for all of us together
+        Lens.scheduler.share_endpoints(1 / len(members))
+        # hand over the tokens of the accounts we give up, their new owner skips the login
+        sessions = {}
+        for address in lost:
+            lens = _clients.get(_addresses.get(self.keys[address]))
+            if lens is not None and lens.refresh_token is not None:
+                sessions[address] = {"access_token": lens.access_token, "refresh_token": lens.refresh_token,
+                                     "user_id": lens.user_id, "user_handle": lens.user_handle}
+        if sessions:
+            await send(self.writer, {"type": "handoff", "accounts": sessions})
+        if gained:
+            self.warm([self.keys[address] for address in gained])
+        print(f"shard worker {self.name}: {len(owned)} accounts, {len(gained)} gained, {len(lost)} given up")
+
+    def warm(self, private_keys):
+        # log the new accounts in ahead of their first call. tokens handed over by their old owner
+        # get handoff_wait seconds to arrive, WarmUp leaves the accounts that have them alone
+        from warmup import WarmUp
+
+        async def run():
+            await asyncio.sleep(self.handoff_wait)
+            await WarmUp(private_keys).run()
+
+        task = asyncio.ensure_future(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def adopt(self, sessions):
+        from lens import get_lens
+        for address, session in sessions.items():
+            private_key = self.keys.get(address)
+            if private_key is None:
+                continue
+            lens = get_lens(private_key)
+            if not lens.is_logged_in():
+                lens.set_tokens(session["access_token"], session["refresh_token"])
+                lens.user_id = session["user_id"]
+                lens.user_handle = session["user_handle"]
+
+    async def handle_call(self, message):
+        import aiohttp
+        from lens import NotExecuted, lens_client
+        sent = False
+        try:
+            private_key = self.keys.get(message["account"].lower())
+            if private_key is None:
+                raise NotSent(f"no key for {message['account']}")
+            lens = await lens_client(private_key)
+            if not lens.is_logged_in():
+                raise NotSent(f"login of {message['account']} failed")
+            sent = True
+            result = await CALLS[message["method"]](lens, *message["args"])
+            reply = {"type": "result", "id": message["id"], "ok": True, "result": result}
+        except Exception as e:
+            # what failed before the call, or never reached lens, is safe to make again
+            if isinstance(e, (aiohttp.ClientConnectorError, NotExecuted)):
+                sent = False
+            reply = {"type": "result", "id": message["id"], "ok": False, "sent": sent,
+                     "error": f"{type(e).__name__}: {e}"}
+        self.handled += 1
+        await send(self.writer, reply)
+
+
+def run_worker(name, coordinator_address, private_keys, environ=None, scheduler_options=None, secret=None):
+    # entry point of a worker process. scheduler_options replace the RequestScheduler defaults
+    os.environ.update(environ or {})
+    if scheduler_options is not None:
+        from lens import Lens
+        from scheduler import RequestScheduler
+        Lens.scheduler = RequestScheduler(**scheduler_options)
+    asyncio.run(ShardWorker(name, coordinator_address, private_keys, secret).run())
+
+
+def spawn_workers(count, coordinator_address, private_keys, environ=None, first=0, scheduler_options=None,
+                  secret=None):
+    # local worker processes, spawned so they do not inherit the sockets and sessions of this one
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(first, first + count):
+        process = context.Process(target=run_worker, args=(f"worker-{index}", coordinator_address, private_keys,
+                                                            environ, scheduler_options, secret), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def relay_result(data):
+    # the answer of a "relay" call as a RelayResult
+    return RelayResult(data["tx_hash"], data["tx_id"], data["reason"])
+
+
+def read_keys(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+if __name__ == '__main__':
+    # SHARD_SECRET=... python shard.py worker --name a --coordinator 10.0.0.1:7100 --keys keys.txt
+    parser = argparse.ArgumentParser()
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("--name", default=f"{os.uname().nodename}-{os.getpid()}")
+    parser.add_argument("--coordinator", required=True, help="host:port or the path of a unix socket")
+    parser.add_argument("--keys", required=True, help="file with one private key per line")
+    args = parser.parse_args()
+    from scheduler import limits_from_environ
+    run_worker(args.name, args.coordinator, read_keys(args.keys), scheduler_options=limits_from_environ() or None)
@@ -0,0 +1,67 @@
+import threading
+from functools import lru_cache
+
+# the two things lens needs from an ethereum key: its address, and a personal_sign signature of the
+# login challenge. `from web3 import Account` costs well over a second of imports for that, the
+# secp256k1 code of eth_keys (coincurve when it is installed) and keccak are a fraction of it,
+# and they are only imported the first time a key is used.
+
+_lock = threading.Lock()
+_keys = None
+_keccak = None
+
+
+def _backend():
+    global _keys, _keccak
+    if _keys is None:
+        with _lock:
+            if _keys is None:
+                from eth_hash.auto import keccak
+                from eth_keys import keys
+                _keccak = keccak
+                _keys = keys
+    return _keys, _keccak
+
+
+def _key_bytes(private_key):
+    # the forms Account.from_key takes: hex with or without 0x, bytes or an int
+    if isinstance(private_key, int):
+        return private_key.to_bytes(32, 'big')
+    if isinstance(private_key, (bytes, bytearray)):
+        return bytes(private_key)
+    hex_key = private_key[2:] if private_key[:2] in ('0x', '0X') else private_key
+    return bytes.fromhex(hex_key)
+
+
+@lru_cache(maxsize=1024)
+def _private_key(key_bytes):
+    # deriving the public key is most of the work when there is no coincurve, do it once per key
+    keys, _ = _backend()
+    return keys.PrivateKey(key_bytes)
+
+
+def checksum_address(address_bytes):
+    # eip-55: a hex digit is upper case where the keccak of the lower case address has a nibble >= 8
+    _, keccak = _backend()
+    hex_address = address_bytes.hex()
+    digest = keccak(hex_address.encode()).hex()
+    return '0x' + ''.join(char.upper() if int(nibble, 16) >= 8 else char
+                          for char, nibble in zip(hex_address, digest))
+
+
+def address_of(private_key):
+    # the checksummed address, the same as Account.from_key(private_key).address
+    _, keccak = _backend()
+    public_key = _private_key(_key_bytes(private_key)).public_key.to_bytes()
+    return checksum_address(keccak(public_key)[-20:])
+
+
+def sign_challenge(private_key, message):
+    # personal_sign (eip-191) of a text message, 0x + r, s, v with v 27 or 28, what
+    # Account.sign_message(encode_defunct(text=message)) gives.
+    # module level so a ProcessPoolExecutor can run it
+    _, keccak = _backend()
+    data = message.encode()
+    message_hash = keccak(b'\x19Ethereum Signed Message:\n' + str(len(data)).encode() + data)
+    signature = _private_key(_key_bytes(private_key)).sign_msg_hash(message_hash).to_bytes()
+    return '0x' + signature[:64].hex() + f"{signature[64] + 27:02x}"
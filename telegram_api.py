@@ -0,0 +1,188 @@
+import asyncio
+import hmac
+import time
+
+import aiohttp
+
+from lens import Lens
+from models import loads
+
+
+class TelegramError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # seconds telegram wants us to wait when we were too fast
+        self.retry_after = retry_after
+
+
+class TelegramBot:
+    # the few Bot API calls the bot needs, on the same pooled session as the Lens clients
+    def __init__(self, token, api_url='https://api.telegram.org'):
+        self.token = token
+        self.url = f"{api_url}/bot{token}/"
+        self.files_url = f"{api_url}/file/bot{token}/"
+
+    async def call(self, method, request_timeout=None, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        kwargs = {}
+        if request_timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=request_timeout)
+        async with Lens.get_session().post(self.url + method, json=params, **kwargs) as response:
+            data = await response.json()
+            if not data.get("ok"):
+                raise TelegramError(f"{method} failed: {data.get('description', response.status)}",
+                                    (data.get("parameters") or {}).get("retry_after"))
+            return data["result"]
+
+    async def get_updates(self, offset=None, timeout=30, limit=None):
+        # long poll, give the request a little longer than telegram holds it open
+        return await self.call("getUpdates", request_timeout=timeout + 10, offset=offset, limit=limit,
+                               timeout=timeout, allowed_updates=["message"])
+
+    async def set_webhook(self, url, secret_token=None, max_connections=None):
+        # telegram stops answering getUpdates and posts every update to url instead
+        return await self.call("setWebhook", url=url, secret_token=secret_token, max_connections=max_connections,
+                               allowed_updates=["message"])
+
+    async def delete_webhook(self):
+        return await self.call("deleteWebhook")
+
+    async def get_file(self, file_id):
+        # file_path for file_url, valid for an hour
+        return await self.call("getFile", file_id=file_id)
+
+    def file_url(self, file_path):
+        return self.files_url + file_path
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None):
+        return await self.call("sendMessage", chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id)
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        return await self.call("editMessageText", chat_id=chat_id, message_id=message_id, text=text)
+
+
+class StatusMessage:
+    def __init__(self, chat_id, reply_to_message_id=None, message_id=None):
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        # None until the message was sent
+        self.message_id = message_id
+        self.text = None
+        self.sent_text = None
+        self.final = False
+        self.task = None
+
+
+class StatusMessages:
+    # one message per request, edited as the request moves along.
+    # sends to a chat are at least `interval` seconds apart, telegram allows about one a second,
+    # and a message that changes several times meanwhile is only edited once, to its latest text.
+    #
+    #   replies = StatusMessages(bot)
+    #   replies.show(job_id, chat_id, "queued…", reply_to_message_id=message_id)
+    #   replies.show(job_id, chat_id, "posted", final=True)
+    def __init__(self, bot, interval=1.0, max_attempts=3, on_sent=None):
+        self.bot = bot
+        self.interval = interval
+        self.max_attempts = max_attempts
+        # on_sent(key, message_id) once a status message exists, to find it again after a restart
+        self.on_sent = on_sent
+        self.messages = {}
+        self.next_send = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    def show(self, key, chat_id, text, reply_to_message_id=None, message_id=None, final=False):
+        # set the text of the status message of key, sent in the background.
+        # message_id edits a message that already exists, final forgets key once the text is shown
+        message = self.messages.get(key)
+        if message is None:
+            message = self.messages[key] = StatusMessage(chat_id, reply_to_message_id, message_id)
+        elif message.message_id is None:
+            message.message_id = message_id
+        if message.text != message.sent_text:
+            # the text waiting to go out is replaced before anyone saw it
+            self.coalesced += 1
+        message.text = text
+        message.final = message.final or final
+        if message.task is None:
+            message.task = asyncio.ensure_future(self.deliver(key, message))
+        return message.task
+
+    async def wait_turn(self, chat_id):
+        now = time.monotonic()
+        turn = max(now, self.next_send.get(chat_id, 0))
+        self.next_send[chat_id] = turn + self.interval
+        if turn > now:
+            await asyncio.sleep(turn - now)
+
+    async def send(self, key, message, text):
+        if message.message_id is None:
+            sent = await self.bot.send_message(message.chat_id, text, message.reply_to_message_id)
+            message.message_id = sent['message_id']
+            if self.on_sent is not None:
+                self.on_sent(key, message.message_id)
+        else:
+            try:
+                await self.bot.edit_message_text(message.chat_id, message.message_id, text)
+            except TelegramError as e:
+                # the message already says this, after a restart for example
+                if 'not modified' not in str(e):
+                    raise
+        self.sent += 1
+
+    async def deliver(self, key, message):
+        attempts = 0
+        try:
+            while message.text != message.sent_text:
+                await self.wait_turn(message.chat_id)
+                text = message.text
+                try:
+                    await self.send(key, message, text)
+                except Exception as e:
+                    attempts += 1
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after:
+                        self.next_send[message.chat_id] = time.monotonic() + retry_after
+                    if attempts < self.max_attempts or retry_after:
+                        continue
+                    print(f"status message {key} in chat {message.chat_id} failed: {e}")
+                attempts = 0
+                message.sent_text = text
+        finally:
+            message.task = None
+            if message.final and message.text == message.sent_text:
+                del self.messages[key]
+
+    async def flush(self, timeout=None):
+        # wait for the texts that are not shown yet
+        tasks = [message.task for message in self.messages.values() if message.task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+
+async def serve_webhook(accept, secret_token, host="0.0.0.0", port=8443, path="/", max_body=16 * 1024 * 1024):
+    # the receiving end of set_webhook, returns the aiohttp runner, await runner.cleanup() to stop.
+    # accept(updates) gets a list and has stored them when it returns: the 200 tells telegram not to
+    # send them again, an exception answers 500 and telegram does. besides the one update telegram
+    # posts, a json array of updates is taken too, for replays and relays that batch a burst
+    from aiohttp import web
+    secret = secret_token.encode()
+
+    async def handler(request):
+        given = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+        if not hmac.compare_digest(given, secret):
+            return web.Response(status=401)
+        try:
+            body = loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        accept(body if isinstance(body, list) else [body])
+        return web.Response()
+
+    app = web.Application(client_max_size=max_body)
+    app.router.add_post(path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,78 @@
+import pytest
+
+from jobqueue import DONE, FAILED, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2, retry_delay=60)
+    yield queue
+    queue.close()
+
+
+def test_enqueue_drops_a_key_seen_before(queue):
+    first, new = queue.enqueue("post", {"text": "a"}, key="update-1")
+    assert new
+    assert queue.enqueue("post", {"text": "again"}, key="update-1") == (first, False)
+
+
+def test_group_runs_in_order(queue):
+    queue.enqueue("post", {"text": "a"}, group=1)
+    queue.enqueue("post", {"text": "b"}, group=1)
+    queue.enqueue("post", {"text": "c"}, group=2)
+    a = queue.claim()
+    c = queue.claim()
+    assert (a.args["text"], c.args["text"]) == ("a", "c")
+    # b waits while a runs
+    assert queue.claim() is None
+    queue.complete(a)
+    assert queue.claim().args["text"] == "b"
+
+
+def test_retry_keeps_the_group_waiting(queue):
+    queue.enqueue("post", {"text": "a"}, group=1)
+    queue.enqueue("post", {"text": "b"}, group=1)
+    a = queue.claim()
+    assert queue.fail(a, "timeout")
+    # a is back to pending with a delay, b must not overtake it
+    assert queue.claim() is None
+    queue.db.execute("update jobs set not_before = 0 where id = ?", (a.id,))
+    retried = queue.claim()
+    assert (retried.id, retried.attempts) == (a.id, 2)
+
+
+def test_failed_for_good_frees_the_group(queue):
+    queue.enqueue("post", {"text": "a"}, group=1)
+    queue.enqueue("post", {"text": "b"}, group=1)
+    a = queue.claim()
+    queue.fail(a, "first")
+    queue.db.execute("update jobs set not_before = 0 where id = ?", (a.id,))
+    assert not queue.fail(queue.claim(), "second")
+    assert queue.counts()[FAILED] == 1
+    assert queue.claim().args["text"] == "b"
+
+
+def test_checkpoint_and_recover(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    queue = JobQueue(path)
+    queue.enqueue("post", {"text": "a"}, group=1)
+    job = queue.claim()
+    job.state["arid"] = "arweave-id"
+    queue.checkpoint(job)
+    queue.close()
+    # the process died while a ran
+    queue = JobQueue(path)
+    assert queue.recovered == 1
+    job = queue.claim()
+    assert job.state == {"arid": "arweave-id"}
+    assert job.attempts == 2
+    queue.complete(job, "ok")
+    assert queue.counts() == {DONE: 1}
+    queue.close()
+
+
+def test_release_does_not_count_the_attempt(queue):
+    queue.enqueue("post", {"text": "a"})
+    job = queue.claim()
+    queue.release(job)
+    assert queue.claim().attempts == 1
@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+from lens import Lens
+from mockserver import STATE, STATS, start_server
+from operations import OPERATIONS
+
+
+@pytest.fixture
+def persisted(monkeypatch):
+    monkeypatch.setattr(Lens, "persisted_queries", True)
+    monkeypatch.setattr(Lens, "persisted_hashes", {})
+    monkeypatch.setattr(Lens, "persisted_unsupported", set())
+
+
+def recommended(mode, times, forget=False):
+    # asks a server in persisted_queries mode for the recommended profiles times over
+    async def go():
+        runner, url = await start_server(persisted_queries=mode)
+        lens = Lens("0x" + "11" * 32, login=False, url=url)
+        try:
+            answers = []
+            for _ in range(times):
+                if forget:
+                    runner.app[STATE].persisted.clear()
+                data = await lens.graphql_data("RecommendedProfiles", {})
+                answers.append(len(data["data"]["recommendedProfiles"]))
+            return answers, runner.app, url
+        finally:
+            await Lens.close_session()
+            await runner.cleanup()
+    return asyncio.run(go())
+
+
+def test_hash_only_once_the_server_has_the_query(persisted):
+    answers, app, url = recommended("apollo", 3)
+    assert answers == [10, 10, 10]
+    assert app[STATS]["requests"] == 3
+    assert app[STATS]["persisted_hits"] == 2
+    assert OPERATIONS["RecommendedProfiles"].sha256 in Lens.persisted_hashes[url]
+
+
+def test_forgotten_hash_sends_the_query_again(persisted):
+    answers, app, _ = recommended("apollo", 3, forget=True)
+    assert answers == [10, 10, 10]
+    # the first request carries the query, the others are turned away once
+    assert app[STATS]["requests"] == 5
+    assert app[STATS]["persisted_hits"] == 0
+
+
+@pytest.mark.parametrize("mode", ["unsupported", None])
+def test_server_without_persisted_queries_gets_plain_queries(persisted, mode):
+    answers, app, url = recommended(mode, 3)
+    assert answers == [10, 10, 10]
+    assert url in Lens.persisted_unsupported
+    # "unsupported" refuses the first request, a server that ignores the hash the second
+    assert app[STATS]["requests"] == 4
+
+
+def test_persisted_queries_are_per_server(persisted):
+    _, _, apollo_url = recommended("apollo", 2)
+    _, _, plain_url = recommended(None, 2)
+    assert apollo_url not in Lens.persisted_unsupported
+    assert plain_url in Lens.persisted_unsupported
+
+
+def pages(lens, contents):
+    # lens answers paginated queries with contents, one list of items per page
+    requests = []
+
+    @contextlib.asynccontextmanager
+    async def graphql(operation_name, variables, headers=None):
+        index = int(variables["request"].get("cursor", 0))
+        requests.append(index)
+        page = {"items": contents[index], "pageInfo": {"next": str(index + 1) if index + 1 < len(contents) else None}}
+        yield Answer(json.dumps({"data": {"followers": page}}).encode())
+
+    lens.graphql = graphql
+    return requests
+
+
+class Answer:
+    def __init__(self, body):
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+
+def walk(lens, **options):
+    async def go():
+        return [item async for item in lens.iter_pages("Followers", {"request": {}}, "followers", **options)]
+    return asyncio.run(go())
+
+
+def test_dropped_items_do_not_end_the_walk():
+    lens = Lens("0x" + "11" * 32, login=False)
+    requests = pages(lens, [[1, 2, None, None, None], [3, None, 4, 5], [6]])
+    assert walk(lens, max_items=4, convert=lambda item: item) == [1, 2, 3, 4]
+    assert requests == [0, 1]
+
+
+def test_walk_reads_every_page():
+    lens = Lens("0x" + "11" * 32, login=False)
+    requests = pages(lens, [[1, 2], [3], [4, 5]])
+    assert walk(lens) == [1, 2, 3, 4, 5]
+    assert walk(lens, max_items=3) == [1, 2, 3]
+    assert requests == [0, 1, 2, 0, 1]
@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import json
+
+import aiohttp
+import pytest
+
+import lensbot
+from jobqueue import JobQueue
+from lens import get_lens
+from lensbot import TelegramLens, message_media
+from mockserver import fake_jwt
+from models import RelayResult
+
+KEY = "0x" + "11" * 32
+
+
+class Replies:
+    def __init__(self):
+        self.shown = []
+
+    def show(self, key, chat_id, text, reply_to_message_id=None, message_id=None, final=False):
+        self.shown.append((text, final))
+
+
+@pytest.fixture
+def bot(tmp_path):
+    bot = TelegramLens(token="mock", private_key=KEY, reply_mode="reply")
+    bot.jobs = JobQueue(str(tmp_path / "jobs.sqlite"))
+    bot.replies = Replies()
+    bot.relays = 0
+
+    async def upload(text, metadata_id, media):
+        return "arweave-id"
+
+    bot.upload = upload
+    # logged in already, nothing talks to the api unless a test says so
+    lens = get_lens(KEY)
+    lens.set_tokens(fake_jwt(30 * 60), fake_jwt(7 * 24 * 60 * 60))
+    lens.user_id = "0x01"
+    yield bot
+    bot.jobs.close()
+
+
+def claim(bot):
+    bot.jobs.enqueue("post", {"text": "gm"}, context={"chat_id": 1, "message_id": 1}, group=1)
+    return bot.jobs.claim()
+
+
+def test_lost_relay_answer_is_not_sent_again(bot):
+    async def relay(arid, text, on_indexed):
+        bot.relays += 1
+        raise asyncio.TimeoutError()
+
+    bot.relay = relay
+    job = claim(bot)
+    with pytest.raises(asyncio.TimeoutError) as error:
+        asyncio.run(bot.run_job(job))
+    bot.jobs.fail(job, error.value)
+    bot.jobs.db.execute("update jobs set not_before = 0")
+    # the retry finds the marker the first attempt saved
+    result = asyncio.run(bot.run_job(bot.jobs.claim()))
+    assert bot.relays == 1
+    assert result["reason"] == "UNKNOWN"
+    assert bot.replies.shown[-1][1]
+
+
+def test_relay_that_never_connected_is_retried(bot):
+    async def relay(arid, text, on_indexed):
+        bot.relays += 1
+        if bot.relays == 1:
+            raise aiohttp.ClientConnectorError(None, OSError("connection refused"))
+        return RelayResult("0xab", "tx", None)
+
+    bot.relay = relay
+    job = claim(bot)
+    with pytest.raises(aiohttp.ClientConnectorError):
+        asyncio.run(bot.run_job(job))
+    result = asyncio.run(bot.run_job(job))
+    assert bot.relays == 2
+    assert result == {"tx_hash": "0xab", "tx_id": "tx", "reason": None}
+
+
+def test_login_that_timed_out_is_retried(bot, monkeypatch):
+    logins = []
+
+    async def lens_client(private_key):
+        logins.append(private_key)
+        if len(logins) == 1:
+            raise asyncio.TimeoutError()
+        return get_lens(private_key)
+
+    async def relay(arid, text, on_indexed):
+        bot.relays += 1
+        return RelayResult("0xab", "tx", None)
+
+    monkeypatch.setattr(lensbot, "lens_client", lens_client)
+    bot.relay = relay
+    job = claim(bot)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(bot.run_job(job))
+    assert not job.state.get("relaying")
+    result = asyncio.run(bot.run_job(job))
+    assert bot.relays == 1
+    assert result["reason"] is None
+
+
+class Answer:
+    def __init__(self, status, data):
+        self.status = status
+        self.body = json.dumps(data).encode()
+
+    async def read(self):
+        return self.body
+
+
+@pytest.mark.parametrize("turned_away", [
+    Answer(200, {"data": None, "errors": [{"message": "Rate limit exceeded"}]}),
+    Answer(429, {"errors": [{"message": "Too many requests"}]}),
+    Answer(401, {"errors": [{"message": "Unauthenticated"}]}),
+])
+def test_relay_the_api_turned_away_is_retried(bot, turned_away):
+    answers = [turned_away, Answer(200, {"data": {"createPostViaDispatcher": {"reason": "REJECTED"}}})]
+    lens = get_lens(KEY)
+
+    @contextlib.asynccontextmanager
+    async def graphql(operation_name, variables, headers=None):
+        yield answers.pop(0)
+
+    lens.graphql = graphql
+    try:
+        job = claim(bot)
+        with pytest.raises(lensbot.NotExecuted):
+            asyncio.run(bot.run_job(job))
+        assert not job.state.get("relaying")
+        result = asyncio.run(bot.run_job(job))
+    finally:
+        del lens.graphql
+    # the second answer is the dispatcher's, not "may or may not have gone out"
+    assert result["reason"] == "REJECTED"
+    assert answers == []
+
+
+class Updates:
+    # answers getUpdates with the lists of answers, then stops the bot
+    def __init__(self, bot, answers):
+        self.bot = bot
+        self.answers = list(answers)
+        self.offsets = []
+
+    async def get_updates(self, offset=None, timeout=30, limit=None):
+        self.offsets.append(offset)
+        if not self.answers:
+            self.bot.stopping.set()
+            return []
+        return self.answers.pop(0)
+
+
+def update(update_id, text="gm"):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": 1}, "text": text}}
+
+
+def test_poll_stores_updates_before_confirming_them(bot):
+    async def poll():
+        bot.stopping = asyncio.Event()
+        bot.bot = Updates(bot, [[update(5), update(6, "/start"), update(7)]])
+        await bot.poll()
+
+    asyncio.run(poll())
+    assert bot.offset == 8
+    assert bot.jobs.counts() == {"pending": 2}
+    # a command is confirmed without a job
+    assert [bot.jobs.claim().args["text"]] == ["gm"]
+
+
+def test_poll_does_not_confirm_updates_it_could_not_store(bot):
+    async def poll():
+        bot.stopping = asyncio.Event()
+        bot.bot = Updates(bot, [[update(5)]])
+        await bot.poll()
+
+    bot.jobs.close()
+    with pytest.raises(Exception):
+        bot.jobs.counts()
+    asyncio.run(poll())
+    assert bot.offset is None
+
+
+def test_documents_need_an_image_or_video_mime_type():
+    def document(**fields):
+        return message_media({"document": dict({"file_id": "a", "file_unique_id": "ua"}, **fields)})
+
+    assert document(mime_type="image/png")[0]["mime_type"] == "image/png"
+    assert document(mime_type="application/pdf") == []
+    assert document() == []
+    # videos and animations are mp4 unless they say otherwise
+    assert message_media({"video": {"file_id": "b", "file_unique_id": "ub"}})[0]["mime_type"] == "video/mp4"
@@ -0,0 +1,51 @@
+import asyncio
+
+from lens import Lens
+from media import MediaStore, MediaUploader
+from mockserver import STATS, add_file, start_server
+from telegram_api import TelegramBot
+
+
+def move(files, path=None):
+    # uploads the files of add_file(*file) one after the other, returns the uploader and the server's counters
+    async def go():
+        runner, url = await start_server()
+        for file in files:
+            add_file(runner.app, *file)
+        uploader = MediaUploader(TelegramBot("mock", url.rstrip("/")), MediaStore(path), upload_url=url + "ipfs/add")
+        try:
+            media = [await uploader.upload_telegram_file(file[1], f"unique-{file[1]}", "image/jpeg")
+                     for file in files]
+        finally:
+            uploader.store.close()
+            await Lens.close_session()
+            await runner.cleanup()
+        return media, uploader, runner.app[STATS]
+
+    return asyncio.run(go())
+
+
+def test_same_content_under_another_file_is_not_uploaded_again():
+    media, uploader, stats = move([(100000, "a"), (100000, "b", "a"), (100000, "c")])
+    assert stats["media_uploads"] == 2
+    assert media[1] is media[0]
+    assert media[2].sha256 != media[0].sha256
+    # b and c were the size of a, both were hashed before anything was uploaded
+    assert (uploader.reused, uploader.hash_downloads) == (1, 2)
+    assert uploader.store.for_file("unique-b") is media[0]
+
+
+def test_files_of_a_new_size_go_straight_up():
+    _, uploader, stats = move([(1000, "a"), (2000, "b")])
+    assert stats["media_uploads"] == 2
+    assert uploader.hash_downloads == 0
+
+
+def test_store_keeps_what_it_has_across_restarts(tmp_path):
+    path = str(tmp_path / "media.sqlite")
+    first, _, _ = move([(5000, "a")], path)
+    store = MediaStore(path)
+    assert store.for_file("unique-a").url == first[0].url
+    assert store.has_size(5000)
+    assert store.for_hash(first[0].sha256).url == first[0].url
+    store.close()
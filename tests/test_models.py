@@ -0,0 +1,29 @@
+from mockserver import profile, publication
+from models import Profile, Publication, feed_item, follower, following
+
+
+def test_views_read_what_the_constructor_takes():
+    data = profile(7)
+    view = Profile.from_data(data)
+    built = Profile(data["id"], data["handle"], data["name"], data["ownedBy"], data["stats"]["totalFollowers"],
+                    data["stats"]["totalFollowing"])
+    fields = ("id", "handle", "name", "owned_by", "total_followers", "total_following")
+    assert [getattr(view, field) for field in fields] == [getattr(built, field) for field in fields]
+    assert view.data is data
+
+
+def test_fields_missing_from_the_projection_are_none():
+    item = {"root": {"id": "0x01-0x01", "__typename": "Post"}}
+    post = feed_item(item)
+    assert (post.id, post.kind) == ("0x01-0x01", "Post")
+    assert (post.handle, post.content, post.upvotes) == (None, None, None)
+    assert Publication.from_data(None) is None
+
+
+def test_follow_edges():
+    edge = follower({"wallet": {"address": "0xabc", "defaultProfile": profile(3)}, "totalAmountOfTimesFollowed": 1})
+    assert (edge.address, edge.handle, edge.times) == ("0xabc", profile(3)["handle"], 1)
+    assert follower({"wallet": {"address": "0xdef", "defaultProfile": None}}).handle is None
+    edge = following({"profile": profile(4)})
+    assert edge.address == profile(4)["ownedBy"]
+    assert feed_item({"root": publication(2)}).id == publication(2)["id"]
@@ -0,0 +1,92 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+
+from mockserver import STATE, STATS, start_server
+from scheduler import RequestScheduler
+
+
+def scheduler():
+    return RequestScheduler(endpoint_rate=None, account_rate=None, max_retries=2, backoff_base=0.01)
+
+
+def send(idempotent, timeout=5, **server):
+    # (status or exception, requests the server got, requests the scheduler sent) of one request
+    async def go():
+        runner, url = await start_server(**server)
+        requests = scheduler()
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+                try:
+                    response = await requests.request(session, 'POST', url, idempotent=idempotent,
+                                                      json={"operationName": "Challenge", "query": "x"})
+                    response.release()
+                    outcome = response.status
+                except Exception as e:
+                    outcome = type(e)
+            return outcome, runner.app[STATS]["requests"], requests.requests
+        finally:
+            await runner.cleanup()
+    return asyncio.run(go())
+
+
+@pytest.mark.parametrize("status", [502, 503, 504])
+def test_server_errors_are_retried_for_queries_only(status):
+    assert send(True, error_rate=1.0, error_status=status) == (status, 3, 3)
+    assert send(False, error_rate=1.0, error_status=status) == (status, 1, 1)
+
+
+def test_timeouts_are_retried_for_queries_only():
+    assert send(True, timeout=0.1, latency=0.3) == (asyncio.TimeoutError, 3, 3)
+    assert send(False, timeout=0.1, latency=0.3) == (asyncio.TimeoutError, 1, 1)
+
+
+@pytest.mark.parametrize("idempotent", [True, False])
+def test_connector_errors_are_retried_for_everything(idempotent):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        url = f"http://127.0.0.1:{probe.getsockname()[1]}/"
+
+    async def go():
+        requests = scheduler()
+        async with aiohttp.ClientSession() as session:
+            with pytest.raises(aiohttp.ClientConnectorError):
+                await requests.request(session, 'POST', url, idempotent=idempotent, data=b"{}")
+        return requests.requests
+
+    assert asyncio.run(go()) == 3
+
+
+def test_too_many_requests_pauses_the_whole_endpoint():
+    async def go():
+        # the mock answers 429 with Retry-After: 1
+        runner, url = await start_server(error_rate=1.0, error_status=429)
+        requests = scheduler()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def one(account):
+                    start = time.monotonic()
+                    response = await requests.request(session, 'POST', url, account=account, idempotent=False,
+                                                      json={"operationName": "Challenge", "query": "x"})
+                    response.release()
+                    return response.status, time.monotonic() - start
+
+                first = asyncio.ensure_future(one("a"))
+                while runner.app[STATS]["errors"] < 1:
+                    await asyncio.sleep(0.01)
+                runner.app[STATE].error_rate = 0.0
+                assert requests.stats()["paused_endpoints"] == [url.split("/")[2]]
+                # another account on the same endpoint waits out the pause too
+                second = await one("b")
+                return await first, second
+        finally:
+            await runner.cleanup()
+
+    (first_status, first_took), (second_status, second_took) = asyncio.run(go())
+    # a 429 was not handled, so even a mutation is sent again
+    assert (first_status, second_status) == (200, 200)
+    assert first_took >= 0.9
+    assert second_took >= 0.8
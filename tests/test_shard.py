@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from shard import Coordinator, HashRing, NotSent, ShardError, ShardWorker, proof, receive, send
+
+SECRET = "s3cret"
+
+
+def hello(challenge, name="a", accounts=(), secret=SECRET):
+    return {"type": "hello", "worker": name, "accounts": list(accounts),
+            "proof": proof(secret.encode(), challenge, name)}
+
+
+async def connect(path, make_hello):
+    # a worker's end of the connection, after its hello and the coordinator's first answer
+    reader, writer = await asyncio.open_unix_connection(path)
+    challenge = await receive(reader)
+    await send(writer, make_hello(challenge["challenge"]))
+    return reader, writer, await asyncio.wait_for(receive(reader), 2)
+
+
+def join(make_hello):
+    # what the coordinator makes of a worker that answers its challenge with make_hello(challenge)
+    async def go(path):
+        coordinator = await Coordinator(path, SECRET, hello_timeout=1).start()
+        try:
+            _, writer, answer = await connect(path, make_hello)
+            writer.close()
+            return answer, dict(coordinator.workers)
+        finally:
+            await coordinator.stop()
+    return go
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "shard.sock")
+
+
+def test_worker_with_the_secret_joins(path):
+    answer, workers = asyncio.run(join(lambda challenge: hello(challenge, accounts=["0xAB"]))(path))
+    assert answer["type"] == "members"
+    assert answer["owned"] == ["0xab"]
+    assert list(workers) == ["a"]
+
+
+@pytest.mark.parametrize("make_hello", [
+    lambda challenge: hello(challenge, secret="wrong"),
+    lambda challenge: hello("old"),
+    lambda challenge: dict(hello(challenge), worker="b"),
+    lambda challenge: {"type": "hello"},
+    lambda challenge: dict(hello(challenge), worker=["a"]),
+    lambda challenge: dict(hello(challenge), accounts="0xab"),
+    lambda challenge: ["hello"],
+])
+def test_anything_else_is_turned_away(path, make_hello):
+    answer, workers = asyncio.run(join(make_hello)(path))
+    assert answer is None
+    assert workers == {}
+
+
+def test_secret_is_required(monkeypatch):
+    monkeypatch.delenv("SHARD_SECRET", raising=False)
+    with pytest.raises(ShardError):
+        Coordinator("/tmp/unused.sock")
+    with pytest.raises(ShardError):
+        ShardWorker("a", "/tmp/unused.sock", [])
+
+
+def test_ring_owner_among_some_workers():
+    ring = HashRing(["a", "b", "c"])
+    addresses = [f"0x{index:040x}" for index in range(200)]
+    assert {ring.owner(address) for address in addresses} == {"a", "b", "c"}
+    # leaving a worker out moves only what it owned
+    for address in addresses:
+        owner = ring.owner(address, {"a", "b"})
+        assert owner == ring.owner(address) or ring.owner(address) == "c"
+    assert ring.owner(addresses[0], set()) is None
+
+
+def test_accounts_go_to_workers_with_their_key(path):
+    shared = [f"0x{index:040x}" for index in range(50)]
+
+    async def go():
+        coordinator = await Coordinator(path, SECRET, call_timeout=0.2).start()
+        try:
+            _, a, _ = await connect(path, lambda challenge: hello(challenge, "a", shared + ["0xaa"]))
+            _, b, _ = await connect(path, lambda challenge: hello(challenge, "b", shared + ["0xbb"]))
+            owners = {coordinator.owner(address) for address in shared}
+            assert owners == {"a", "b"}
+            assert (coordinator.owner("0xAA"), coordinator.owner("0xbb")) == ("a", "b")
+            with pytest.raises(NotSent):
+                await coordinator.call("0xcc", "like", "0x01-0x01")
+            a.close()
+            b.close()
+        finally:
+            await coordinator.stop()
+
+    asyncio.run(go())
+
+
+def test_calls_a_worker_did_not_make_are_not_sent(path):
+    async def go():
+        coordinator = await Coordinator(path, SECRET).start()
+        try:
+            reader, writer, _ = await connect(path, lambda challenge: hello(challenge, accounts=["0xaa"]))
+
+            async def answer(**result):
+                call = await receive(reader)
+                await send(writer, dict(result, type="result", id=call["id"], ok=False, error="no"))
+
+            for result, error in (({"sent": False}, NotSent), ({"sent": True}, ShardError)):
+                answering = asyncio.ensure_future(answer(**result))
+                with pytest.raises(error) as raised:
+                    await coordinator.call("0xaa", "like", "0x01-0x01")
+                await answering
+                assert (type(raised.value) is NotSent) == (error is NotSent)
+            writer.close()
+        finally:
+            await coordinator.stop()
+
+    asyncio.run(go())
+
+
+class Writer:
+    def __init__(self):
+        self.sent = []
+
+    def write(self, data):
+        self.sent.append(data)
+
+    async def drain(self):
+        pass
+
+
+def test_worker_without_the_key_says_it_did_not_send():
+    async def go():
+        worker = ShardWorker("a", "/tmp/unused.sock", [], secret=SECRET)
+        worker.writer = Writer()
+        await worker.handle_call({"id": 1, "account": "0xaa", "method": "like", "args": ["0x01-0x01"]})
+        return worker.writer.sent
+
+    sent = asyncio.run(go())
+    assert b'"sent":false' in sent[0]
+    assert b"no key for 0xaa" in sent[0]
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+from batching import GraphQLBatcher
+
+
+# one background poller for every relayed transaction (posts, mirrors) and proxy action (follows).
+# each round asks about all pending transactions in a few batched requests, polls quickly while
+# things are getting indexed and backs off while nothing changes.
+
+class TxStatus:
+    def __init__(self, key, tx_id=None, tx_hash=None, proxy_action_id=None):
+        self.key = key
+        self.tx_id = tx_id
+        self.tx_hash = tx_hash
+        self.proxy_action_id = proxy_action_id
+        # None while pending, then True or False
+        self.indexed = None
+        self.reason = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def __repr__(self):
+        state = {None: 'pending', True: 'indexed', False: f'failed: {self.reason}'}[self.indexed]
+        return f"<tx {self.tx_hash or self.key} {state}>"
+
+
+class PendingTx:
+    def __init__(self, lens, status, future):
+        self.lens = lens
+        self.status = status
+        self.future = future
+        self.callbacks = []
+
+
+class TxTracker:
+    def __init__(self, min_interval=2, max_interval=30, batch_size=50, timeout=600):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.batcher = GraphQLBatcher(window=0.005, max_batch=batch_size)
+        self.pending = {}
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.task = None
+        self.wakeup = None
+        self.polls = 0
+
+    def track(self, lens, tx_id=None, tx_hash=None, proxy_action_id=None, callback=None):
+        # future resolving to a TxStatus once the transaction is indexed, failed or timed out.
+        # callback(status) is called at the same time
+        key = proxy_action_id or tx_id or tx_hash
+        entry = self.pending.get(key)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = self.pending[key] = PendingTx(lens, TxStatus(key, tx_id, tx_hash, proxy_action_id),
+                                                  loop.create_future())
+            # a new transaction needs a look soon, even if the poller has backed off
+            self.interval = self.min_interval
+            deadline = loop.time() + self.min_interval
+            if self.task is None or self.task.done():
+                self.next_poll = deadline
+                self.wakeup = asyncio.Event()
+                self.task = asyncio.ensure_future(self.run())
+            elif deadline < self.next_poll:
+                self.next_poll = deadline
+                self.wakeup.set()
+        if callback is not None:
+            entry.callbacks.append(callback)
+        return entry.future
+
+    def finish(self, entry, indexed, reason=None):
+        status = entry.status
+        status.indexed = indexed
+        status.reason = reason
+        status.finished = time.monotonic()
+        del self.pending[status.key]
+        if not entry.future.done():
+            entry.future.set_result(status)
+        for callback in entry.callbacks:
+            try:
+                callback(status)
+            except Exception as e:
+                print(f"tx {status.key} callback failed: {e}")
+
+    async def check(self, entry):
+        # one status query, the batcher merges the queries of a round into few requests
+        status = entry.status
+        lens = entry.lens
+        if status.proxy_action_id is not None and status.tx_hash is None:
+            data = await self.batcher.execute(lens, "ProxyActionStatus", {"proxyActionId": status.proxy_action_id},
+                                              lens.headers_with_access_token or lens.headers)
+            result = (data.get('data') or {}).get('proxyActionStatus') or {}
+            if result.get('__typename') == 'ProxyActionError':
+                return self.finish(entry, False, result.get('reason'))
+            if result.get('status') == 'COMPLETE':
+                status.tx_id = result.get('txId')
+                status.tx_hash = result.get('txHash')
+                return self.finish(entry, True)
+            return None
+        request = {"txHash": status.tx_hash} if status.tx_id is None else {"txId": status.tx_id}
+        data = await self.batcher.execute(lens, "HasTxHashBeenIndexed", {"request": request}, lens.headers)
+        result = (data.get('data') or {}).get('hasTxHashBeenIndexed') or {}
+        if result.get('__typename') == 'TransactionError':
+            return self.finish(entry, False, result.get('reason'))
+        if result.get('indexed'):
+            status.tx_hash = result.get('txHash') or status.tx_hash
+            return self.finish(entry, True)
+        return None
+
+    async def poll_once(self):
+        # returns how many transactions were settled this round
+        self.polls += 1
+        entries = list(self.pending.values())
+        before = len(self.pending)
+        results = await asyncio.gather(*(self.check(entry) for entry in entries), return_exceptions=True)
+        for entry, result in zip(entries, results):
+            if isinstance(result, Exception):
+                # stays pending, the next round asks again
+                print(f"tx {entry.status.key} status check failed: {result}")
+            if entry.status.key in self.pending and entry.status.elapsed > self.timeout:
+                self.finish(entry, False, 'timed out')
+        return before - len(self.pending)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            delay = self.next_poll - loop.time()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            settled = await self.poll_once()
+            # quick rounds while things settle, slower and slower while nothing happens
+            self.interval = self.min_interval if settled else min(self.max_interval, self.interval * 2)
+            self.next_poll = loop.time() + self.interval
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
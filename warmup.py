@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+from lens import get_lens, sign_challenge
+
+
+# log many accounts in at once. challenges and authentication run side by side with at most
+# `concurrency` requests in flight, signing runs in an executor so it never stalls the loop,
+# and every account is usable the moment its own login is done.
+#
+#   warmup = WarmUp(keys, executor=ProcessPoolExecutor()).start()
+#   lens = await warmup.wait(key)            # this account only
+#   async for status in WarmUp(keys):        # or as they come in
+#       print(status)
+
+
+class AccountStatus:
+    def __init__(self, private_key, lens=None, error=None, elapsed=0.0):
+        self.private_key = private_key
+        self.lens = lens
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ready(self):
+        return self.error is None and self.lens is not None
+
+    def __repr__(self):
+        name = self.lens.user_handle or self.lens.address if self.lens is not None else 'unknown account'
+        state = 'ready' if self.ready else f'failed: {self.error}'
+        return f"<{name} {state} {self.elapsed * 1000:.0f}ms>"
+
+
+class WarmUp:
+    def __init__(self, private_keys, concurrency=32, executor=None):
+        # executor signs the challenges, None keeps Lens.signing_executor
+        self.private_keys = list(dict.fromkeys(private_keys))
+        self.concurrency = concurrency
+        self.executor = executor
+        self.statuses = {}
+        self.futures = {}
+        self.finished = asyncio.Queue()
+        self.task = None
+
+    async def login(self, private_key, in_flight):
+        start = time.perf_counter()
+        try:
+            lens = get_lens(private_key)
+        except Exception as e:
+            return AccountStatus(private_key, error=e, elapsed=time.perf_counter() - start)
+        try:
+            if not lens.is_logged_in() and lens.refresh_token is not None:
+                # a token refresh needs no signature
+                async with in_flight:
+                    await lens.ensure_login()
+            if not lens.is_logged_in():
+                # the same lock as ensure_login, a bot serving this account meanwhile waits for us
+                async with lens._login_lock:
+                    if not lens.is_logged_in():
+                        async with in_flight:
+                            message = await lens.get_message_for_signature()
+                        if not message:
+                            raise RuntimeError("no challenge")
+                        # outside the request limit, the executor bounds the signing
+                        loop = asyncio.get_running_loop()
+                        with lens.metrics.timer("lens_sign"):
+                            signature = await loop.run_in_executor(self.executor or lens.signing_executor,
+                                                                   sign_challenge, lens.private_key, message)
+                        async with in_flight:
+                            await lens.get_profile(signature)
+            if not lens.is_logged_in():
+                raise RuntimeError("login failed")
+        except Exception as e:
+            return AccountStatus(private_key, lens, e, time.perf_counter() - start)
+        return AccountStatus(private_key, lens, elapsed=time.perf_counter() - start)
+
+    async def run(self):
+        # logs every account in, returns the statuses in the order of private_keys
+        self.prepare()
+        in_flight = asyncio.Semaphore(self.concurrency)
+
+        async def one(private_key):
+            status = await self.login(private_key, in_flight)
+            self.statuses[private_key] = status
+            self.futures[private_key].set_result(status)
+            self.finished.put_nowait(status)
+
+        await asyncio.gather(*(one(private_key) for private_key in self.private_keys))
+        return [self.statuses[private_key] for private_key in self.private_keys]
+
+    def prepare(self):
+        if not self.futures:
+            loop = asyncio.get_running_loop()
+            self.futures = {private_key: loop.create_future() for private_key in self.private_keys}
+
+    def start(self):
+        # log in in the background, use wait() or iterate to pick accounts up as they get ready
+        self.prepare()
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def wait(self, private_key):
+        # the logged in client, raises the login error
+        self.start()
+        if private_key not in self.futures:
+            raise KeyError("not one of the accounts being warmed up")
+        status = await asyncio.shield(self.futures[private_key])
+        if not status.ready:
+            raise RuntimeError(f"login failed: {status.error}")
+        return status.lens
+
+    def progress(self):
+        ready = sum(status.ready for status in self.statuses.values())
+        return {"ready": ready, "failed": len(self.statuses) - ready,
+                "pending": len(self.private_keys) - len(self.statuses)}
+
+    async def __aiter__(self):
+        # statuses in the order the logins finish
+        self.start()
+        for _ in self.private_keys:
+            yield await self.finished.get()